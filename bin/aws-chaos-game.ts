@@ -51,7 +51,7 @@ new AwsChaosGameIotStack(app, `AwsChaosGameIotStack`, {
     region: process.env.CDK_DEFAULT_REGION
   },
   prefix: prefix,
-  fisStateMachine: fisStack.stateMachine,
+  admissionQueue: fisStack.admissionQueue,
   tags: {
     Project: prefix,
   }
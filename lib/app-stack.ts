@@ -22,16 +22,19 @@ export class AwsChaosGameAppStack extends Stack {
     this.removalPolicy = props.removalPolicy || RemovalPolicy.DESTROY;
 
     // DynamoDB Table to store the experiment results
-    this.scoreTable = new ChaosGameDynamodbTable(this, 'FisExperimentTable', {
+    const scoreTable = new ChaosGameDynamodbTable(this, 'FisExperimentTable', {
       prefix: this.prefix,
       removalPolicy: this.removalPolicy,
-    }).table;
+    });
+    this.scoreTable = scoreTable.table;
 
     this.webApp = new ChaosGameWebApp(this, 'Web', {
       prefix: this.prefix,
       removalPolicy: this.removalPolicy,
       scoreTableName: this.scoreTable.tableName,
       scoreTableArn: this.scoreTable.tableArn,
+      scoreTableStreamArn: this.scoreTable.tableStreamArn,
+      leaderboardIndexName: scoreTable.leaderboardIndexName,
     });
   }
 }
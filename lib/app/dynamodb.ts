@@ -1,6 +1,6 @@
 import { Construct } from 'constructs';
 import { RemovalPolicy } from 'aws-cdk-lib';
-import { Table, ITable, AttributeType, BillingMode } from 'aws-cdk-lib/aws-dynamodb';
+import { Table, ITable, AttributeType, BillingMode, ProjectionType, StreamViewType } from 'aws-cdk-lib/aws-dynamodb';
 
 export interface ChaosGameDynamodbTableProps {
   readonly prefix: string;
@@ -11,18 +11,34 @@ export class ChaosGameDynamodbTable extends Construct {
   public readonly prefix: string;
   public readonly table: ITable;
   public readonly partitionKey: string;
+  public readonly leaderboardIndexName: string;
 
   constructor(scope: Construct, id: string, props: ChaosGameDynamodbTableProps) {
     super(scope, id);
 
     this.prefix = props.prefix;
     this.partitionKey = 'pk';
+    this.leaderboardIndexName = 'leaderboard';
 
-    this.table = new Table(this, 'Table', {
+    const table = new Table(this, 'Table', {
       tableName: `${this.prefix}-fis-experiments`,
       billingMode: BillingMode.PAY_PER_REQUEST,
       partitionKey: { name: this.partitionKey, type: AttributeType.STRING },
+      // Expiration of the experiment records
+      timeToLiveAttribute: 'expiresAt',
+      // The changes of the items, from which the web application pushes the score to the browsers when it changes
+      stream: StreamViewType.KEYS_ONLY,
       removalPolicy: props.removalPolicy,
     });
+    // The leaderboard counters of the devices and players, by board and number of games won. Only the counter items
+    // have a board attribute, so only they are in the index
+    table.addGlobalSecondaryIndex({
+      indexName: this.leaderboardIndexName,
+      partitionKey: { name: 'board', type: AttributeType.STRING },
+      sortKey: { name: 'won', type: AttributeType.NUMBER },
+      projectionType: ProjectionType.INCLUDE,
+      nonKeyAttributes: ['name', 'lost'],
+    });
+    this.table = table;
   }
 }
\ No newline at end of file
@@ -116,6 +116,15 @@ export class ChaosGameWebAppNetwork extends Construct {
       }]
     });
 
+    // Add the DynamoDB Streams endpoint for the application to follow the changes of the score, the gateway endpoint
+    // of DynamoDB does not serve the streams
+    this.vpc.addInterfaceEndpoint('DynamoDbStreamsEndpoint', {
+      service: new InterfaceVpcEndpointAwsService('dynamodb-streams'),
+      subnets: {
+        subnetType: SubnetType.PRIVATE_ISOLATED,
+      },
+    });
+
     // Add DynamoDB Gateway Endpoint
     this.vpc.addGatewayEndpoint('DynamoDbEndpoint', {
       service: GatewayVpcEndpointAwsService.DYNAMODB,
@@ -6,6 +6,7 @@ import { Runtime, Code, SingletonFunction } from 'aws-cdk-lib/aws-lambda';
 import { RetentionDays } from 'aws-cdk-lib/aws-logs';
 import { Repository, TagMutability, IRepository } from 'aws-cdk-lib/aws-ecr';
 import { DockerImageAsset, Platform } from 'aws-cdk-lib/aws-ecr-assets';
+import { chaosGameRuntimeLayer } from '../chaos/lambda';
 import * as ecrdeploy from 'cdk-ecr-deployment';
 import * as webappConfig from '../../webapp-config.json';
 
@@ -34,10 +35,12 @@ export class cleanupEcrRepo extends Construct {
       uuid: '54gf6lx0-r58g-88j5-d44t-l40cef953pqn',
       code: Code.fromAsset('resources/lambdas/cleanup_ecr'),
       handler: 'main.lambda_handler',
+      layers: [chaosGameRuntimeLayer(this)],
       environment: {
         ECR_REPOSITORY_NAME: props.ecrRepositoryName,
+        DELETE_WORKERS: '4',
       },
-      timeout: Duration.seconds(60),
+      timeout: Duration.minutes(5),
       runtime: Runtime.PYTHON_3_9,
       logRetention: RetentionDays.ONE_WEEK,
     });
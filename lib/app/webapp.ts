@@ -31,6 +31,9 @@ export interface ChaosGameWebAppProps {
   readonly vpcCider?: string;
   readonly scoreTableName: string;
   readonly scoreTableArn: string;
+  // The stream of the table, from which the score is pushed to the browsers. It is read at an interval when not set
+  readonly scoreTableStreamArn?: string;
+  readonly leaderboardIndexName: string;
 }
 
 export class ChaosGameWebApp extends Construct {
@@ -115,15 +118,25 @@ export class ChaosGameWebApp extends Construct {
       managedPolicyArn: 'arn:aws:iam::aws:policy/AWSXRayDaemonWriteAccess'
     });
 
-    // Create policy to give GetIem right on the DynamoDB table the app task
+    // Create policy to give the right to read the score items of the DynamoDB table to the app task
     const dynamodbPolicy = new Policy(this, 'DdbReadPolicy', {
       policyName: `${this.prefix}-app-dynamodb-policy`,
       statements: [
         new PolicyStatement({
           effect: Effect.ALLOW,
-          actions: ['dynamodb:GetItem'],
+          actions: ['dynamodb:GetItem', 'dynamodb:BatchGetItem'],
           resources: [props.scoreTableArn],
         }),
+        new PolicyStatement({
+          effect: Effect.ALLOW,
+          actions: ['dynamodb:Query'],
+          resources: [`${props.scoreTableArn}/index/${props.leaderboardIndexName}`],
+        }),
+        ...(props.scoreTableStreamArn ? [new PolicyStatement({
+          effect: Effect.ALLOW,
+          actions: ['dynamodb:DescribeStream', 'dynamodb:GetShardIterator', 'dynamodb:GetRecords'],
+          resources: [props.scoreTableStreamArn],
+        })] : []),
       ],
     });
     dynamodbPolicy.attachToRole(appTaskRole);
@@ -161,6 +174,11 @@ export class ChaosGameWebApp extends Construct {
       environment: {
         AWS_REGION: stack.region,
         TABLE_NAME: props.scoreTableName,
+        SCORE_SHARDS: webappConfig.score.shards.toString(),
+        SCORE_CACHE_TTL_MS: webappConfig.score.cacheTtlMs.toString(),
+        LEADERBOARD_INDEX_NAME: props.leaderboardIndexName,
+        ...(props.scoreTableStreamArn ? { SCORE_STREAM_ARN: props.scoreTableStreamArn } : {}),
+        SCORE_STREAM_POLL_MS: webappConfig.score.streamPollMs.toString(),
       },
       logging: new AwsLogDriver({
         logGroup: webAppLogGroup,
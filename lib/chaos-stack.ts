@@ -1,10 +1,15 @@
 import { Construct } from 'constructs';
 import { Stack, StackProps, RemovalPolicy } from 'aws-cdk-lib';
 import { StateMachine } from 'aws-cdk-lib/aws-stepfunctions';
+import { IQueue } from 'aws-cdk-lib/aws-sqs';
+import { IBucket } from 'aws-cdk-lib/aws-s3';
 import { AwsChaosGameAppStack } from './app-stack';
 import { ChaosGameFis } from './chaos/fis';
 import { ChaosGameFisStateMachine } from "./chaos/state-machine";
 import { ChaosGameCwAlarm } from "./chaos/cloudwatch";
+import { ChaosGameAdmission } from "./chaos/admission";
+import { ChaosGameHistory } from "./chaos/history";
+import * as webappConfig from '../webapp-config.json';
 
 export interface AwsChaosGameFisStackProps extends StackProps {
   readonly prefix: string;
@@ -17,6 +22,8 @@ export class AwsChaosGameFisStack extends Stack {
   public readonly removalPolicy: RemovalPolicy;
   public readonly fis: ChaosGameFis;
   public readonly stateMachine: StateMachine;
+  public readonly admissionQueue: IQueue;
+  public readonly historyBucket: IBucket;
 
   constructor(scope: Construct, id: string, props: AwsChaosGameFisStackProps) {
     super(scope, id, props);
@@ -37,13 +44,45 @@ export class AwsChaosGameFisStack extends Stack {
       stopAlarm: alarm,
     });
 
+    // The endpoints probed during the experiments, one per tier of the application: Nginx answers its health check
+    // itself, the static assets are served by the app without DynamoDB, the leaderboard is read from DynamoDB. Other
+    // deployments, e.g. in other regions, can be added in webapp-config.json
+    const loadBalancerUrl = `http://${props.app.webApp.loadBalancer.loadBalancerDnsName}`;
+    const appUrl = `${loadBalancerUrl}${props.app.webApp.appPath}`;
+    const probeTargets: { [name: string]: string } = {
+      app: appUrl,
+      nginx: `${loadBalancerUrl}${webappConfig.nginx.healthCheckPath}`,
+      static: `${appUrl}/css/style.css`,
+      data: `${appUrl}/leaderboard?by=device&period=day&top=1`,
+      ...webappConfig.probe.extraTargets,
+    };
+
+    // Keep the history of the games, archived by the FIS state machine, to query months of experiments offline
+    const history = new ChaosGameHistory(this, 'History', {
+      prefix: this.prefix,
+      removalPolicy: this.removalPolicy,
+    });
+    this.historyBucket = history.bucket;
+
     // Create the FIS state machine to start and monitor a FIS experiment
     const fisStateMachine = new ChaosGameFisStateMachine(this, 'FisStateMachine', {
       prefix: this.prefix,
       removalPolicy: this.removalPolicy,
       scoreTable: scoreTable,
-      appUrl: `http://${props.app.webApp.loadBalancer.loadBalancerDnsName}${props.app.webApp.appPath}`,
+      appUrl: appUrl,
+      probeTargets: probeTargets,
+      archiveFunction: history.archiveFunction,
     });
     this.stateMachine = fisStateMachine.stateMachine;
+
+    // Admit the game losses before starting the FIS state machine, to limit the experiments running at the same time
+    // and coalesce the losses received together into one experiment
+    const admission = new ChaosGameAdmission(this, 'Admission', {
+      prefix: this.prefix,
+      removalPolicy: this.removalPolicy,
+      scoreTable: scoreTable,
+      fisStateMachine: this.stateMachine,
+    });
+    this.admissionQueue = admission.queue;
   }
 }
@@ -0,0 +1,90 @@
+import { Construct } from 'constructs';
+import { Duration, RemovalPolicy } from 'aws-cdk-lib';
+import { Effect, PolicyStatement } from "aws-cdk-lib/aws-iam";
+import { IQueue, Queue, QueueEncryption } from 'aws-cdk-lib/aws-sqs';
+import { ITable } from 'aws-cdk-lib/aws-dynamodb';
+import { StateMachine } from 'aws-cdk-lib/aws-stepfunctions';
+import { SqsEventSource } from 'aws-cdk-lib/aws-lambda-event-sources';
+import { ChaosGameLambda } from "./lambda";
+
+export interface ChaosGameAdmissionProps {
+  readonly prefix: string;
+  readonly removalPolicy: RemovalPolicy;
+  readonly scoreTable: ITable;
+  readonly fisStateMachine: StateMachine;
+  // Maximum number of FIS experiments running at the same time
+  readonly maxInFlight?: number;
+  // Time window during which the game losses are batched and coalesced into one experiment
+  readonly coalescingWindow?: Duration;
+}
+
+export class ChaosGameAdmission extends Construct {
+  public readonly prefix: string;
+  public readonly queue: IQueue;
+
+  constructor(scope: Construct, id: string, props: ChaosGameAdmissionProps) {
+    super(scope, id);
+
+    this.prefix = props.prefix;
+
+    const coalescingWindow = props.coalescingWindow || Duration.seconds(5);
+
+    // Queue of the game losses published by the IoT devices. A batch which can't be admitted is retried after the
+    // visibility timeout. The losses still not admitted after 20 minutes of retries, longer than a slot can be held,
+    // are kept in the dead-letter queue instead of expiring
+    const deadLetterQueue = new Queue(this, 'LossDeadLetterQueue', {
+      queueName: `${this.prefix}-game-losses-dlq`,
+      retentionPeriod: Duration.days(14),
+      encryption: QueueEncryption.SQS_MANAGED,
+      removalPolicy: props.removalPolicy,
+    });
+    this.queue = new Queue(this, 'LossQueue', {
+      queueName: `${this.prefix}-game-losses`,
+      visibilityTimeout: Duration.seconds(30),
+      retentionPeriod: Duration.hours(1),
+      encryption: QueueEncryption.SQS_MANAGED,
+      removalPolicy: props.removalPolicy,
+      deadLetterQueue: { queue: deadLetterQueue, maxReceiveCount: 40 },
+    });
+
+    // Create the Lambda function used to admit the game losses and start the FIS state machine
+    const admitExperimentLambda = new ChaosGameLambda(this, 'AdmitExperimentLambda', {
+      prefix: this.prefix,
+      name: 'admit-experiment',
+      codePath: 'resources/lambdas/admit_experiment',
+      memorySize: 128,
+      timeout: Duration.seconds(10),
+      environment: {
+        PROJECT_TAG: this.prefix,
+        SCORE_TABLE_NAME: props.scoreTable.tableName,
+        STATE_MACHINE_ARN: props.fisStateMachine.stateMachineArn,
+        MAX_IN_FLIGHT: `${props.maxInFlight || 1}`,
+        SLOT_TTL_SECONDS: "900",
+        DEDUP_WINDOW_SECONDS: "10",
+        POWERTOOLS_SERVICE_NAME: 'admit-experiment',
+        POWERTOOLS_METRICS_NAMESPACE: this.prefix,
+      },
+      additionalPolicyStatements: [
+        new PolicyStatement({
+          effect: Effect.ALLOW,
+          actions: ['dynamodb:GetItem', 'dynamodb:UpdateItem', 'dynamodb:PutItem', 'dynamodb:DeleteItem'],
+          resources: [props.scoreTable.tableArn],
+        }),
+        new PolicyStatement({
+          effect: Effect.ALLOW,
+          actions: ['states:StartExecution'],
+          resources: [props.fisStateMachine.stateMachineArn],
+        })
+      ]
+    });
+    // The event source grants the function the rights to consume the queue. The versioned slot map serializes the
+    // admission decisions. The pollers run at most two batches at a time, the minimum, where a reserved concurrency
+    // would throttle them and send the batches back to the queue
+    admitExperimentLambda.function.addEventSource(new SqsEventSource(this.queue, {
+      batchSize: 100,
+      maxBatchingWindow: coalescingWindow,
+      maxConcurrency: 2,
+      reportBatchItemFailures: true,
+    }));
+  }
+}
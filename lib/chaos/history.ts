@@ -0,0 +1,74 @@
+import { Construct } from 'constructs';
+import { Duration, RemovalPolicy } from 'aws-cdk-lib';
+import { Effect, PolicyStatement } from "aws-cdk-lib/aws-iam";
+import { Bucket, BucketEncryption, BlockPublicAccess, IBucket } from 'aws-cdk-lib/aws-s3';
+import { IFunction } from 'aws-cdk-lib/aws-lambda';
+import { Rule, Schedule } from 'aws-cdk-lib/aws-events';
+import { LambdaFunction } from 'aws-cdk-lib/aws-events-targets';
+import { ChaosGameLambda } from "./lambda";
+
+export interface ChaosGameHistoryProps {
+  readonly prefix: string;
+  readonly removalPolicy: RemovalPolicy;
+}
+
+export class ChaosGameHistory extends Construct {
+  public readonly prefix: string;
+  public readonly bucket: IBucket;
+  public readonly archiveFunction: IFunction;
+
+  constructor(scope: Construct, id: string, props: ChaosGameHistoryProps) {
+    super(scope, id);
+
+    this.prefix = props.prefix;
+    const historyPrefix = 'history';
+
+    // The history of the games, one columnar segment per game partitioned by day, merged into one segment per day
+    this.bucket = new Bucket(this, 'HistoryBucket', {
+      encryption: BucketEncryption.S3_MANAGED,
+      blockPublicAccess: BlockPublicAccess.BLOCK_ALL,
+      enforceSSL: true,
+      removalPolicy: props.removalPolicy,
+      autoDeleteObjects: props.removalPolicy === RemovalPolicy.DESTROY,
+    });
+
+    // Create the Lambda function used to archive the games scored by the FIS state machine and to compact the days
+    const archiveGameLambda = new ChaosGameLambda(this, 'ArchiveGameLambda', {
+      prefix: this.prefix,
+      name: 'archive-game',
+      codePath: 'resources/lambdas/archive_game',
+      memorySize: 256,
+      timeout: Duration.seconds(60),
+      environment: {
+        HISTORY_BUCKET_NAME: this.bucket.bucketName,
+        HISTORY_PREFIX: historyPrefix,
+        COMPACT_DAYS: "3",
+        POWERTOOLS_SERVICE_NAME: 'archive-game',
+        POWERTOOLS_METRICS_NAMESPACE: this.prefix,
+      },
+      additionalPolicyStatements: [
+        new PolicyStatement({
+          effect: Effect.ALLOW,
+          actions: ['s3:PutObject', 's3:GetObject', 's3:DeleteObject'],
+          resources: [this.bucket.arnForObjects(`${historyPrefix}/*`)],
+        }),
+        new PolicyStatement({
+          effect: Effect.ALLOW,
+          actions: ['s3:ListBucket'],
+          resources: [this.bucket.bucketArn],
+        })
+      ]
+    });
+    this.archiveFunction = archiveGameLambda.function;
+
+    // Compact the segments of the last days every hour. A game archived after its day was compacted, by an execution
+    // stopping after midnight or a retried asynchronous invocation, is merged into the segment of its day by the next
+    // run
+    new Rule(this, 'CompactHistoryRule', {
+      ruleName: `${this.prefix}-compact-history`,
+      description: 'Merge the game history segments of each of the last days into one',
+      schedule: Schedule.cron({ minute: '30' }),
+      targets: [new LambdaFunction(this.archiveFunction)],
+    });
+  }
+}
@@ -1,6 +1,6 @@
 import { Construct } from 'constructs';
 import { PythonLayerVersion } from '@aws-cdk/aws-lambda-python-alpha';
-import { Duration } from 'aws-cdk-lib';
+import { Duration, Stack } from 'aws-cdk-lib';
 import {
   IRole,
   ManagedPolicy,
@@ -15,6 +15,7 @@ import {
   Function,
   IFunction,
   ILayerVersion,
+  LayerVersion,
   Runtime,
   Architecture,
   Tracing,
@@ -22,6 +23,21 @@ import {
 } from 'aws-cdk-lib/aws-lambda';
 import { ILogGroup, RetentionDays } from 'aws-cdk-lib/aws-logs';
 
+/**
+ * The layer of the chaos_runtime package shared by the Python functions: the boto3 clients and HTTP connection pools
+ * reused across warm invocations, and the latency spans. One layer per stack, whatever the number of functions.
+ */
+export function chaosGameRuntimeLayer(scope: Construct): ILayerVersion {
+  const stack = Stack.of(scope);
+  const id = 'ChaosGameRuntimeLayer';
+  const existing = stack.node.tryFindChild(id) as ILayerVersion | undefined;
+  return existing || new LayerVersion(stack, id, {
+    code: Code.fromAsset('resources/lambdas/runtime'),
+    compatibleRuntimes: [Runtime.PYTHON_3_9],
+    description: 'Shared clients, connection pools and spans of the chaos game Lambda functions',
+  });
+}
+
 interface LambdaFunctionProps {
   functionName: string;
   runtime: Runtime;
@@ -118,6 +134,7 @@ export class ChaosGameLambda extends Construct {
         description: `${this.prefix}-${this.name} Lambda Layer`,
         compatibleRuntimes: [this.properties.runtime],
       }),
+      chaosGameRuntimeLayer(this),
     ];
 
     const lambda = new Function(this, 'Function', {
@@ -2,6 +2,8 @@ import { Construct } from 'constructs';
 import { Duration, RemovalPolicy, Stack } from 'aws-cdk-lib';
 import { LogGroup } from 'aws-cdk-lib/aws-logs';
 import { Effect, PolicyStatement } from "aws-cdk-lib/aws-iam";
+import { Rule } from 'aws-cdk-lib/aws-events';
+import { LambdaFunction } from 'aws-cdk-lib/aws-events-targets';
 import {
   StateMachine,
   StateMachineType,
@@ -11,17 +13,32 @@ import {
   Condition,
   Succeed,
   Fail,
-  CustomState
+  CustomState,
+  Parallel,
+  Pass,
+  Result,
+  IntegrationPattern,
+  JsonPath,
+  TaskInput,
+  Timeout,
+  LogLevel,
 } from 'aws-cdk-lib/aws-stepfunctions';
 import { ITable } from 'aws-cdk-lib/aws-dynamodb';
-import { LambdaInvoke } from 'aws-cdk-lib/aws-stepfunctions-tasks';
+import { IFunction } from 'aws-cdk-lib/aws-lambda';
+import { LambdaInvoke, LambdaInvocationType, DynamoGetItem, DynamoUpdateItem, DynamoAttributeValue } from 'aws-cdk-lib/aws-stepfunctions-tasks';
 import { ChaosGameLambda } from "./lambda";
+import * as webappConfig from '../../webapp-config.json';
 
 export interface ChaosGameFisStateMachineProps {
   readonly prefix: string;
   readonly removalPolicy: RemovalPolicy;
   readonly scoreTable: ITable;
   readonly appUrl : string;
+  // The endpoints probed during the experiments by name, only appUrl is probed when not set. The one named 'app'
+  // scores the availability of the game
+  readonly probeTargets?: { [name: string]: string };
+  // The function archiving the history of the games, no history is kept when not set
+  readonly archiveFunction?: IFunction;
 }
 
 export class ChaosGameFisStateMachine extends Construct {
@@ -34,6 +51,7 @@ export class ChaosGameFisStateMachine extends Construct {
     this.prefix = props.prefix;
 
     const stack = Stack.of(this);
+    const stateMachineName = `${this.prefix}-fis-process`;
 
     // Create the Lambda function used to trigger the FIS experiments
     const triggerExperimentLambda = new ChaosGameLambda(this, 'TriggerFisLambda', {
@@ -44,6 +62,12 @@ export class ChaosGameFisStateMachine extends Construct {
       timeout: Duration.seconds(3),
       environment: {
         PROJECT_TAG: this.prefix,
+        TEMPLATE_CACHE_TTL_SECONDS: "300",
+        SCORE_TABLE_NAME: props.scoreTable.tableName,
+        SCHEDULER_STRATEGY: 'least_recent',
+        SCHEDULER_COOLDOWN_SECONDS: "0",
+        POWERTOOLS_SERVICE_NAME: 'trigger-experiment',
+        POWERTOOLS_METRICS_NAMESPACE: this.prefix,
       },
       additionalPolicyStatements: [
         new PolicyStatement({
@@ -58,6 +82,12 @@ export class ChaosGameFisStateMachine extends Construct {
             `arn:aws:fis:${stack.region}:${stack.account}:experiment-template/*`,
             `arn:aws:fis:${stack.region}:${stack.account}:experiment/*`,
           ],
+        }),
+        // The scheduling state of the experiments is stored in the score table
+        new PolicyStatement({
+          effect: Effect.ALLOW,
+          actions: ['dynamodb:GetItem', 'dynamodb:UpdateItem'],
+          resources: [props.scoreTable.tableArn],
         })
       ]
     });
@@ -69,6 +99,13 @@ export class ChaosGameFisStateMachine extends Construct {
       codePath: 'resources/lambdas/check_experiment',
       memorySize: 128,
       timeout: Duration.seconds(3),
+      environment: {
+        SCORE_TABLE_NAME: props.scoreTable.tableName,
+        POLL_BASE_WAIT_SECONDS: "5",
+        POLL_MAX_WAIT_SECONDS: "30",
+        POWERTOOLS_SERVICE_NAME: 'check-experiment',
+        POWERTOOLS_METRICS_NAMESPACE: this.prefix,
+      },
       additionalPolicyStatements: [
         new PolicyStatement({
           effect: Effect.ALLOW,
@@ -79,11 +116,35 @@ export class ChaosGameFisStateMachine extends Construct {
               'aws:ResourceTag/Project': this.prefix,
             }
           }
+        }),
+        // The experiment records, holding their status and the task token of the waiting execution
+        new PolicyStatement({
+          effect: Effect.ALLOW,
+          actions: ['dynamodb:UpdateItem'],
+          resources: [props.scoreTable.tableArn],
+        }),
+        // The state machine ARN is built from its name to avoid a circular dependency with the state machine
+        new PolicyStatement({
+          effect: Effect.ALLOW,
+          actions: ['states:SendTaskSuccess'],
+          resources: [`arn:aws:states:${stack.region}:${stack.account}:stateMachine:${stateMachineName}`],
         })
       ]
     });
 
+    // Send the FIS experiments state changes to the Lambda function to resume the waiting executions
+    new Rule(this, 'FisStateChangeRule', {
+      ruleName: `${this.prefix}-fis-state-change`,
+      description: 'Resume the FIS state machine when an experiment state changes',
+      eventPattern: {
+        source: ['aws.fis'],
+        detailType: ['FIS Experiment State Change'],
+      },
+      targets: [new LambdaFunction(checkExperimentLambda.function)],
+    });
+
     // Create the Lambda function used to query the Application during the experiment
+    const probeTargets = props.probeTargets || { app: props.appUrl };
     const queryAppLambda = new ChaosGameLambda(this, 'QueryAppLambda', {
       prefix: this.prefix,
       name: 'query-app',
@@ -92,7 +153,14 @@ export class ChaosGameFisStateMachine extends Construct {
       timeout: Duration.seconds(20),
       environment: {
         APP_URL: props.appUrl,
+        PROBE_TARGETS: JSON.stringify(probeTargets),
         NB_TRIES: "20",
+        // The probes are shared out between the targets, a target timing out does not hold the probes of the others
+        CONCURRENCY: "16",
+        PROBE_DURATION_SECONDS: "10",
+        TARGET_RPS: "5",
+        POWERTOOLS_SERVICE_NAME: 'query-app',
+        POWERTOOLS_METRICS_NAMESPACE: this.prefix,
       }
     });
 
@@ -106,21 +174,28 @@ export class ChaosGameFisStateMachine extends Construct {
     });
 
     //Create some Tasks for the State Machine
-    const wait5 = new Wait(this, 'wait5', { time: WaitTime.duration(Duration.seconds(5))});
-    const checkStatus = new LambdaInvoke(this, 'Check the Experiment Status', {
-      lambdaFunction: checkExperimentLambda.function,
-      payloadResponseOnly: true
-    });
     const success = new Succeed(this, 'Experiment Finished');
+    // The score is spread over several items picked at random, so that the writes don't all go to the same partition.
+    // The web application adds them up
+    const scoreShardKey = `States.Format('score#{}', States.MathRandom(0, ${webappConfig.score.shards - 1}))`;
     const failure = new Fail(this, 'Experiment Failed');
+    // The score also adds up the probes of the application during the experiments, and their time of outage, to show
+    // how much the application held up
+    const availabilityValues = {
+      ':probes': {'N.$': "States.Format('{}', $.outcome.availability.probes)"},
+      ':failedProbes': {'N.$': "States.Format('{}', $.outcome.availability.failedProbes)"},
+      ':downtimeSeconds': {'N.$': "States.Format('{}', $.outcome.availability.downtimeSeconds)"},
+    };
+    const availabilityCounters = 'probes :probes, failedProbes :failedProbes, downtimeSeconds :downtimeSeconds';
     const winStateJson = {
       Type: 'Task',
       Resource: 'arn:aws:states:::dynamodb:updateItem',
       Parameters: {
         TableName: props.scoreTable.tableName,
-        Key: {pk: { S: 'score' }},
-        ExpressionAttributeValues: { ':inc': {N: '1'} },
-        UpdateExpression: 'ADD won :inc'
+        Key: {pk: { 'S.$': scoreShardKey }},
+        // One experiment can be credited to several coalesced game losses
+        ExpressionAttributeValues: { ':inc': {'N.$': "States.Format('{}', $.credits)"}, ...availabilityValues },
+        UpdateExpression: `ADD won :inc, ${availabilityCounters}`
       },
       Next: 'Experiment Finished'
     };
@@ -130,53 +205,202 @@ export class ChaosGameFisStateMachine extends Construct {
       Resource: 'arn:aws:states:::dynamodb:updateItem',
       Parameters: {
         TableName: props.scoreTable.tableName,
-        Key: {pk: { S: 'score' }},
-        ExpressionAttributeValues: { ':inc': {N: '1'} },
-        UpdateExpression: 'ADD lost :inc'
+        Key: {pk: { 'S.$': scoreShardKey }},
+        // One experiment can be credited to several coalesced game losses
+        ExpressionAttributeValues: { ':inc': {'N.$': "States.Format('{}', $.credits)"}, ...availabilityValues },
+        UpdateExpression: `ADD lost :inc, ${availabilityCounters}`
       },
       Next: 'Experiment Finished'
     };
     const updateLooseDB = new CustomState(this, 'Update Loose Score', {stateJson: looseStateJson}).next(success);
+    const experimentRunning = Condition.or(
+      Condition.stringEquals('$.experimentStatus', 'initiating'),
+      Condition.stringEquals('$.experimentStatus', 'pending'),
+      Condition.stringEquals('$.experimentStatus', 'running')
+    );
+
+    // Wait for the experiment to end. The execution is resumed by the FIS state change event. If no event came before
+    // the timeout, fall back to polling the experiment status with an increasing wait between the checks
+    const experimentEnded = new Succeed(this, 'Experiment Ended');
+    const waitBackoff = new Wait(this, 'Wait Before Next Check', { time: WaitTime.secondsPath('$.waitSeconds') });
+    const checkStatus = new LambdaInvoke(this, 'Check the Experiment Status', {
+      lambdaFunction: checkExperimentLambda.function,
+      payloadResponseOnly: true
+    });
+    checkStatus.next(new Choice(this, 'Experiment Still Running?')
+      .when(experimentRunning, waitBackoff.next(checkStatus))
+      .otherwise(experimentEnded));
+    const waitForExperiment = new LambdaInvoke(this, 'Wait for the Experiment to End', {
+      lambdaFunction: checkExperimentLambda.function,
+      integrationPattern: IntegrationPattern.WAIT_FOR_TASK_TOKEN,
+      payload: TaskInput.fromObject({
+        experimentId: JsonPath.stringAt('$.experimentId'),
+        taskToken: JsonPath.taskToken,
+        // The trace of the game losses, to time the experiment
+        trace: JsonPath.objectAt('$.trace'),
+      }),
+      taskTimeout: Timeout.duration(Duration.minutes(webappConfig.fis.numberOfEvaluationPeriods + 4)),
+    }).addCatch(checkStatus, {errors: ['States.ALL'], resultPath: '$.error'});
+
+    // Generate traffic on the application until the experiment record shows the experiment is over
+    const getExperimentRecord = new DynamoGetItem(this, 'Get the Experiment Record', {
+      table: props.scoreTable,
+      key: { pk: DynamoAttributeValue.fromString(JsonPath.format('experiment#{}', JsonPath.stringAt('$.experimentId'))) },
+      consistentRead: true,
+      resultPath: '$.record',
+    });
+    // A failed or throttled check of the application waits before the next one, instead of looping through the
+    // states until the execution times out
+    const waitAfterProbeError = new Wait(this, 'Wait After a Failed Check', {
+      time: WaitTime.duration(Duration.seconds(5)),
+    }).next(getExperimentRecord);
+    const queryApp = new LambdaInvoke(this, 'Check the Application', {
+      lambdaFunction: queryAppLambda.function,
+      payloadResponseOnly: true,
+      retryOnServiceExceptions: false,
+    }).addCatch(waitAfterProbeError, {errors: ['States.ALL'], resultPath: '$.error'});
+    queryApp.next(getExperimentRecord);
+    const recordedStatus = '$.record.Item.experimentStatus.S';
+    getExperimentRecord.next(new Choice(this, 'Experiment Status Recorded?')
+      .when(Condition.isPresent(recordedStatus), new Choice(this, 'Keep Checking the Application?')
+        .when(Condition.or(
+          Condition.stringEquals(recordedStatus, 'initiating'),
+          Condition.stringEquals(recordedStatus, 'pending'),
+          Condition.stringEquals(recordedStatus, 'running')
+        ), queryApp)
+        .otherwise(new Succeed(this, 'Stop Checking the Application')))
+      .otherwise(queryApp));
+
+    // The availability figures of the application, and of each target probed, updated by every check of the
+    // application
+    const noProbes = {
+      probes: 0, failedProbes: 0, availabilityPercent: 100, downtimeSeconds: 0, outages: 0,
+      longestOutageSeconds: 0, timeToRecoverSeconds: 0,
+    };
+    const targetsNoProbes: { [name: string]: object } = {};
+    for (const name of Object.keys(probeTargets)) {
+      targetsNoProbes[name] = noProbes;
+    }
+    const startCheckingApp = new Pass(this, 'Start Checking the Application', {
+      result: Result.fromObject({ ...noProbes, targets: targetsNoProbes }),
+      resultPath: '$.availability',
+    }).next(queryApp);
+
+    const runExperiment = new Parallel(this, 'Run the Experiment', {
+      // Keep the experiment status from the first branch, and the availability of the application from the second one
+      resultSelector: {
+        'experimentStatus.$': '$[0].experimentStatus',
+        'availability.$': '$[1].availability',
+      },
+      resultPath: '$.outcome',
+    }).branch(waitForExperiment).branch(startCheckingApp);
+
+    // Free the in-flight experiment slot taken by the admission of the game losses. The slot map does not exist for
+    // executions started manually, so errors are ignored
+    const releaseSlotProps = {
+      table: props.scoreTable,
+      key: { pk: DynamoAttributeValue.fromString(`inflight#${this.prefix}`) },
+      updateExpression: 'REMOVE #executions.#name',
+      expressionAttributeNames: { '#executions': 'executions', '#name': JsonPath.stringAt('$$.Execution.Name') },
+      resultPath: JsonPath.DISCARD,
+    };
+    const scoreGame = new Choice(this, 'Experiment Finished?')
+      .when(Condition.stringEquals('$.outcome.experimentStatus', 'completed'), updateWinDB)
+      .when(Condition.or(
+        Condition.stringEquals('$.outcome.experimentStatus', 'stopping'),
+        Condition.stringEquals('$.outcome.experimentStatus', 'stopped')
+      ), updateLooseDB)
+      .when(Condition.stringEquals('$.outcome.experimentStatus', 'failed'), failure)
+      .otherwise(success);
+    const releaseSlot = new DynamoUpdateItem(this, 'Release the Experiment Slot', releaseSlotProps)
+      .addCatch(scoreGame, {errors: ['States.ALL'], resultPath: JsonPath.DISCARD});
+    // Keep the availability figures of the game with its experiment record. States.Format turns the number into the
+    // string DynamoDB expects
+    const availabilityFigure = (path: string) => DynamoAttributeValue.numberFromString(
+      JsonPath.format('{}', JsonPath.stringAt(`$.outcome.availability${path}`)));
+    const targetsAvailability: { [name: string]: DynamoAttributeValue } = {};
+    for (const name of Object.keys(probeTargets)) {
+      targetsAvailability[name] = availabilityFigure(`.targets['${name}'].availabilityPercent`);
+    }
+    // The availability and the time to recover are missing or null when nothing was probed, "null" is not a number
+    // DynamoDB accepts. They get the figures of an experiment without probes instead
+    const defaultFigure = (label: string, path: string, value: number) => new Choice(this, `${label} Measured?`)
+      .when(Condition.or(Condition.isNotPresent(path), Condition.isNull(path)), new Pass(this, `Default ${label}`, {
+        result: Result.fromNumber(value),
+        resultPath: path,
+      }))
+      .afterwards({ includeOtherwise: true });
+    const figureDefaults = [
+      defaultFigure('Availability', '$.outcome.availability.availabilityPercent', noProbes.availabilityPercent),
+      defaultFigure('Time to Recover', '$.outcome.availability.timeToRecoverSeconds', noProbes.timeToRecoverSeconds),
+      ...Object.keys(probeTargets).map(name => defaultFigure(`Availability of ${name}`,
+        `$.outcome.availability.targets['${name}'].availabilityPercent`, noProbes.availabilityPercent)),
+    ];
+    const recordAvailability = new DynamoUpdateItem(this, 'Record the Availability', {
+      table: props.scoreTable,
+      key: { pk: DynamoAttributeValue.fromString(JsonPath.format('experiment#{}', JsonPath.stringAt('$.experimentId'))) },
+      // The record is written when the experiment is registered, and expires with it
+      conditionExpression: 'attribute_exists(pk)',
+      updateExpression: 'SET availability = :availability',
+      expressionAttributeValues: {
+        ':availability': DynamoAttributeValue.fromMap({
+          probes: availabilityFigure('.probes'),
+          failedProbes: availabilityFigure('.failedProbes'),
+          availabilityPercent: availabilityFigure('.availabilityPercent'),
+          downtimeSeconds: availabilityFigure('.downtimeSeconds'),
+          outages: availabilityFigure('.outages'),
+          longestOutageSeconds: availabilityFigure('.longestOutageSeconds'),
+          timeToRecoverSeconds: availabilityFigure('.timeToRecoverSeconds'),
+          // The availability of each target, to tell which tier of the application broke
+          targets: DynamoAttributeValue.fromMap(targetsAvailability),
+        }),
+      },
+      resultPath: JsonPath.DISCARD,
+    }).addCatch(scoreGame, {errors: ['States.ALL'], resultPath: JsonPath.DISCARD});
+    // Archive the game in the history, without waiting for it: the archive does not delay the score
+    const archiveGame = props.archiveFunction && new LambdaInvoke(this, 'Archive the Game', {
+      lambdaFunction: props.archiveFunction,
+      invocationType: LambdaInvocationType.EVENT,
+      payload: TaskInput.fromObject({
+        state: JsonPath.entirePayload,
+        execution: JsonPath.stringAt('$$.Execution.Name'),
+        stoppedAt: JsonPath.stringAt('$$.State.EnteredTime'),
+      }),
+      resultPath: JsonPath.DISCARD,
+    }).addCatch(scoreGame, {errors: ['States.ALL'], resultPath: JsonPath.DISCARD});
+    const releaseFailedSlot = new DynamoUpdateItem(this, 'Release the Failed Experiment Slot', releaseSlotProps)
+      .addCatch(failure, {errors: ['States.ALL'], resultPath: JsonPath.DISCARD});
+    releaseFailedSlot.next(failure);
+    runExperiment.addCatch(releaseFailedSlot, {errors: ['States.ALL'], resultPath: '$.error'});
 
     //Create the State Machine Definition
-    const smDefinition = new LambdaInvoke(this, 'Trigger the Experiment', {
+    const runGame = new LambdaInvoke(this, 'Trigger the Experiment', {
       lambdaFunction: triggerExperimentLambda.function,
       payloadResponseOnly: true,
-    }).next(wait5)
-      .next(new LambdaInvoke(this, 'Check the Application', {
-        lambdaFunction: queryAppLambda.function,
-        payloadResponseOnly: true,
-        retryOnServiceExceptions: false,
-      }).addCatch(checkStatus, {errors: ['States.ALL'], resultPath: '$.error'}))
-      .next(checkStatus)
-      .next(new Choice(this, 'Experiment Finished?')
-        .when(Condition.or(
-          Condition.stringEquals('$.experimentStatus', 'initiating'),
-          Condition.stringEquals('$.experimentStatus', 'pending'),
-          Condition.stringEquals('$.experimentStatus', 'running')
-        ), wait5)
-        .when(Condition.stringEquals('$.experimentStatus', 'completed'), updateWinDB)
-        .when(Condition.or(
-          Condition.stringEquals('$.experimentStatus', 'stopping'),
-          Condition.stringEquals('$.experimentStatus', 'stopped')
-        ), updateLooseDB)
-        .when(Condition.stringEquals('$.experimentStatus', 'failed'), failure)
-        .otherwise(success));
+    }).addCatch(releaseFailedSlot, {errors: ['States.ALL'], resultPath: '$.error'})
+      .next(runExperiment)
+      .next(releaseSlot);
+    const recordGame = figureDefaults.reduce((chain, defaults) => chain.next(defaults), runGame)
+      .next(recordAvailability);
+    const smDefinition = archiveGame ? recordGame.next(archiveGame).next(scoreGame) : recordGame.next(scoreGame);
 
     // Create the State Machine based on the definition
     const stateMachine = new StateMachine(this, 'fisProcess', {
       definition: smDefinition,
-      stateMachineName: `${this.prefix}-fis-process`,
+      stateMachineName: stateMachineName,
       timeout: Duration.minutes(10),
       stateMachineType: StateMachineType.STANDARD,
+      // All the state transitions are logged, the latency report reads the time of the score update from them
       logs: {
         destination: fisStateMachineLogGroup,
+        level: LogLevel.ALL,
+        includeExecutionData: false,
       },
     });
     stateMachine.addToRolePolicy(
       new PolicyStatement({
         effect: Effect.ALLOW,
-        actions: ['dynamodb:UpdateItem'],
+        actions: ['dynamodb:UpdateItem', 'dynamodb:GetItem'],
         resources: [props.scoreTable.tableArn],
       }
     ));
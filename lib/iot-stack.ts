@@ -1,6 +1,6 @@
 import { Construct } from 'constructs';
 import { Stack, StackProps, RemovalPolicy } from 'aws-cdk-lib';
-import { StateMachine } from 'aws-cdk-lib/aws-stepfunctions';
+import { IQueue } from 'aws-cdk-lib/aws-sqs';
 import { ITopicRule } from "@aws-cdk/aws-iot-alpha";
 import { ChaosGameIotTopic } from "./iot/iot-rule";
 import { ChaosGameIotCore } from "./iot/iot-core";
@@ -8,7 +8,7 @@ import { ChaosGameIotCore } from "./iot/iot-core";
 export interface AwsChaosGameIotStackProps extends StackProps {
   readonly prefix: string;
   readonly removalPolicy?: RemovalPolicy;
-  readonly fisStateMachine: StateMachine;
+  readonly admissionQueue: IQueue;
 }
 
 export class AwsChaosGameIotStack extends Stack {
@@ -29,7 +29,7 @@ export class AwsChaosGameIotStack extends Stack {
     const iotTopicRule = new ChaosGameIotTopic(this, 'Topic', {
       prefix: this.prefix,
       removalPolicy: this.removalPolicy,
-      fisStateMachine: props.fisStateMachine,
+      admissionQueue: props.admissionQueue,
     });
     this.iotTopicRule = iotTopicRule.topicRule;
 
@@ -1,13 +1,13 @@
 import { Construct } from 'constructs';
 import { RemovalPolicy} from "aws-cdk-lib";
 import { TopicRule, ITopicRule, IotSql } from "@aws-cdk/aws-iot-alpha";
-import { StateMachine } from 'aws-cdk-lib/aws-stepfunctions';
-import { StepFunctionsAction } from "./step-function-action";
+import { SqsQueueAction } from "@aws-cdk/aws-iot-actions-alpha";
+import { IQueue } from 'aws-cdk-lib/aws-sqs';
 
 export interface ChaosGameIotTopicProps {
   readonly prefix: string;
   readonly removalPolicy?: RemovalPolicy;
-  readonly fisStateMachine: StateMachine;
+  readonly admissionQueue: IQueue;
 }
 
 export class ChaosGameIotTopic extends Construct {
@@ -28,9 +28,14 @@ export class ChaosGameIotTopic extends Construct {
     //
     this.topicRule = new TopicRule(this, 'TopicRule', {
       topicRuleName: `${this.prefix.replace(/-/g,'_')}_iot_topic_rule`,
-      description: 'AWS IoT Topic Rule to trigger the FIS experiment',
-      sql: IotSql.fromStringAsVer20160323(`SELECT * FROM 'monster-chaos-game/monster' WHERE game_result = 'FAILED'`),
-      actions: [ new StepFunctionsAction(props.fisStateMachine)],
+      description: 'AWS IoT Topic Rule to send the game losses to the FIS experiment admission queue',
+      // The devices send batches of game results with sequence numbers, used to de-duplicate the results they
+      // publish again. The device and reception time de-duplicate the single losses of the previous devices
+      sql: IotSql.fromStringAsVer20160323(
+        `SELECT *, clientid() AS client_id, timestamp() AS received_at FROM 'monster-chaos-game/monster' ` +
+        `WHERE game_result = 'FAILED' OR NOT isUndefined(results)`
+      ),
+      actions: [ new SqsQueueAction(props.admissionQueue)],
     });
   }
 }
\ No newline at end of file
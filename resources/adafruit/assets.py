@@ -0,0 +1,156 @@
+# SPDX-License-Identifier: MIT
+
+"""
+Game assets
+=========================================================
+The sounds and images of the game, loaded once at start up and
+kept for the session instead of being opened from the flash at
+every game end.
+
+The assets are loaded in order of priority, within a memory
+budget and as long as a reserve of RAM stays free for the
+network. A sound which fits is preloaded as a RawSample,
+otherwise it is streamed from its file, kept open, by a
+WaveFile created once with its own decoding buffer. An image
+which fits is loaded into a Bitmap, otherwise it is shown from
+the flash with an OnDiskBitmap.
+"""
+
+import gc
+import struct
+from array import array
+import displayio
+import adafruit_imageload
+try:
+    from audioio import RawSample, WaveFile
+except ImportError:
+    from audiocore import RawSample, WaveFile
+
+# Bytes of the buffer of a streamed sound, split in two halves
+# filled in turn from the flash
+STREAM_BUFFER_SIZE = 4096
+
+def wave_format(file):
+    """Channels, sample rate, bits per sample, and the offset and size
+    of the samples of a WAV file
+    """
+    riff, _, wave = struct.unpack('<4sI4s', file.read(12))
+    if riff != b'RIFF' or wave != b'WAVE':
+        raise ValueError('Not a WAV file')
+    while True:
+        header = file.read(8)
+        if len(header) < 8:
+            raise ValueError('No samples in the WAV file')
+        chunk, size = struct.unpack('<4sI', header)
+        if chunk == b'fmt ':
+            _, channels, rate, _, _, bits = struct.unpack('<HHIIHH', file.read(16))
+            file.seek(size - 16, 1)
+        elif chunk == b'data':
+            return channels, rate, bits, file.tell(), size
+        else:
+            file.seek(size + (size & 1), 1)
+
+def bitmap_size(file):
+    """Bytes taken in RAM by the Bitmap of a BMP file, and of its palette"""
+    file.seek(18)
+    width, height, _, bits = struct.unpack('<iiHH', file.read(12))
+    file.seek(0)
+    palette = 4 * (1 << bits) if bits <= 8 else 0
+    # The rows of a Bitmap are padded to 32 bits
+    return ((abs(width) * bits + 31) // 32) * 4 * abs(height) + palette
+
+class Assets:
+    def __init__(self, budget, reserve, mem_free=None):
+        self.budget = budget
+        self.reserve = reserve
+        # gc.mem_free only exists on CircuitPython
+        self.mem_free = mem_free or getattr(gc, 'mem_free', None)
+        self.used = 0
+        # Bytes taken in RAM by each preloaded asset
+        self.sizes = {}
+        self.sounds = {}
+        self.images = {}
+        # The files of the streamed assets, kept open for the session
+        self.files = {}
+        self.free_before = self.free_after = None
+
+    def _fits(self, size):
+        """Whether size bytes can be taken, and twice as much while loading"""
+        if self.used + size > self.budget:
+            return False
+        if self.mem_free is not None:
+            gc.collect()
+            return self.mem_free() - 2 * size >= self.reserve
+        return True
+
+    def load(self, *paths):
+        """Load the WAV sounds and the BMP images, the first ones first"""
+        self.free_before = self._free()
+        for path in paths:
+            if path.endswith('.wav'):
+                self.sound(path)
+            else:
+                self.image(path)
+        self.free_after = self._free()
+
+    def _free(self):
+        if self.mem_free is None:
+            return None
+        gc.collect()
+        return self.mem_free()
+
+    def sound(self, path):
+        """The sample of a sound, to give to AudioOut.play"""
+        if path not in self.sounds:
+            file = open(path, 'rb')
+            channels, rate, bits, offset, size = wave_format(file)
+            if bits in (8, 16) and self._fits(size):
+                file.seek(offset)
+                # 16-bit samples are signed, 8-bit ones unsigned, as in the WAV file
+                samples = array('h' if bits == 16 else 'B', bytes(size))
+                file.readinto(samples)
+                file.close()
+                self.used += size
+                self.sizes[path] = size
+                self.sounds[path] = RawSample(samples, channel_count=channels, sample_rate=rate)
+            else:
+                file.seek(0)
+                self.files[path] = file
+                self.sounds[path] = WaveFile(file, bytearray(STREAM_BUFFER_SIZE))
+        return self.sounds[path]
+
+    def image(self, path):
+        """The bitmap and pixel shader of an image, to give to a TileGrid"""
+        if path not in self.images:
+            file = open(path, 'rb')
+            size = bitmap_size(file)
+            if self._fits(size):
+                file.close()
+                self.used += size
+                self.sizes[path] = size
+                self.images[path] = adafruit_imageload.load(path, bitmap=displayio.Bitmap,
+                                                            palette=displayio.Palette)
+            else:
+                self.files[path] = file
+                bitmap = displayio.OnDiskBitmap(file)
+                self.images[path] = (bitmap, getattr(bitmap, 'pixel_shader', displayio.ColorConverter()))
+        return self.images[path]
+
+    def release(self, path):
+        """Drop an asset no longer shown or played, and close its file"""
+        if path in self.files:
+            self.files.pop(path).close()
+        self.used -= self.sizes.pop(path, 0)
+        self.sounds.pop(path, None)
+        self.images.pop(path, None)
+        gc.collect()
+
+    def preloaded(self, path):
+        return path not in self.files
+
+    def report(self):
+        for path in list(self.sounds) + list(self.images):
+            print('{}: {}'.format(path, 'in RAM' if self.preloaded(path) else 'streamed from the flash'))
+        if self.free_before is not None:
+            print('Assets: {} bytes in RAM, {} bytes free before loading, {} after'.format(
+                self.used, self.free_before, self.free_after))
@@ -31,13 +31,8 @@ from random import seed, randint
 import board
 import digitalio
 import displayio
+import microcontroller
 import audioio
-try:
-    from audioio import WaveFile
-except ImportError:
-    from audiocore import WaveFile
-
-import adafruit_imageload
 import adafruit_touchscreen
 
 # For AWS IoT
@@ -51,6 +46,11 @@ from adafruit_minimqtt.adafruit_minimqtt import MMQTTException
 from adafruit_aws_iot import MQTT_CLIENT, AWS_IOT_ERROR
 from adafruit_seesaw.seesaw import Seesaw
 
+from tasks import Scheduler, Timing, CooperativeSocketPool, cooperative_esp_waits, wait_for
+from outbox import Outbox, LOST, WON
+from minesweeper import Board, Tiles, BLANK
+from assets import Assets
+
 # =========================================================
 # Display and Audio Config
 # =========================================================
@@ -68,6 +68,28 @@ elif hasattr(board, 'SPEAKER'):
     audio = audioio.AudioOut(board.SPEAKER)
 else:
     raise AttributeError('Board does not have a builtin speaker!')
+
+# =========================================================
+# Assets
+# =========================================================
+SPRITE_SHEET = "/images/SpriteSheet.bmp"
+SPLASH_SCREEN = "/images/main.bmp"
+WIN_SOUND = "sounds/win.wav"
+LOSE_SOUND = "sounds/lose.wav"
+# RAM the assets may take, and RAM kept free for the TLS connection and the
+# MQTT messages. The assets which don't fit are streamed from the flash.
+# The budget holds the sprites and the lose sound (156 KiB of samples). On a
+# board with PSRAM both are preloaded, but a PyPortal has about 120 KiB free
+# once the libraries are imported, so there the lose sound doesn't fit even
+# without the reserve and is still streamed
+ASSET_BUDGET = 192 * 1024
+ASSET_RESERVE = 48 * 1024
+
+# The sprites first, then the sounds of the lose path, the splash screen last
+# as it is only shown while connecting
+assets = Assets(ASSET_BUDGET, ASSET_RESERVE)
+assets.load(SPRITE_SHEET, LOSE_SOUND, WIN_SOUND, SPLASH_SCREEN)
+assets.report()
 # =========================================================
 # AWS IoT Config
 # =========================================================
@@ -111,11 +133,9 @@ wifi = adafruit_esp32spi_wifimanager.ESPSPI_WiFiManager(
 
 # Initialize the graphics helper
 print("Loading AWS IoT Graphics...")
-aws_iot_splash_screen_file = open("/images/main.bmp", "rb")
-aws_iot_splash_screen = displayio.OnDiskBitmap(aws_iot_splash_screen_file)
+aws_iot_splash_screen, aws_iot_splash_screen_shader = assets.image(SPLASH_SCREEN)
 aws_iot_splash_screen_sprite = displayio.TileGrid(
-    aws_iot_splash_screen,
-    pixel_shader=getattr(aws_iot_splash_screen, 'pixel_shader', displayio.ColorConverter()))
+    aws_iot_splash_screen, pixel_shader=aws_iot_splash_screen_shader)
 disply_group_iot.append(aws_iot_splash_screen_sprite)
 print("Graphics loaded!")
 
@@ -130,9 +150,19 @@ print("Connecting to WiFi...")
 wifi.connect()
 print("Connected!")
 
-# Initialize MQTT interface with the esp interface
+# The touch screen, the game, the sounds, the lose animation and AWS IoT
+# are separate tasks of a cooperative scheduler, so that a slow broker
+# or a sound playing doesn't freeze the screen
+scheduler = Scheduler()
+
+# Initialize MQTT interface with the esp interface. While MiniMQTT waits
+# for the broker, its socket reads run the other tasks, and so does the
+# ESP32 while it makes the TLS handshake of a connection
 MQTT_TOPIC = "monster-chaos-game/monster"
-MQTT.set_socket(socket, esp)
+MQTT_POLL_INTERVAL = 0.01
+MQTT.set_socket(CooperativeSocketPool(socket, scheduler, MQTT_POLL_INTERVAL), esp)
+if not cooperative_esp_waits(esp, scheduler, MQTT_POLL_INTERVAL):
+    print("The ESP32 driver blocks while connecting to AWS IoT")
 
 # Set up a new MiniMQTT Client
 client = MQTT.MQTT(broker = secrets['broker'],
@@ -196,31 +226,16 @@ seed(int(time.monotonic()))
 
 NUMBER_OF_MONSTERS = 10
 NUMBER_OF_MONSTER_TYPES = 4
+# The monsters are placed at the first touch of a game, away from the touched
+# square, on a board that can be cleared without guessing when one is found
+# within this time
+GENERATION_BUDGET = 0.2
 
-# Board pieces
-
-OPEN0 = 0
-OPEN1 = 1
-OPEN2 = 2
-OPEN3 = 3
-OPEN4 = 4
-OPEN5 = 5
-OPEN6 = 6
-OPEN7 = 7
-OPEN8 = 8
-BLANK = 9
-MONSTERFLAGGED = 11
-MONSTERMISFLAGGED = 12
-MONSTERQUESTION = 13
-MONSTERS = [16, 17, 18, 19]
-MONSTERDEATH = [20, 21, 22, 23]
 TILE_PIX_SIZE = 32
 NB_X_TILES = 10
 NB_Y_TILES = 7
 
-sprite_sheet, palette = adafruit_imageload.load("/images/SpriteSheet.bmp",
-                                                bitmap=displayio.Bitmap,
-                                                palette=displayio.Palette)
+sprite_sheet, palette = assets.image(SPRITE_SHEET)
 display_group_game = displayio.Group()
 touchscreen = adafruit_touchscreen.Touchscreen(board.TOUCH_XL, board.TOUCH_XR,
                                                board.TOUCH_YD, board.TOUCH_YU,
@@ -234,224 +249,222 @@ tilegrid = displayio.TileGrid(sprite_sheet, pixel_shader=palette,
                               default_tile=BLANK)
 display_group_game.append(tilegrid)
 display.show(display_group_game)
+# The splash screen is not shown again, its memory or its file is given back
+disply_group_iot.remove(aws_iot_splash_screen_sprite)
+del aws_iot_splash_screen, aws_iot_splash_screen_shader, aws_iot_splash_screen_sprite
+assets.release(SPLASH_SCREEN)
 
-board_data = bytearray(b'\x00' * NB_X_TILES * NB_Y_TILES)
+# The neighbor table of the board is built once, the board is reset in place for every game
+game_board = Board(NB_X_TILES, NB_Y_TILES)
+# The game reads and writes the tiles in this shadow, only the changed ones are pushed to the TileGrid
+game_tiles = Tiles(game_board)
 
 # =========================================================
 # Game Functions
 # =========================================================
-#pylint:disable=redefined-outer-name
-def get_data(x, y):
-    return board_data[y * NB_X_TILES + x]
-
-def set_data(x, y, value):
-    board_data[y * NB_X_TILES + x] = value
-#pylint:disable=redefined-outer-name
-
-def seed_monsters(how_many):
-    for _ in range(how_many):
-        while True:
-            monster_x = randint(0, NB_X_TILES-1)
-            monster_y = randint(0, NB_Y_TILES-1)
-            monster_type = 15 + randint(1, NUMBER_OF_MONSTER_TYPES)
-            if get_data(monster_x, monster_y) == 0:
-                set_data(monster_x, monster_y, monster_type)
-                break
-
-def compute_counts():
-    """For each monster, increment the count in each non-monster square around it"""
-    for y in range(NB_Y_TILES):
-        for x in range(NB_X_TILES):
-            if get_data(x, y) not in MONSTERS:
-                continue                  # keep looking for monsters
-            for dx in (-1, 0, 1):
-                if x + dx < 0 or x + dx >= NB_X_TILES:
-                    continue              # off screen
-                for dy in (-1, 0, 1):
-                    if y + dy < 0 or y + dy >= NB_Y_TILES:
-                        continue          # off screen
-                    count = get_data(x + dx, y + dy)
-                    if count in MONSTERS:
-                        continue          # don't process monsters
-                    set_data(x + dx, y + dy, count + 1)
+def push_tiles():
+    """Push the changed tiles to the TileGrid in one batch, refreshed once"""
+    if not game_tiles.changed:
+        return
+    display.auto_refresh = False
+    game_tiles.flush(tilegrid)
+    display.auto_refresh = True
 
 def reveal():
-    for x in range(NB_X_TILES):
-        for y in range(NB_Y_TILES):
-            if tilegrid[x, y] == MONSTERFLAGGED and get_data(x, y) not in MONSTERS:
-                tilegrid[x, y] = MONSTERMISFLAGGED
-            else:
-                tilegrid[x, y] = get_data(x, y)
-
-#pylint:disable=too-many-nested-blocks
-def expand_uncovered(start_x, start_y):
-    number_uncovered = 1
-    stack = [(start_x, start_y)]
-    while len(stack) > 0:
-        x, y = stack.pop()
-        if tilegrid[x, y] == BLANK:
-            under_the_tile = get_data(x, y)
-            if under_the_tile <= OPEN8:
-                tilegrid[x, y] = under_the_tile
-                number_uncovered += 1
-                if under_the_tile == OPEN0:
-                    for dx in (-1, 0, 1):
-                        if x + dx < 0 or x + dx >= NB_X_TILES:
-                            continue              # off screen
-                        for dy in (-1, 0, 1):
-                            if y + dy < 0 or y + dy >= NB_Y_TILES:
-                                continue          # off screen
-                            if dx == 0 and dy == 0:
-                                continue          # don't process where the monster
-                            stack.append((x + dx, y + dy))
-    return number_uncovered
-#pylint:enable=too-many-nested-blocks
-
-def check_for_win():
-    """Check for a complete, winning game. That's one with all squares uncovered
-    and all monsters correctly flagged, with no non-monster squares flaged.
-    """
-    # first make sure everything has been explored and decided
-    for x in range(NB_X_TILES):
-        for y in range(NB_Y_TILES):
-            if tilegrid[x, y] == BLANK or tilegrid[x, y] == MONSTERQUESTION:
-                return None               #still ignored or question squares
-    # then check for mistagged monsters
-    for x in range(NB_X_TILES):
-        for y in range(NB_Y_TILES):
-            if tilegrid[x, y] == MONSTERFLAGGED and get_data(x, y) not in MONSTERS:
-                return False               #misflagged monsters, not done
-    return True               #nothing unexplored, and no misflagged monsters
-
-#pylint:disable=too-many-branches
-# This could be broken apart but I think it's more understandable
-# with it all in one place
-def play_a_game():
-    number_uncovered = 0
-    touch_x = -1
-    touch_y = -1
-    touch_time = 0
+    game_tiles.reveal()
+    push_tiles()
+
+# =========================================================
+# Game Tasks
+# =========================================================
+TOUCH_INTERVAL = 0.05
+MQTT_INTERVAL = 0.1
+NEW_GAME_DELAY = 5.0
+# Keep-alive messages are sent every 29 seconds, within the 30 seconds
+# keep-alive of the broker
+KEEP_ALIVE_INTERVAL = 29
+MAX_RECONNECT_DELAY = 60
+# Game results sent in one MQTT message
+RESULTS_PER_MESSAGE = 10
+
+# Touched tiles waiting for the game, with the time of the touch
+touches = []
+# Game results waiting to be published, kept in the non-volatile memory
+outbox = Outbox(microcontroller.nvm)
+# When the results still in the outbox were recorded since the last reset, to tell the cloud how long they waited
+recorded_at = {}
+# Time between a touch and its tiles pushed to the screen
+input_latency = Timing()
+last_touch = 0
+
+def touch_task():
+    global last_touch
     wait_for_release = False
-    # Send an initial keep-alive MQTT message to AWS IoT
-    aws_iot.loop()
-    last_keep_alive = time.monotonic()
     while True:
-        now = time.monotonic()
-        if now >= touch_time:
-            touch_time = now + 0.2
-            # process touch
-            touch_at = touchscreen.touch_point
-            if touch_at is None:
-                wait_for_release = False
-            else:
-                if wait_for_release:
-                    continue
-                wait_for_release = True
-                touch_x = max(min([touch_at[0] // TILE_PIX_SIZE, NB_X_TILES-1]), 0)
-                touch_y = max(min([touch_at[1] // TILE_PIX_SIZE, NB_Y_TILES-1]), 0)
-                if tilegrid[touch_x, touch_y] == BLANK:
-                    tilegrid[touch_x, touch_y] = MONSTERQUESTION
-                elif tilegrid[touch_x, touch_y] == MONSTERQUESTION:
-                    tilegrid[touch_x, touch_y] = MONSTERFLAGGED
-                elif tilegrid[touch_x, touch_y] == MONSTERFLAGGED:
-                    under_the_tile = get_data(touch_x, touch_y)
-                    if under_the_tile in MONSTERS:
-                        set_data(touch_x, touch_y, MONSTERDEATH[under_the_tile-16]) #reveal a red monster
-                        tilegrid[touch_x, touch_y] = MONSTERDEATH[under_the_tile-16]
-                        return False          #lost
-                    elif under_the_tile > OPEN0 and under_the_tile <= OPEN8:
-                        tilegrid[touch_x, touch_y] = under_the_tile
-                    elif under_the_tile == OPEN0:
-                        tilegrid[touch_x, touch_y] = BLANK
-                        number_uncovered += expand_uncovered(touch_x, touch_y)
-                    else:                    #something bad happened
-                        raise ValueError('Unexpected value on board')
-            status = check_for_win()
-            if status is None:
-                continue
-            return status
-        # Send a keep-alive MQTT message every 29 seconds
-        # But let's not fail the game if a keep-alive message fails
-        if now - last_keep_alive > 29:
-            try:
-                aws_iot.loop()
-                last_keep_alive = time.monotonic()
-                print("Sending keepalive at:", last_keep_alive)
-            except (AWS_IOT_ERROR, MMQTTException, ConnectionError) as e:
-                print("MQTT error", e)
-                print("Continuing...")
+        touch_at = touchscreen.touch_point
+        if touch_at is None:
+            wait_for_release = False
+        elif not wait_for_release:
+            wait_for_release = True
+            last_touch = time.monotonic()
+            touch_x = max(min([touch_at[0] // TILE_PIX_SIZE, NB_X_TILES-1]), 0)
+            touch_y = max(min([touch_at[1] // TILE_PIX_SIZE, NB_Y_TILES-1]), 0)
+            touches.append((game_board.index(touch_x, touch_y), last_touch))
+        yield TOUCH_INTERVAL
 
-#pylint:enable=too-many-branches
+def play_a_game():
+    """Play the touches until the game is won or lost, and return the result"""
+    # The touches made while the previous game was ending don't count
+    del touches[:]
+    generated = False
+    while True:
+        while touches:
+            touched, touched_at = touches.pop(0)
+            if not generated:
+                generated = True
+                solvable, attempts = game_board.generate(NUMBER_OF_MONSTERS, NUMBER_OF_MONSTER_TYPES,
+                                                         touched, GENERATION_BUDGET)
+                print('Board generated in {} attempts, {}'.format(
+                    attempts, 'no guess needed' if solvable else 'guesses may be needed'))
+            alive = game_tiles.touch(touched)
+            push_tiles()
+            input_latency.record(time.monotonic() - touched_at)
+            if not alive:
+                return False
+            status = game_tiles.check_for_win()
+            if status is not None:
+                return status
+        yield TOUCH_INTERVAL
 
 def reset_board():
-    for x in range(NB_X_TILES):
-        for y in range(NB_Y_TILES):
-            tilegrid[x, y] = BLANK
-            set_data(x, y, 0)
-    seed_monsters(NUMBER_OF_MONSTERS)
-    compute_counts()
+    """Cover the tiles, the monsters are placed at the first touch"""
+    game_tiles.reset()
+    push_tiles()
 
 def play_sound(file_name):
     try:
         board.DISPLAY.refresh(target_frames_per_second=60)
     except AttributeError:
         board.DISPLAY.wait_for_frame()
-    wavfile = open(file_name, "rb")
-    wavedata = WaveFile(wavfile)
     speaker_enable.value = True
-    audio.play(wavedata)
-    return wavfile
+    audio.play(assets.sound(file_name))
 
-def wait_for_sound_and_cleanup(wavfile):
+def sound_task(file_name):
+    play_sound(file_name)
     while audio.playing:
-        pass
-    wavfile.close()
+        yield 0.05
     speaker_enable.value = False
 
-def win():
-    print('You won')
-    wait_for_sound_and_cleanup(play_sound('sounds/win.wav'))
-
-def lose():
-    print('You lost')
-    wavfile = play_sound('sounds/lose.wav')
+def lose_animation_task():
+    # The display refreshes itself between the frames
     for _ in range(10):
         tilegrid.x = randint(-2, 2)
         tilegrid.y = randint(-2, 2)
-        try:
-            board.DISPLAY.refresh(target_frames_per_second=60)
-        except AttributeError:
-            board.DISPLAY.refresh_soon()
-            board.DISPLAY.wait_for_frame()
+        yield 1 / 30
     tilegrid.x = 0
     tilegrid.y = 0
-    wait_for_sound_and_cleanup(wavfile)
 
-def send_result_to_aws():
-    # Create a json-formatted device payload
-    payload = {"game_result": "FAILED"}
-    # Update device shadow
-    aws_iot.publish(MQTT_TOPIC, json.dumps(payload))
+def send_result_to_aws(won, duration):
+    # Record the result in the outbox, the MQTT task sends it
+    seq = outbox.record(WON if won else LOST, duration)
+    recorded_at[seq] = time.monotonic()
+    print('Game result', seq, 'recorded,', len(outbox), 'waiting to be sent')
+
+def results_payload(results):
+    # Create a json-formatted device payload with a batch of game results.
+    # The device is identified by its MQTT client id, added by the IoT rule.
+    # Each result has a correlation id, which follows it up to the score update
+    now = time.monotonic()
+    batch = []
+    for seq, result, duration in results:
+        entry = {"seq": seq, "game_result": "SUCCEEDED" if result == WON else "FAILED", "duration": duration,
+                 "cid": '{:08x}-{}'.format(outbox.epoch, seq)}
+        if seq in recorded_at:
+            entry["age_ms"] = int((now - recorded_at[seq]) * 1000)
+        batch.append(entry)
+    payload = {
+        "results": batch,
+        "epoch": outbox.epoch,
+        "dropped": outbox.dropped,
+    }
+    if secrets.get('player'):
+        payload["player"] = secrets['player']
+    return json.dumps(payload)
+
+def game_task():
+    while True:
+        reset_board()
+        started = time.monotonic()
+        won = yield from play_a_game()
+        send_result_to_aws(won, time.monotonic() - started)
+        if won:
+            print('You won')
+            yield from wait_for(scheduler.spawn('win sound', sound_task(WIN_SOUND), 0.05))
+        else:
+            print('You lost')
+            reveal()
+            sound = scheduler.spawn('lose sound', sound_task(LOSE_SOUND), 0.05)
+            yield from wait_for(scheduler.spawn('lose animation', lose_animation_task(), 0.01))
+            yield from wait_for(sound)
+        print('Input latency: {} touches, {:.1f} ms mean, {:.1f} ms worst'.format(
+            input_latency.count, input_latency.mean * 1000, input_latency.worst * 1000))
+        scheduler.report()
+        yield NEW_GAME_DELAY
+
+def mqtt_task():
+    """Publish the game results and send the keep-alive messages to AWS IoT.
+    While the broker answers, and while the ESP32 connects, the other tasks
+    keep running. After an error, the connection is made again with an
+    exponential backoff, and the game results wait in the outbox.
+    """
+    last_keep_alive = time.monotonic()
+    reconnect_delay = 0
+    while True:
+        now = time.monotonic()
+        if reconnect_delay:
+            try:
+                print("Reconnecting...")
+                aws_iot.connect()
+                reconnect_delay = 0
+                last_keep_alive = time.monotonic()
+            except (AWS_IOT_ERROR, MMQTTException, ConnectionError, OSError) as e:
+                print("MQTT error", e)
+                reconnect_delay = min(reconnect_delay * 2, MAX_RECONNECT_DELAY)
+                yield reconnect_delay
+                continue
+        elif len(outbox):
+            try:
+                # The results are removed from the outbox once the broker acknowledged them.
+                # If the acknowledgement is lost they are sent again, and dropped by the cloud side
+                results = outbox.pending(RESULTS_PER_MESSAGE)
+                aws_iot.publish(MQTT_TOPIC, results_payload(results), qos=1)
+                # A game ending while publishing can drop the oldest results of a full outbox
+                outbox.acknowledge(results[-1][0])
+                for seq, _, _ in results:
+                    recorded_at.pop(seq, None)
+                last_keep_alive = time.monotonic()
+            except (AWS_IOT_ERROR, MMQTTException, ConnectionError, OSError) as e:
+                # If there was a problem sending the MQTT message, let's try to reconnect first
+                print("MQTT error", e)
+                reconnect_delay = 1
+                yield reconnect_delay
+                continue
+        elif now - last_keep_alive > KEEP_ALIVE_INTERVAL:
+            # But let's not fail the game if a keep-alive message fails
+            try:
+                aws_iot.loop()
+                print("Sending keepalive at:", now)
+            except (AWS_IOT_ERROR, MMQTTException, ConnectionError) as e:
+                print("MQTT error", e)
+                print("Continuing...")
+            last_keep_alive = time.monotonic()
+        yield MQTT_INTERVAL
 
 # =========================================================
 # Game Start
 # =========================================================
 
-while True:
-    reset_board()
-    if play_a_game():
-        win()
-    else:
-        reveal()
-        lose()
-        try:
-            send_result_to_aws()
-        except (AWS_IOT_ERROR, MMQTTException, ConnectionError) as e:
-            # If there was a problem sending the MQTT message, let's try to reconnect first
-            print("MQTT error", e)
-            print("Reconnecting...")
-            aws_iot.connect()
-            send_result_to_aws()
-    # AWS IoT keep-alive
-    aws_iot.loop()
-    time.sleep(5.0)
+scheduler.spawn('touch', touch_task(), 0.01)
+scheduler.spawn('game', game_task(), 0.05)
+scheduler.spawn('mqtt', mqtt_task())
+scheduler.run()
@@ -0,0 +1,326 @@
+# SPDX-FileCopyrightText: Minesweeper: 2019 Dave Astels for Adafruit Industries
+#
+# SPDX-License-Identifier: MIT
+
+"""
+PyPortal MineSweeper board
+=========================================================
+The board logic and the rules of the game, without any hardware
+dependency so that it can also run on a host computer.
+
+The cells are addressed by their flat index y * width + x,
+which the displayio TileGrid also accepts.
+"""
+
+from array import array
+from random import randint
+from time import monotonic
+
+# Board pieces
+
+OPEN0 = 0
+OPEN1 = 1
+OPEN2 = 2
+OPEN3 = 3
+OPEN4 = 4
+OPEN5 = 5
+OPEN6 = 6
+OPEN7 = 7
+OPEN8 = 8
+BLANK = 9
+MONSTERFLAGGED = 11
+MONSTERMISFLAGGED = 12
+MONSTERQUESTION = 13
+MONSTERS = (16, 17, 18, 19)
+MONSTERDEATH = (20, 21, 22, 23)
+
+_neighbor_tables = {}
+
+def neighbor_table(width, height):
+    """Flat indices of the neighbors of every cell, built once per board size.
+    The neighbors of the cell i are neighbors[starts[i]:starts[i + 1]]
+    """
+    key = (width, height)
+    if key not in _neighbor_tables:
+        starts = array('I', [0])
+        neighbors = array('H')
+        for y in range(height):
+            for x in range(width):
+                for dy in (-1, 0, 1):
+                    if y + dy < 0 or y + dy >= height:
+                        continue          # off screen
+                    for dx in (-1, 0, 1):
+                        if x + dx < 0 or x + dx >= width or (dx == 0 and dy == 0):
+                            continue      # off screen or the cell itself
+                        neighbors.append((y + dy) * width + x + dx)
+                starts.append(len(neighbors))
+        _neighbor_tables[key] = (starts, neighbors)
+    return _neighbor_tables[key]
+
+class Board:
+    """What is under the tiles: a monster, or the number of monsters around"""
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.size = width * height
+        self.data = bytearray(self.size)
+        self.starts, self.neighbors = neighbor_table(width, height)
+        # A permutation of the squares and the position of every square in it,
+        # shuffled in place by the draws of the monsters
+        self.cells = array('H', range(self.size))
+        self.positions = array('H', range(self.size))
+
+    def index(self, x, y):
+        return y * self.width + x
+
+    def reset(self, number_of_monsters, number_of_monster_types, safe=None):
+        for i in range(self.size):
+            self.data[i] = 0
+        self.seed_monsters(number_of_monsters, number_of_monster_types, safe)
+
+    def seed_monsters(self, how_many, number_of_monster_types, safe=None):
+        """Place the monsters on distinct squares drawn without replacement, in
+        time linear in the number of monsters whatever the density, and count
+        them in the squares around. The safe square and its neighbors get no
+        monster, as long as enough squares are left for the monsters.
+        """
+        data = self.data
+        starts = self.starts
+        neighbors = self.neighbors
+        cells = self.cells
+        positions = self.positions
+        last = self.size - 1
+        if safe is not None:
+            # Move the safe squares to the end of the permutation, out of the draw
+            safe_squares = [safe]
+            if self.size - 1 - (starts[safe + 1] - starts[safe]) >= how_many:
+                safe_squares.extend(neighbors[starts[safe]:starts[safe + 1]])
+            for square in safe_squares:
+                position = positions[square]
+                other = cells[last]
+                cells[position] = other
+                positions[other] = position
+                cells[last] = square
+                positions[square] = last
+                last -= 1
+        if how_many > last + 1:
+            raise ValueError('Too many monsters for the board')
+        # Partial Fisher-Yates shuffle: the first how_many squares of the permutation get the monsters
+        for m in range(how_many):
+            j = randint(m, last)
+            monster = cells[j]
+            other = cells[m]
+            cells[j] = other
+            positions[other] = j
+            cells[m] = monster
+            positions[monster] = m
+            data[monster] = 15 + randint(1, number_of_monster_types)
+            for k in range(starts[monster], starts[monster + 1]):
+                neighbor = neighbors[k]
+                if data[neighbor] <= OPEN8:   # a count, not a monster
+                    data[neighbor] += 1
+
+    def generate(self, number_of_monsters, number_of_monster_types, start, budget=0.2):
+        """Reset the board with the start square and its neighbors safe, drawing
+        new boards until one can be cleared from the start square without
+        guessing or the budget in seconds is spent, in which case the last board
+        is kept. Returns whether the board can be cleared and the boards drawn
+        """
+        deadline = monotonic() + budget
+        attempts = 0
+        while True:
+            self.reset(number_of_monsters, number_of_monster_types, start)
+            attempts += 1
+            if self.solvable(start, number_of_monsters):
+                return True, attempts
+            if monotonic() >= deadline:
+                return False, attempts
+
+    def solvable(self, start, number_of_monsters):
+        """Whether the board can be cleared from the start square without ever
+        guessing, by constraint propagation: a number with as many covered
+        squares around as monsters left has monsters on all of them, and a number
+        with all its monsters flagged has safe squares on the others. The board
+        is cleared when all the safe squares are uncovered or all the monsters
+        flagged
+        """
+        data = self.data
+        starts = self.starts
+        neighbors = self.neighbors
+        # 0 covered, 1 uncovered, 2 flagged
+        state = bytearray(self.size)
+        frontier = []
+        stack = [start]
+        uncovered = flagged = 0
+        safe_squares = self.size - number_of_monsters
+        while True:
+            # Uncover the squares known to be safe, flooding the empty ones
+            while stack:
+                i = stack.pop()
+                if state[i]:
+                    continue
+                state[i] = 1
+                uncovered += 1
+                if data[i] == OPEN0:
+                    for k in range(starts[i], starts[i + 1]):
+                        if not state[neighbors[k]]:
+                            stack.append(neighbors[k])
+                else:
+                    frontier.append(i)
+            if uncovered == safe_squares:
+                return True
+            if flagged == number_of_monsters:
+                return True               # all the covered squares left are safe
+            progress = False
+            remaining = []
+            for i in frontier:
+                covered = flags = 0
+                for k in range(starts[i], starts[i + 1]):
+                    neighbor_state = state[neighbors[k]]
+                    if neighbor_state == 0:
+                        covered += 1
+                    elif neighbor_state == 2:
+                        flags += 1
+                if not covered:
+                    continue              # done with this number
+                if data[i] == flags + covered:
+                    for k in range(starts[i], starts[i + 1]):
+                        if not state[neighbors[k]]:
+                            state[neighbors[k]] = 2
+                            flagged += 1
+                    progress = True
+                elif data[i] == flags:
+                    for k in range(starts[i], starts[i + 1]):
+                        if not state[neighbors[k]]:
+                            stack.append(neighbors[k])
+                    progress = True
+                else:
+                    remaining.append(i)
+            frontier = remaining
+            if not progress:
+                return False              # a guess is needed
+
+    def expand_uncovered(self, tiles, start):
+        """Uncover the tiles around an empty square, and around the empty squares
+        uncovered in turn. Each square is pushed on the stack at most once.
+        """
+        data = self.data
+        starts = self.starts
+        neighbors = self.neighbors
+        visited = bytearray(self.size)
+        visited[start] = 1
+        number_uncovered = 1
+        stack = [start]
+        while stack:
+            i = stack.pop()
+            if tiles[i] != BLANK:
+                continue
+            under_the_tile = data[i]
+            if under_the_tile > OPEN8:
+                continue
+            tiles[i] = under_the_tile
+            number_uncovered += 1
+            if under_the_tile == OPEN0:
+                for k in range(starts[i], starts[i + 1]):
+                    neighbor = neighbors[k]
+                    if not visited[neighbor]:
+                        visited[neighbor] = 1
+                        stack.append(neighbor)
+        return number_uncovered
+
+class Tiles:
+    """Shadow of the tiles shown by the TileGrid. It counts the blank, question
+    and misflagged tiles as they change, and keeps the list of the changed tiles
+    so that only those are pushed to the TileGrid.
+    """
+
+    def __init__(self, board):
+        self.board = board
+        self.tiles = bytearray([BLANK] * board.size)
+        self.dirty = bytearray(board.size)
+        self.changed = []
+        self.blank = board.size
+        self.question = 0
+        self.misflagged = 0
+
+    def __getitem__(self, index):
+        return self.tiles[index]
+
+    def __setitem__(self, index, value):
+        previous = self.tiles[index]
+        if previous == value:
+            return
+        self._count(index, previous, -1)
+        self._count(index, value, 1)
+        self.tiles[index] = value
+        if not self.dirty[index]:
+            self.dirty[index] = 1
+            self.changed.append(index)
+
+    def _count(self, index, tile, increment):
+        if tile == BLANK:
+            self.blank += increment
+        elif tile == MONSTERQUESTION:
+            self.question += increment
+        elif tile == MONSTERFLAGGED and self.board.data[index] not in MONSTERS:
+            self.misflagged += increment
+
+    def reset(self):
+        for i in range(self.board.size):
+            self[i] = BLANK
+
+    def reveal(self):
+        data = self.board.data
+        for i in range(self.board.size):
+            if self.tiles[i] == MONSTERFLAGGED and data[i] not in MONSTERS:
+                self[i] = MONSTERMISFLAGGED
+            else:
+                self[i] = data[i]
+
+    def touch(self, index):
+        """Play one touched tile: a blank tile gets a question mark, then a flag,
+        and a flagged tile is uncovered. Returns False when a monster is uncovered
+        """
+        tile = self.tiles[index]
+        if tile == BLANK:
+            self[index] = MONSTERQUESTION
+        elif tile == MONSTERQUESTION:
+            self[index] = MONSTERFLAGGED
+        elif tile == MONSTERFLAGGED:
+            data = self.board.data
+            under_the_tile = data[index]
+            if under_the_tile in MONSTERS:
+                # the flag comes off before the monster changes, to keep the misflagged count right
+                self[index] = MONSTERDEATH[under_the_tile-16]
+                data[index] = MONSTERDEATH[under_the_tile-16] #reveal a red monster
+                return False          #lost
+            elif under_the_tile > OPEN0 and under_the_tile <= OPEN8:
+                self[index] = under_the_tile
+            elif under_the_tile == OPEN0:
+                self[index] = BLANK
+                self.board.expand_uncovered(self, index)
+            else:                    #something bad happened
+                raise ValueError('Unexpected value on board')
+        return True
+
+    def check_for_win(self):
+        """Check for a complete, winning game. That's one with all squares uncovered
+        and all monsters correctly flagged, with no non-monster squares flaged.
+        """
+        if self.blank or self.question:
+            return None               #still ignored or question squares
+        if self.misflagged:
+            return False              #misflagged monsters, not done
+        return True                   #nothing unexplored, and no misflagged monsters
+
+    def flush(self, tilegrid):
+        """Write the changed tiles to the TileGrid. Returns the number of tiles written"""
+        tiles = self.tiles
+        dirty = self.dirty
+        for i in self.changed:
+            tilegrid[i] = tiles[i]
+            dirty[i] = 0
+        number_written = len(self.changed)
+        self.changed = []
+        return number_written
@@ -0,0 +1,94 @@
+# SPDX-License-Identifier: MIT
+
+"""
+Game results outbox
+=========================================================
+A bounded queue of the game results waiting to be published,
+kept in non-volatile memory so that it survives a reset or a
+power loss. Every result gets a sequence number, which the
+cloud side uses to drop the results published twice. The
+sequence numbers restart when the storage is initialized,
+with a new random epoch to tell them apart.
+
+The storage is any bytearray-like object, the microcontroller
+nvm on the device. It holds a header and a ring of fixed-size
+records. A record is written before the header which refers
+to it, so an interrupted write loses at most that record.
+"""
+
+import os
+import struct
+
+LOST = 0
+WON = 1
+
+# magic, epoch, next sequence number, index of the oldest record, number of records, number of dropped records
+_HEADER = "<HIIHHH"
+_HEADER_SIZE = struct.calcsize(_HEADER)
+# sequence number, result, duration of the game in seconds
+_RECORD = "<IBH"
+_RECORD_SIZE = struct.calcsize(_RECORD)
+_MAGIC = 0xC4A0
+
+class Outbox:
+    def __init__(self, storage, capacity=128, offset=0):
+        if offset + _HEADER_SIZE + capacity * _RECORD_SIZE > len(storage):
+            raise ValueError('Storage too small for the outbox')
+        self.storage = storage
+        self.capacity = capacity
+        self.offset = offset
+        magic, self.epoch, self.next_seq, self.first, self.count, self.dropped = struct.unpack(
+            _HEADER, bytes(storage[offset:offset + _HEADER_SIZE]))
+        if magic != _MAGIC or self.first >= capacity or self.count > capacity:
+            # Blank or foreign storage
+            self.epoch = struct.unpack("<I", os.urandom(4))[0]
+            self.next_seq, self.first, self.count, self.dropped = 1, 0, 0, 0
+            self._write_header()
+
+    def __len__(self):
+        return self.count
+
+    def _write_header(self):
+        self.storage[self.offset:self.offset + _HEADER_SIZE] = struct.pack(
+            _HEADER, _MAGIC, self.epoch, self.next_seq, self.first, self.count, self.dropped)
+
+    def _position(self, i):
+        return self.offset + _HEADER_SIZE + ((self.first + i) % self.capacity) * _RECORD_SIZE
+
+    def record(self, result, duration):
+        """Add a game result, dropping the oldest one when the outbox is full. Returns its sequence number"""
+        seq = self.next_seq
+        if self.count == self.capacity:
+            self.first = (self.first + 1) % self.capacity
+            self.count -= 1
+            self.dropped += 1
+        position = self._position(self.count)
+        self.storage[position:position + _RECORD_SIZE] = struct.pack(
+            _RECORD, seq, result, min(max(int(duration), 0), 0xFFFF))
+        self.next_seq += 1
+        self.count += 1
+        self._write_header()
+        return seq
+
+    def pending(self, limit):
+        """The oldest results, as (sequence number, result, duration) tuples"""
+        records = []
+        for i in range(min(limit, self.count)):
+            position = self._position(i)
+            records.append(struct.unpack(_RECORD, bytes(self.storage[position:position + _RECORD_SIZE])))
+        return records
+
+    def acknowledge(self, last_seq):
+        """Remove the oldest results up to the sequence number last_seq,
+        once they are published. The results recorded while publishing
+        may have dropped some of them already, so they are matched by
+        sequence number rather than counted
+        """
+        while self.count:
+            position = self._position(0)
+            seq = struct.unpack(_RECORD, bytes(self.storage[position:position + _RECORD_SIZE]))[0]
+            if seq > last_seq:
+                break
+            self.first = (self.first + 1) % self.capacity
+            self.count -= 1
+        self._write_header()
@@ -8,5 +8,6 @@ secrets = {
     'password' : '',         # Keep the two '' quotes around password
     'timezone' : '',         # http://worldtimeapi.org/timezones
     'broker' : '',           # The AWS IoT broker
-    'client_id' : ''         # The AWS IoT Thing name
+    'client_id' : '',        # The AWS IoT Thing name
+    'player' : ''            # Optional name of the player, for the leaderboards
     }
@@ -0,0 +1,221 @@
+# SPDX-License-Identifier: MIT
+
+"""
+Cooperative scheduler
+=========================================================
+Runs generator tasks one step at a time. A task yields the
+number of seconds to wait before its next step, and the
+scheduler sleeps until the next task is due instead of
+busy-polling.
+
+Every task is timed: the duration of its steps, how late
+they start, and how many steps went over the task budget.
+It has no hardware dependency, so that the game loop can
+also be simulated on a host computer.
+
+A task waiting for the network doesn't hold the others: the
+sockets of a CooperativeSocketPool run the steps of the
+other tasks while their reads wait for data, and so do the
+waits of an ESP32 co-processor for the end of its commands
+once cooperative_esp_waits is applied to it.
+"""
+
+import time
+import errno
+
+class Timing:
+    """Count, mean and worst of a series of durations, in seconds"""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.worst = 0.0
+
+    def record(self, duration):
+        self.count += 1
+        self.total += duration
+        if duration > self.worst:
+            self.worst = duration
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+class Task:
+    def __init__(self, name, generator, budget, next_run):
+        self.name = name
+        self.generator = generator
+        self.budget = budget
+        self.next_run = next_run
+        self.done = False
+        self.duration = Timing()
+        self.lateness = Timing()
+        self.overruns = 0
+        # Time spent in the steps of the other tasks while this one waited for I/O
+        self.lent = 0.0
+
+class TaskError(Exception):
+    """A task run while another one waited for I/O failed. Raised
+    as its own error, so that the waiting task doesn't take it
+    for an error of its I/O"""
+
+class Scheduler:
+    def __init__(self, clock=time.monotonic, sleep=time.sleep):
+        self.clock = clock
+        self.sleep = sleep
+        self.tasks = []
+        # Kept after the tasks are done, for the report
+        self.timings = {}
+        # The tasks in the middle of a step, the last one is running
+        # the others while it waits for I/O
+        self.running = []
+
+    def spawn(self, name, generator, budget=None):
+        """Add a task. Its steps are expected to take less than the budget, in seconds"""
+        task = Task(name, generator, budget, self.clock())
+        self.tasks.append(task)
+        self.timings[name] = task
+        return task
+
+    def step(self, until=None):
+        """Run one step of the task due first, after sleeping until it is due.
+        A task waiting for I/O calls it with the time it wants control
+        back: the tasks in the middle of a step are left out, and no
+        step is run when none is due by then"""
+        task = None
+        for other in self.tasks:
+            if other not in self.running and (task is None or other.next_run < task.next_run):
+                task = other
+        if task is None and until is None:
+            return
+        start = self.clock()
+        due = until if task is None else task.next_run if until is None else min(task.next_run, until)
+        if due > start:
+            self.sleep(due - start)
+            slept_until = self.clock()
+            # A task waiting for I/O isn't holding the others while it sleeps
+            if self.running:
+                self.running[-1].lent += slept_until - start
+            start = slept_until
+        if task is None or task.next_run > start:
+            return
+        task.lateness.record(start - task.next_run)
+        task.lent = 0.0
+        self.running.append(task)
+        try:
+            delay = next(task.generator)
+        except StopIteration:
+            task.done = True
+            self.tasks.remove(task)
+            delay = 0
+        except Exception as e:
+            if len(self.running) > 1:
+                raise TaskError(task.name, e)
+            raise
+        finally:
+            self.running.pop()
+        end = self.clock()
+        if self.running:
+            self.running[-1].lent += end - start
+        duration = end - start - task.lent
+        task.duration.record(duration)
+        if task.budget is not None and duration > task.budget:
+            task.overruns += 1
+        task.next_run = end + (delay or 0)
+
+    def run(self):
+        while self.tasks:
+            self.step()
+
+    def report(self):
+        for task in self.timings.values():
+            print('{}: {} steps, {:.1f} ms mean, {:.1f} ms worst, {:.1f} ms worst lateness, {} over budget'.format(
+                task.name, task.duration.count, task.duration.mean * 1000, task.duration.worst * 1000,
+                task.lateness.worst * 1000, task.overruns))
+
+class CooperativeSocket:
+    """A socket whose reads poll the socket for data, and run the
+    steps of the other tasks in between, up to the timeout set on it.
+    A read which gets nothing in time raises OSError(ETIMEDOUT)"""
+
+    def __init__(self, sock, scheduler, poll_interval):
+        self._socket = sock
+        self._scheduler = scheduler
+        self._poll_interval = poll_interval
+        self._timeout = None
+
+    def __getattr__(self, name):
+        return getattr(self._socket, name)
+
+    def settimeout(self, timeout):
+        self._timeout = timeout
+
+    def recv(self, bufsize):
+        return self._wait(self._socket.recv, bufsize)
+
+    def recv_into(self, buffer, nbytes=0):
+        return self._wait(self._socket.recv_into, buffer, nbytes)
+
+    def _wait(self, read, *args):
+        clock = self._scheduler.clock
+        deadline = None if self._timeout is None else clock() + self._timeout
+        # A zero timeout means no timeout for some sockets, the poll
+        # waits a little instead
+        self._socket.settimeout(self._poll_interval)
+        # The sockets which tell how much data they hold are only read
+        # once there is some, instead of blocking for the poll interval
+        available = getattr(self._socket, 'available', None)
+        while True:
+            try:
+                received = read(*args) if available is None or available() else None
+                if received:
+                    return received
+            except OSError as e:
+                if e.args[0] not in (errno.ETIMEDOUT, errno.EAGAIN):
+                    raise
+            now = clock()
+            if deadline is not None and now >= deadline:
+                raise OSError(errno.ETIMEDOUT)
+            self._scheduler.step(now + self._poll_interval)
+
+class CooperativeSocketPool:
+    """The socket module handed to a network library, whose sockets
+    are CooperativeSockets"""
+
+    def __init__(self, pool, scheduler, poll_interval=0.01):
+        self._pool = pool
+        self._scheduler = scheduler
+        self._poll_interval = poll_interval
+
+    def __getattr__(self, name):
+        return getattr(self._pool, name)
+
+    def socket(self, *args, **kwargs):
+        return CooperativeSocket(self._pool.socket(*args, **kwargs), self._scheduler, self._poll_interval)
+
+def cooperative_esp_waits(esp, scheduler, poll_interval=0.01, timeout=10):
+    """Run the steps of the other tasks while an ESP32SPI co-processor
+    works on a command, such as the TLS handshake of a connection which
+    takes seconds. The co-processor raises its ready pin until it is
+    done, and ESP_SPIcontrol polls it in _wait_for_ready, outside of
+    the SPI bus lock. That wait is replaced. Returns False, and leaves
+    the waits blocking, when the driver doesn't have them"""
+    ready = getattr(esp, '_ready', None)
+    if ready is None or not hasattr(esp, '_wait_for_ready'):
+        return False
+
+    def wait_for_ready():
+        deadline = scheduler.clock() + timeout
+        while ready.value:
+            now = scheduler.clock()
+            if now >= deadline:
+                raise TimeoutError('ESP32 not responding')
+            scheduler.step(now + poll_interval)
+
+    esp._wait_for_ready = wait_for_ready
+    return True
+
+def wait_for(task, interval=0.05):
+    """To use with "yield from" in a task, to wait until another task is done"""
+    while not task.done:
+        yield interval
@@ -0,0 +1,258 @@
+"""Host-side batch simulator of the PyPortal game, to tune the number of monsters and the board size against the rate
+of chaos experiments the stack can run.
+
+Millions of boards are generated and played at once with NumPy: the monster counts of the squares are the convolution
+of the monsters with a 3x3 kernel, and the flood fills of the empty squares run on all the boards together. A scripted
+player plays every board like a careful human: it flags the squares which must be monsters and uncovers the ones
+which must be safe, from the numbers shown, and guesses a random square when nothing can be deduced. On the device,
+uncovering a square takes 3 touches (question mark, flag, uncover) and flagging one 2.
+
+As on the device, the monsters are placed after the first touch, away from the touched square. The no guess column is
+the share of the boards the player clears without guessing: the device draws boards again, within its generation
+budget, until it gets one of those, on which only a mistake of the player loses the game. The device columns are
+played on those boards only, again, by a player who uncovers a random hidden square instead of a deduced one now and
+then (--mistakes, per square uncovered).
+
+Each lost game asks for one FIS experiment. The simulator compares the losses of a device playing non stop with the
+experiments the stack runs per hour: MAX_IN_FLIGHT at a time, one by default, each lasting the duration of the
+experiment templates. The admission turns the other losses away.
+
+The batched rules are first checked against the game engine of the device, minesweeper.py.
+
+    python resources/adafruit_local/batch_simulator.py [--games 1000000] [--sizes 10x7,12x8] [--monsters 6-14]
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import numpy as np
+
+ADAFRUIT_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "adafruit")
+# Appended rather than inserted: the secrets.py of the device would shadow the one of the standard library NumPy uses
+sys.path.append(ADAFRUIT_PATH)
+from minesweeper import Board, Tiles, MONSTERS, OPEN0, OPEN8
+
+# The device board and monsters, see code.py
+DEVICE_SIZE = (10, 7)
+DEVICE_MONSTERS = 10
+NEW_GAME_DELAY = 5.0
+# Boards played together, to bound the memory used
+CHUNK_SIZE = 50_000
+with open(os.path.join(os.path.dirname(ADAFRUIT_PATH), "..", "webapp-config.json")) as f:
+    # The FIS experiments last the alarm evaluation periods plus 3 minutes
+    EXPERIMENT_SECONDS = (json.load(f)["fis"]["numberOfEvaluationPeriods"] + 3) * 60
+
+
+def neighbor_counts(cells: np.ndarray) -> np.ndarray:
+    """Number of marked neighbors of every square of a batch of boards shaped (boards, height, width): the
+    convolution of the marks with a 3x3 kernel of ones without its center, the squares off the board being unmarked.
+    The kernel is separable, the rows are summed and then the columns
+    """
+    cells = cells.astype(np.uint8)
+    rows = cells.copy()
+    rows[:, 1:] += cells[:, :-1]
+    rows[:, :-1] += cells[:, 1:]
+    counts = rows.copy()
+    counts[:, :, 1:] += rows[:, :, :-1]
+    counts[:, :, :-1] += rows[:, :, 1:]
+    return counts - cells
+
+
+def dilate(cells: np.ndarray) -> np.ndarray:
+    """The squares with at least one marked neighbor or marked themselves, cheaper than the counts"""
+    rows = cells.copy()
+    rows[:, 1:] |= cells[:, :-1]
+    rows[:, :-1] |= cells[:, 1:]
+    around = rows.copy()
+    around[:, :, 1:] |= rows[:, :, :-1]
+    around[:, :, :-1] |= rows[:, :, 1:]
+    return around
+
+
+def generate(rng: np.random.Generator, games: int, width: int, height: int, monsters: int) -> tuple:
+    """The monsters of a batch of boards, placed uniformly as the device does, the counts of the other squares and
+    the first touched squares. The monsters are placed after the first touch, away from the touched square and its
+    neighbors when the board leaves enough squares for them
+    """
+    first = np.zeros((games, height, width), bool)
+    first.reshape(games, -1)[np.arange(games), rng.integers(0, width * height, games)] = True
+    safe = dilate(first)
+    fits = width * height - safe.sum(axis=(1, 2)) >= monsters
+    safe[~fits] = first[~fits]
+    # The safe squares get the largest keys, the monsters go to the smallest ones
+    keys = rng.random((games, height, width)) + safe
+    positions = np.argpartition(keys.reshape(games, -1), monsters - 1, axis=1)[:, :monsters]
+    mines = np.zeros((games, width * height), bool)
+    mines[np.arange(games)[:, None], positions] = True
+    mines = mines.reshape(games, height, width)
+    return mines, neighbor_counts(mines), first
+
+
+def flood(opened: np.ndarray, empty: np.ndarray, mines: np.ndarray) -> np.ndarray:
+    """Uncover the squares around the empty uncovered squares, until no board changes. Only the boards still
+    spreading are dilated again
+    """
+    spreading = np.arange(len(opened))
+    while len(spreading):
+        before = opened[spreading]
+        after = dilate(before & empty[spreading]) & ~mines[spreading] | before
+        changed = (after != before).any(axis=(1, 2))
+        spreading = spreading[changed]
+        opened[spreading] = after[changed]
+    return opened
+
+
+def play(rng: np.random.Generator, mines: np.ndarray, counts: np.ndarray, first: np.ndarray, monsters: int,
+         mistakes: float = 0) -> dict:
+    """Play a batch of boards to the end with the scripted player, from the first touched squares, the player
+    uncovering a random hidden square instead of a deduced one with the mistakes probability. Returns the result of
+    every game: won, the touches and the guesses
+    """
+    games = len(mines)
+    won = np.zeros(games, bool)
+    touches = np.full(games, 3, np.int32)
+    guesses = np.zeros(games, np.int32)
+    # The boards still being played, compacted as the games end
+    active = np.arange(games)
+    empty = counts == 0
+    opened = flood(first.copy(), empty, mines)
+    flagged = np.zeros(mines.shape, bool)
+    while len(active):
+        unknown = ~opened & ~flagged
+        shown = opened & ~empty
+        hidden = neighbor_counts(unknown)
+        flags = neighbor_counts(flagged)
+        # A number with as many hidden squares around as monsters left: they are all monsters. A number with all its
+        # monsters flagged: the other squares around are safe
+        new_flags = dilate(shown & (hidden > 0) & (counts == flags + hidden)) & unknown
+        new_opens = dilate(shown & (hidden > 0) & (counts == flags)) & unknown
+        # As many hidden squares left as monsters not flagged: they are all monsters
+        left = unknown.sum(axis=(1, 2))
+        all_monsters = left == monsters - flagged.sum(axis=(1, 2))
+        new_flags[all_monsters] |= unknown[all_monsters]
+        # Guess a random hidden square where nothing can be deduced
+        stuck = ~(new_flags | new_opens).any(axis=(1, 2)) & (left > 0)
+        if stuck.any():
+            new_opens[stuck] |= pick(rng, unknown[stuck])
+            guesses[active[stuck]] += 1
+        # A slip of the player, on one of the squares uncovered
+        if mistakes:
+            slipped = rng.random(len(active)) >= (1 - mistakes) ** new_opens.sum(axis=(1, 2))
+            slipped &= ~stuck & (left > 0)
+            if slipped.any():
+                new_opens[slipped] |= pick(rng, unknown[slipped])
+
+        touches[active] += 2 * new_flags.sum(axis=(1, 2)) + 3 * new_opens.sum(axis=(1, 2))
+        lost = (new_opens & mines).any(axis=(1, 2))
+        flagged |= new_flags
+        opened = flood(opened | (new_opens & ~mines), empty, mines)
+        finished = lost | ~(~opened & ~flagged).any(axis=(1, 2))
+        won[active[finished & ~lost]] = True
+        keep = ~finished
+        active, mines, counts, empty = active[keep], mines[keep], counts[keep], empty[keep]
+        opened, flagged = opened[keep], flagged[keep]
+    return {"won": won, "touches": touches, "guesses": guesses}
+
+
+def pick(rng: np.random.Generator, cells: np.ndarray) -> np.ndarray:
+    """One of the marked squares of every board, at random"""
+    keys = rng.random(cells.shape) * cells
+    picked = np.zeros(cells.shape, bool).reshape(len(cells), -1)
+    picked[np.arange(len(cells)), keys.reshape(len(cells), -1).argmax(axis=1)] = True
+    return picked.reshape(cells.shape)
+
+
+def check_against_engine(games: int = 500, seed: int = 0):
+    """The batched counts and flood fill give the same board as the device engine, for random boards and starts"""
+    rng = np.random.default_rng(seed)
+    randomness = random.Random(seed)
+    for width, height, monsters in ((10, 7, 10), (16, 11, 30), (5, 4, 3)):
+        mines, counts, _ = generate(rng, games, width, height, monsters)
+        for game in range(games):
+            board = Board(width, height)
+            for index in np.flatnonzero(mines[game]):
+                board.data[index] = MONSTERS[0]
+                for k in range(board.starts[index], board.starts[index + 1]):
+                    if board.data[board.neighbors[k]] not in MONSTERS:
+                        board.data[board.neighbors[k]] += 1
+            expected = np.where(mines[game], MONSTERS[0], counts[game]).ravel()
+            assert bytes(board.data) == bytes(expected.astype(np.uint8)), f"counts of board {game} differ"
+            # Uncover an empty square through the touches of the device, and with the batched flood fill
+            empty = np.flatnonzero((counts[game] == OPEN0) & ~mines[game])
+            if not len(empty):
+                continue
+            start = int(empty[randomness.randrange(len(empty))])
+            tiles = Tiles(board)
+            for _ in range(3):
+                assert tiles.touch(start)
+            opened = np.zeros((1, height, width), bool)
+            opened.reshape(-1)[start] = True
+            opened = flood(opened, counts[game:game + 1] == 0, mines[game:game + 1])
+            device = np.array([tile <= OPEN8 for tile in tiles.tiles]).reshape(1, height, width)
+            assert (device == opened).all(), f"flood fill of board {game} differs"
+            assert tiles.blank == width * height - opened.sum()
+
+
+def parse_range(text: str) -> list:
+    low, _, high = text.partition("-")
+    return list(range(int(low), int(high or low) + 1))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--games", type=int, default=1_000_000, help="games per configuration")
+    parser.add_argument("--sizes", default="10x7", help="board sizes, e.g. 10x7,12x8")
+    parser.add_argument("--monsters", default="6-14", help="numbers of monsters, e.g. 10 or 6-14")
+    parser.add_argument("--touch-seconds", type=float, default=0.6, help="time between two touches of the player")
+    parser.add_argument("--in-flight", type=int, default=1, help="experiments running at the same time (MAX_IN_FLIGHT)")
+    parser.add_argument("--mistakes", type=float, default=0.01,
+                        help="chance the player uncovers a random hidden square instead of a deduced one, per square")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    check_against_engine()
+    print(f"batched rules match the device engine ({time.perf_counter() - start:.1f} s)")
+    experiments_per_hour = args.in_flight * 3600 / EXPERIMENT_SECONDS
+    print(f"the stack runs {experiments_per_hour:.0f} experiments per hour ({args.in_flight} at a time, "
+          f"{EXPERIMENT_SECONDS / 60:.0f} min each)")
+    print(f"{'':>15} {'any board':^26} {'device: boards cleared without guessing':^44}".rstrip())
+    print(f"{'board':>6} {'monsters':>8} {'win %':>6} {'no guess %':>10} {'guesses':>8} {'win %':>6} {'touches':>8} "
+          f"{'game s':>7} {'losses/h':>9} {'admitted %':>10} {'boards/s':>9}")
+    rng = np.random.default_rng(args.seed)
+    for size in args.sizes.split(","):
+        width, height = (int(n) for n in size.split("x"))
+        for monsters in parse_range(args.monsters):
+            start = time.perf_counter()
+            won = guesses = no_guess = device_won = touches = 0
+            for offset in range(0, args.games, CHUNK_SIZE):
+                mines, counts, first = generate(rng, min(CHUNK_SIZE, args.games - offset), width, height, monsters)
+                results = play(rng, mines, counts, first, monsters)
+                won += int(results["won"].sum())
+                guesses += int(results["guesses"].sum())
+                # The boards the device keeps, played again with the mistakes of the player
+                kept = results["guesses"] == 0
+                no_guess += int(kept.sum())
+                if kept.any():
+                    device = play(rng, mines[kept], counts[kept], first[kept], monsters, args.mistakes)
+                    device_won += int(device["won"].sum())
+                    touches += int(device["touches"].sum())
+            elapsed = time.perf_counter() - start
+            row = f"{size:>6} {monsters:>8} {100 * won / args.games:>6.1f} {100 * no_guess / args.games:>10.1f} " \
+                  f"{guesses / args.games:>8.2f}"
+            marker = " <- device" if (width, height) == DEVICE_SIZE and monsters == DEVICE_MONSTERS else ""
+            if not no_guess:
+                # The device keeps a board which needs guessing when its budget runs out
+                print(f"{row} {'no board cleared without guessing':^44} {args.games / elapsed:>9.0f}{marker}")
+                continue
+            game_seconds = touches / no_guess * args.touch_seconds
+            # Losses of one device playing non stop, and the share of them the stack can run an experiment for
+            losses_per_hour = (1 - device_won / no_guess) * 3600 / (game_seconds + NEW_GAME_DELAY)
+            admitted = min(1, experiments_per_hour / losses_per_hour) if losses_per_hour else 1
+            print(f"{row} {100 * device_won / no_guess:>6.1f} {touches / no_guess:>8.1f} {game_seconds:>7.0f} "
+                  f"{losses_per_hour:>9.1f} {100 * admitted:>10.0f} {args.games / elapsed:>9.0f}{marker}")
+
+if __name__ == "__main__":
+    main()
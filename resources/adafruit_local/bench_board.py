@@ -0,0 +1,162 @@
+"""Host-side benchmark of the PyPortal game board: board reset and full reveal flood fill, against the previous
+implementation with nested bounds checks and x, y indexing, for board sizes up to well beyond the 10x7 of the device
+
+    python resources/adafruit_local/bench_board.py
+"""
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "adafruit"))
+from minesweeper import Board, BLANK, MONSTERS, OPEN0, OPEN8
+
+SIZES = ((10, 7), (20, 14), (40, 28), (80, 56))
+# Same monster density as the device: 10 monsters on 70 squares
+MONSTER_DENSITY = 1 / 7
+NB_ROUNDS = 20
+
+
+class LegacyBoard:
+    """The board functions of code.py before the neighbor table, with the board size as attributes"""
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.data = bytearray(width * height)
+
+    def get_data(self, x, y):
+        return self.data[y * self.width + x]
+
+    def set_data(self, x, y, value):
+        self.data[y * self.width + x] = value
+
+    def reset(self, how_many, number_of_monster_types):
+        for x in range(self.width):
+            for y in range(self.height):
+                self.set_data(x, y, 0)
+        for _ in range(how_many):
+            while True:
+                monster_x = random.randint(0, self.width - 1)
+                monster_y = random.randint(0, self.height - 1)
+                monster_type = 15 + random.randint(1, number_of_monster_types)
+                if self.get_data(monster_x, monster_y) == 0:
+                    self.set_data(monster_x, monster_y, monster_type)
+                    break
+        self.compute_counts()
+
+    def compute_counts(self):
+        for y in range(self.height):
+            for x in range(self.width):
+                if self.get_data(x, y) not in MONSTERS:
+                    continue
+                for dx in (-1, 0, 1):
+                    if x + dx < 0 or x + dx >= self.width:
+                        continue
+                    for dy in (-1, 0, 1):
+                        if y + dy < 0 or y + dy >= self.height:
+                            continue
+                        count = self.get_data(x + dx, y + dy)
+                        if count in MONSTERS:
+                            continue
+                        self.set_data(x + dx, y + dy, count + 1)
+
+    def expand_uncovered(self, tiles, start_x, start_y):
+        number_uncovered = 1
+        stack = [(start_x, start_y)]
+        while len(stack) > 0:
+            x, y = stack.pop()
+            if tiles[x, y] == BLANK:
+                under_the_tile = self.get_data(x, y)
+                if under_the_tile <= OPEN8:
+                    tiles[x, y] = under_the_tile
+                    number_uncovered += 1
+                    if under_the_tile == OPEN0:
+                        for dx in (-1, 0, 1):
+                            if x + dx < 0 or x + dx >= self.width:
+                                continue
+                            for dy in (-1, 0, 1):
+                                if y + dy < 0 or y + dy >= self.height:
+                                    continue
+                                if dx == 0 and dy == 0:
+                                    continue
+                                stack.append((x + dx, y + dy))
+        return number_uncovered
+
+
+class Tiles:
+    """Stand-in for the displayio TileGrid, indexed by x, y tuples or by flat index"""
+
+    def __init__(self, width, height):
+        self.width = width
+        self.tiles = bytearray([BLANK] * width * height)
+
+    def __getitem__(self, index):
+        if isinstance(index, tuple):
+            index = index[1] * self.width + index[0]
+        return self.tiles[index]
+
+    def __setitem__(self, index, value):
+        if isinstance(index, tuple):
+            index = index[1] * self.width + index[0]
+        self.tiles[index] = value
+
+
+def expected_counts(board) -> bytearray:
+    """Board data with the counts computed from scratch on the monster positions of the given board"""
+    legacy = LegacyBoard(board.width, board.height)
+    legacy.data = bytearray(value if value in MONSTERS else 0 for value in board.data)
+    legacy.compute_counts()
+    return legacy.data
+
+
+def timed(function, *args) -> float:
+    start = time.perf_counter()
+    function(*args)
+    return (time.perf_counter() - start) * 1000
+
+
+def main():
+    print(f"{'board':>7} | {'reset ms':>8} | {'legacy':>8} | {'reveal ms':>9} | {'legacy':>8} | {'pushes':>7} | {'legacy':>7}")
+    for width, height in SIZES:
+        number_of_monsters = int(width * height * MONSTER_DENSITY)
+        board, legacy = Board(width, height), LegacyBoard(width, height)
+        resets, legacy_resets = [], []
+        for _ in range(NB_ROUNDS):
+            resets.append(timed(board.reset, number_of_monsters, 4))
+            assert board.data == expected_counts(board), "the incremental counts differ from the full count"
+            legacy_resets.append(timed(legacy.reset, number_of_monsters, 4))
+
+        # A board without monsters is revealed entirely from one corner, the worst case of the flood fill
+        board.reset(0, 4)
+        legacy.reset(0, 4)
+        tiles, legacy_tiles = Tiles(width, height), Tiles(width, height)
+        reveal = timed(board.expand_uncovered, tiles, 0)
+        legacy_reveal = timed(legacy.expand_uncovered, legacy_tiles, 0, 0)
+        assert tiles.tiles == legacy_tiles.tiles
+        # Count the stack pushes separately, to keep the counting out of the timings
+        pushes = count_pushes(lambda tiles: board.expand_uncovered(tiles, 0), Tiles(width, height))
+        legacy_pushes = count_pushes(lambda tiles: legacy.expand_uncovered(tiles, 0, 0), Tiles(width, height))
+        print(f"{width:>3}x{height:<3} | {sorted(resets)[NB_ROUNDS // 2]:8.2f} | {sorted(legacy_resets)[NB_ROUNDS // 2]:8.2f} | "
+              f"{reveal:9.2f} | {legacy_reveal:8.2f} | {pushes:>7} | {legacy_pushes:>7}")
+
+
+def count_pushes(call, tiles) -> int:
+    """Number of cells pushed on the flood fill stack, traced through the list appends of the call"""
+    pushes = 0
+
+    def tracer(frame, event, arg):
+        nonlocal pushes
+        if event == "c_call" and getattr(arg, "__name__", None) == "append":
+            pushes += 1
+
+    sys.setprofile(tracer)
+    try:
+        call(tiles)
+    finally:
+        sys.setprofile(None)
+    return pushes
+
+
+if __name__ == "__main__":
+    main()
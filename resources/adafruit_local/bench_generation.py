@@ -0,0 +1,142 @@
+"""Host-side benchmark of the PyPortal board generation: boards per second of the sampling without replacement
+against the previous rejection sampling, as the density of monsters rises, and of the generation of boards which can be
+cleared without guessing from the first touch.
+
+The generated boards are checked: the right number of monsters, none on the first touched square or around it, and
+the counts of the squares. The boards the solver accepts are played by a player who never guesses, which must clear
+them all.
+
+    python resources/adafruit_local/bench_generation.py
+"""
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "adafruit"))
+from minesweeper import Board, Tiles, MONSTERS, MONSTERFLAGGED, BLANK, OPEN0, OPEN8
+from bench_board import expected_counts
+
+SIZES = ((10, 7), (40, 28))
+WIDTH, HEIGHT = 10, 7
+DEVICE_MONSTERS = 10
+MONSTER_TYPES = 4
+DENSITIES = (1 / 7, 0.3, 0.6, 0.9)
+NB_BOARDS = 400
+NB_ROUNDS = 5
+NB_GAMES = 2000
+
+
+def rejection_sampling(board, how_many, number_of_monster_types):
+    """seed_monsters before the sampling without replacement: random squares until an empty one is drawn"""
+    data = board.data
+    for i in range(board.size):
+        data[i] = 0
+    for _ in range(how_many):
+        while True:
+            monster = random.randint(0, board.size - 1)
+            if data[monster] not in MONSTERS:
+                break
+        data[monster] = 15 + random.randint(1, number_of_monster_types)
+        for k in range(board.starts[monster], board.starts[monster + 1]):
+            neighbor = board.neighbors[k]
+            if data[neighbor] not in MONSTERS:
+                data[neighbor] += 1
+
+
+def boards_per_second(generate) -> float:
+    """Best of the rounds, to keep the noise of the host out"""
+    durations = []
+    for _ in range(NB_ROUNDS):
+        start = time.perf_counter()
+        for _ in range(NB_BOARDS):
+            generate()
+        durations.append(time.perf_counter() - start)
+    return NB_BOARDS / min(durations)
+
+
+def play_without_guessing(board, start, number_of_monsters) -> bool:
+    """Play the board through the touches of the device, flagging and uncovering only what the numbers prove"""
+    tiles = Tiles(board)
+
+    def uncover(index):
+        # Question mark, flag, uncover
+        return tiles.touch(index) and tiles.touch(index) and tiles.touch(index)
+
+    assert uncover(start), "monster on the first touched square"
+    while tiles.check_for_win() is None:
+        progress = False
+        for i in range(board.size):
+            if tiles[i] == OPEN0 or tiles[i] > OPEN8:
+                continue
+            around = [board.neighbors[k] for k in range(board.starts[i], board.starts[i + 1])]
+            covered = [n for n in around if tiles[n] == BLANK]
+            flags = sum(1 for n in around if tiles[n] == MONSTERFLAGGED)
+            if covered and tiles[i] == flags + len(covered):
+                for n in covered:
+                    tiles.touch(n)
+                    tiles.touch(n)
+                progress = True
+            elif covered and tiles[i] == flags:
+                for n in covered:
+                    assert uncover(n), "monster on a square proven safe"
+                progress = True
+        if not progress:
+            covered = [i for i in range(board.size) if tiles[i] == BLANK]
+            monsters_left = number_of_monsters - sum(1 for tile in tiles.tiles if tile == MONSTERFLAGGED)
+            if monsters_left == len(covered):
+                # The monsters no number touches, walled in by other monsters
+                for n in covered:
+                    tiles.touch(n)
+                    tiles.touch(n)
+            elif not monsters_left:
+                # All the monsters flagged: the covered squares left are safe
+                for n in covered:
+                    assert uncover(n), "monster on a square proven safe"
+            else:
+                return False
+    return tiles.check_for_win() is True
+
+
+def main():
+    print("boards per second")
+    print(f"{'board':>7} | {'monsters':>8} | {'rejection':>9} | {'without replacement':>19} | {'with a safe start':>17}")
+    for width, height in SIZES:
+        board = Board(width, height)
+        for density in DENSITIES:
+            how_many = int(board.size * density)
+            start = random.randrange(board.size)
+            rejection = boards_per_second(lambda: rejection_sampling(board, how_many, MONSTER_TYPES))
+            sampling = boards_per_second(lambda: board.reset(how_many, MONSTER_TYPES))
+            safe = boards_per_second(lambda: board.reset(how_many, MONSTER_TYPES, start))
+            for _ in range(100):
+                start = random.randrange(board.size)
+                board.reset(how_many, MONSTER_TYPES, start)
+                assert sum(1 for value in board.data if value in MONSTERS) == how_many
+                assert board.data == expected_counts(board), "the counts differ from the full count"
+                assert board.data[start] not in MONSTERS
+                if board.size - 1 - (board.starts[start + 1] - board.starts[start]) >= how_many:
+                    assert all(board.data[board.neighbors[k]] not in MONSTERS
+                               for k in range(board.starts[start], board.starts[start + 1]))
+            print(f"{width:>3}x{height:<3} | {how_many:>8} | {rejection:9.0f} | {sampling:19.0f} | {safe:17.0f}")
+
+    board = Board(WIDTH, HEIGHT)
+    print(f"\n{NB_GAMES} games of {DEVICE_MONSTERS} monsters on {WIDTH}x{HEIGHT}, boards which can be cleared without guessing")
+    print(f"{'budget ms':>9} | {'no guess %':>10} | {'mean draws':>10} | {'worst draws':>11} | {'mean ms':>7} | {'worst ms':>8}")
+    for budget in (0, 0.001, 0.01, 0.2):
+        solved, draws, durations = 0, [], []
+        for _ in range(NB_GAMES):
+            start = random.randrange(board.size)
+            began = time.perf_counter()
+            solvable, attempts = board.generate(DEVICE_MONSTERS, MONSTER_TYPES, start, budget)
+            durations.append((time.perf_counter() - began) * 1000)
+            draws.append(attempts)
+            solved += solvable
+            if solvable:
+                assert play_without_guessing(board, start, DEVICE_MONSTERS), "the solver accepted a board which needs a guess"
+        print(f"{budget * 1000:9.0f} | {100 * solved / NB_GAMES:10.1f} | {sum(draws) / NB_GAMES:10.1f} | "
+              f"{max(draws):11} | {sum(durations) / NB_GAMES:7.2f} | {max(durations):8.2f}")
+
+
+if __name__ == "__main__":
+    main()
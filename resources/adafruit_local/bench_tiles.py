@@ -0,0 +1,122 @@
+"""Host-side simulation of PyPortal games with random touches: TileGrid accesses and win check cost of the shadow
+tiles, against the previous game which read and wrote the TileGrid directly
+
+    python resources/adafruit_local/bench_tiles.py
+"""
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "adafruit"))
+from minesweeper import (Board, Tiles, OPEN0, OPEN8, BLANK, MONSTERFLAGGED, MONSTERMISFLAGGED, MONSTERQUESTION,
+                         MONSTERS, MONSTERDEATH)
+
+NB_GAMES = 200
+WIDTH, HEIGHT = 10, 7
+NUMBER_OF_MONSTERS = 10
+
+
+class TileGrid:
+    """Stand-in for the displayio TileGrid counting the reads and writes, which go through the display API"""
+
+    def __init__(self, size):
+        self.tiles = bytearray([BLANK] * size)
+        self.reads = 0
+        self.writes = 0
+
+    def __getitem__(self, index):
+        self.reads += 1
+        return self.tiles[index]
+
+    def __setitem__(self, index, value):
+        self.writes += 1
+        self.tiles[index] = value
+
+
+def legacy_check_for_win(board, tiles):
+    """The win check reading the TileGrid twice, as it was run on every touch tick"""
+    for i in range(board.size):
+        if tiles[i] == BLANK or tiles[i] == MONSTERQUESTION:
+            return None
+    for i in range(board.size):
+        if tiles[i] == MONSTERFLAGGED and board.data[i] not in MONSTERS:
+            return False
+    return True
+
+
+def touch(board, tiles, index):
+    """One touch of the game loop of code.py. Returns False when the game is lost"""
+    if tiles[index] == BLANK:
+        tiles[index] = MONSTERQUESTION
+    elif tiles[index] == MONSTERQUESTION:
+        tiles[index] = MONSTERFLAGGED
+    elif tiles[index] == MONSTERFLAGGED:
+        under_the_tile = board.data[index]
+        if under_the_tile in MONSTERS:
+            tiles[index] = MONSTERDEATH[under_the_tile - 16]
+            board.data[index] = MONSTERDEATH[under_the_tile - 16]
+            return False
+        elif OPEN0 < under_the_tile <= OPEN8:
+            tiles[index] = under_the_tile
+        elif under_the_tile == OPEN0:
+            tiles[index] = BLANK
+            board.expand_uncovered(tiles, index)
+    return True
+
+
+def play(shadow: bool, seed: int) -> dict:
+    random.seed(seed)
+    board = Board(WIDTH, HEIGHT)
+    tilegrid = TileGrid(board.size)
+    game_tiles = Tiles(board)
+    board.reset(NUMBER_OF_MONSTERS, 4)
+    # A player who knows where the monsters are, and sometimes flags a wrong square
+    touches = [i for i in range(board.size) for _ in range(3 if board.data[i] <= OPEN8 else 2)]
+    touches += random.sample(range(board.size), 5)
+    random.shuffle(touches)
+    check_seconds = 0
+    ticks = 0
+    for index in touches:
+        ticks += 1
+        if shadow:
+            alive = touch(board, game_tiles, index)
+            game_tiles.flush(tilegrid)
+            start = time.perf_counter()
+            status = game_tiles.check_for_win()
+            check_seconds += time.perf_counter() - start
+            assert status == legacy_check_for_win(board, game_tiles.tiles)
+        else:
+            alive = touch(board, tilegrid, index)
+            start = time.perf_counter()
+            status = legacy_check_for_win(board, tilegrid)
+            check_seconds += time.perf_counter() - start
+        if not alive or status is not None:
+            break
+    if shadow:
+        game_tiles.reveal()
+        game_tiles.flush(tilegrid)
+    else:
+        for i in range(board.size):
+            if tilegrid[i] == MONSTERFLAGGED and board.data[i] not in MONSTERS:
+                tilegrid[i] = MONSTERMISFLAGGED
+            else:
+                tilegrid[i] = board.data[i]
+    return {"reads": tilegrid.reads, "writes": tilegrid.writes, "ticks": ticks, "check_seconds": check_seconds,
+            "tiles": bytes(tilegrid.tiles)}
+
+
+def main():
+    totals = {}
+    for shadow in (False, True):
+        results = [play(shadow, seed) for seed in range(NB_GAMES)]
+        totals[shadow] = results
+        ticks = sum(r["ticks"] for r in results)
+        print(f"{'shadow tiles' if shadow else 'TileGrid':>12}: {sum(r['reads'] for r in results) / NB_GAMES:7.1f} reads "
+              f"and {sum(r['writes'] for r in results) / NB_GAMES:6.1f} writes per game, win check "
+              f"{sum(r['check_seconds'] for r in results) / ticks * 1e6:6.2f} us per touch tick")
+    assert [r["tiles"] for r in totals[False]] == [r["tiles"] for r in totals[True]], "the final screens differ"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""Host-side check of the PyPortal asset manager on the real sounds and images of the game, with stand-ins for the
+CircuitPython audio and display modules.
+
+The WAV and BMP headers are parsed as the wave module and the image sizes say, and the preloaded samples are the ones
+of the file. Then, for several memory budgets, the assets which are preloaded and those streamed from the flash, and
+the files opened when a game ends, against opening the sound at every game end as code.py used to.
+
+    python resources/adafruit_local/check_assets.py
+"""
+import os
+import sys
+import types
+import wave
+import builtins
+
+ADAFRUIT_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "adafruit")
+sys.path.append(ADAFRUIT_PATH)
+# Free RAM once the libraries of code.py are imported, on a PyPortal and on a board with PSRAM
+BOARDS = {"PyPortal": 120 * 1024, "with PSRAM": 2048 * 1024}
+RESERVE = 48 * 1024
+BUDGETS = (0, 64 * 1024, 192 * 1024, 512 * 1024)
+SPRITE_SHEET = "/images/SpriteSheet.bmp"
+SPLASH_SCREEN = "/images/main.bmp"
+WIN_SOUND = "sounds/win.wav"
+LOSE_SOUND = "sounds/lose.wav"
+GAMES = 10
+
+
+class Sample:
+    """RawSample and WaveFile stand-in, which keeps what it is given"""
+
+    def __init__(self, source, *args, **kwargs):
+        self.source = source
+        self.kwargs = kwargs
+
+
+class Image:
+    def __init__(self, file=None):
+        self.file = file
+
+
+sys.modules.update({
+    "displayio": types.SimpleNamespace(Bitmap=Image, Palette=Image, OnDiskBitmap=Image, ColorConverter=Image),
+    "adafruit_imageload": types.SimpleNamespace(load=lambda path, **kwargs: (Image(), Image())),
+    "audioio": types.SimpleNamespace(RawSample=Sample, WaveFile=Sample),
+})
+import assets  # noqa: E402
+
+opened = []
+host_open = builtins.open
+
+
+def circuitpy_open(path, *args, **kwargs):
+    """The files of the CIRCUITPY drive, opened with absolute paths on the device"""
+    opened.append(path)
+    return host_open(os.path.join(ADAFRUIT_PATH, path.lstrip("/")), *args, **kwargs)
+
+
+def check_formats():
+    for path in (WIN_SOUND, LOSE_SOUND):
+        with circuitpy_open(path, "rb") as f:
+            channels, rate, bits, offset, size = assets.wave_format(f)
+        with wave.open(host_open(os.path.join(ADAFRUIT_PATH, path), "rb")) as w:
+            assert (channels, rate, bits // 8) == (w.getnchannels(), w.getframerate(), w.getsampwidth())
+            assert size == w.getnframes() * w.getsampwidth() * w.getnchannels()
+            frames = w.readframes(w.getnframes())
+        manager = assets.Assets(budget=size, reserve=0)
+        sample = manager.sound(path)
+        assert manager.preloaded(path) and sample.source.tobytes() == frames, f"{path}: samples differ"
+        assert sample.kwargs == {"channel_count": channels, "sample_rate": rate}
+        print(f"{path}: {channels} channel, {rate} Hz, {bits} bits, {size} bytes of samples at {offset}")
+    for path in (SPRITE_SHEET, SPLASH_SCREEN):
+        with circuitpy_open(path, "rb") as f:
+            size = assets.bitmap_size(f)
+            header = f.read(30)
+        width, height = int.from_bytes(header[18:22], "little"), int.from_bytes(header[22:26], "little")
+        print(f"{path}: {width}x{height}, {size} bytes as a Bitmap")
+
+
+def plan(name: str, free_ram: int, budget: int):
+    """Assets preloaded with the budget on a board, and the files opened by the game ends"""
+    manager = assets.Assets(budget, RESERVE, mem_free=lambda: free_ram - manager.used)
+    manager.load(SPRITE_SHEET, LOSE_SOUND, WIN_SOUND, SPLASH_SCREEN)
+    manager.release(SPLASH_SCREEN)
+    del opened[:]
+    for game in range(GAMES):
+        manager.sound(LOSE_SOUND if game % 2 else WIN_SOUND)
+    in_ram = [os.path.basename(path) for path in manager.sounds if manager.preloaded(path)]
+    in_ram += [os.path.basename(path) for path in manager.images if manager.preloaded(path)]
+    print(f"{name:>10} | {budget // 1024:>6} KiB | {manager.used // 1024:>6} KiB | {manager.free_before // 1024:>5} -> "
+          f"{manager.free_after // 1024:>4} KiB | {', '.join(in_ram) or '-':<36} | {len(opened) / GAMES:.0f}")
+    return manager
+
+
+def main():
+    builtins.open = circuitpy_open
+    try:
+        check_formats()
+        print(f"\n{RESERVE // 1024} KiB kept free for the network, code.py used to open 1 file at every game end")
+        print(f"{'board':>10} | {'budget':>10} | {'in RAM':>10} | {'free':>17} | {'preloaded':<36} | "
+              f"files opened per game end")
+        for name, free_ram in BOARDS.items():
+            for budget in BUDGETS:
+                manager = plan(name, free_ram, budget)
+                assert manager.free_after >= RESERVE
+                assert SPLASH_SCREEN not in manager.files
+    finally:
+        builtins.open = host_open
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,403 @@
+"""Host-side simulation of the PyPortal game loop, with mocked hardware and a virtual clock.
+
+code.py runs unchanged against stand-ins for the display, the touch screen, the speaker and AWS IoT. A scripted player
+presses random tiles, and the broker answers slowly on the socket handed to MiniMQTT. The input latency is the time
+between a press and the first tile written to the TileGrid after it, the presses between two games wait for the next
+one. Every call to time.monotonic() costs a little virtual time, so that a busy loop advances the clock as it would on
+the device.
+
+The broker can also lose a share of the acknowledgements of the published messages, to check that every game result
+recorded in the outbox is eventually published.
+
+    python resources/adafruit_local/simulate_game.py [--seconds 600] [--broker-latency 1.5] [--lost-acks 0.2]
+                                                     [--code path/to/code.py]
+"""
+import os
+import json
+import errno
+import sys
+import builtins
+import time
+import types
+import random
+import argparse
+import statistics
+
+ADAFRUIT_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "adafruit")
+# Virtual time spent by each call to time.monotonic() and by each check of audio.playing
+CALL_COST_SECONDS = 20e-6
+PRESS_SECONDS = 0.15
+SOUND_SECONDS = 1.5
+
+
+class StopSimulation(Exception):
+    pass
+
+
+class VirtualClock:
+    def __init__(self, duration: float):
+        self.now = 0.0
+        self.duration = duration
+
+    def advance(self, seconds: float):
+        self.now += seconds
+        if self.now > self.duration:
+            raise StopSimulation()
+
+    def monotonic(self) -> float:
+        self.advance(CALL_COST_SECONDS)
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.advance(max(seconds, 0))
+
+
+class Anything:
+    """Accepts any constructor arguments, attribute or call, for the hardware the simulation doesn't look at"""
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __getattr__(self, name):
+        return Anything()
+
+    def __call__(self, *args, **kwargs):
+        return Anything()
+
+
+class Display(Anything):
+    width = 320
+    height = 240
+    auto_refresh = True
+
+
+class TileGrid(Anything):
+    def __init__(self, bitmap=None, width=1, height=1, default_tile=0, **kwargs):
+        self.width = width
+        self.tiles = bytearray([default_tile] * width * height)
+        self.x = 0
+        self.y = 0
+        self.writes = []
+
+    def _index(self, index):
+        return index[1] * self.width + index[0] if isinstance(index, tuple) else index
+
+    def __getitem__(self, index):
+        return self.tiles[self._index(index)]
+
+    def __setitem__(self, index, value):
+        self.tiles[self._index(index)] = value
+        self.writes.append(SIMULATION.clock.now)
+
+
+class Player:
+    """Presses a random tile which isn't open yet every few seconds, whether the screen is sampled or not"""
+
+    def __init__(self, clock: VirtualClock, rng: random.Random):
+        self.clock = clock
+        self.rng = rng
+        self.presses = []
+        # The presses made while no tile was left to open, before the next game
+        self.between_games = set()
+        self.missed = 0
+        self.next_press = 2.0
+        self.point = None
+        self.release_at = 0
+
+    def touch_point(self):
+        now = self.clock.now
+        if self.point is not None and now >= self.release_at:
+            self.point = None
+        # The presses which started and ended while the screen wasn't sampled
+        while self.point is None and now >= self.next_press + PRESS_SECONDS:
+            self.missed += 1
+            self.next_press += PRESS_SECONDS + self.rng.uniform(0.5, 3)
+        if self.point is None and now >= self.next_press:
+            tilegrid = SIMULATION.tilegrid
+            closed = [i for i, tile in enumerate(tilegrid.tiles) if tile in (9, 11, 13)]
+            index = self.rng.choice(closed or range(len(tilegrid.tiles)))
+            if not closed:
+                self.between_games.add(self.next_press)
+            self.point = ((index % tilegrid.width) * 32 + 16, (index // tilegrid.width) * 32 + 16, 20000)
+            self.presses.append(self.next_press)
+            self.release_at = self.next_press + PRESS_SECONDS
+            self.next_press += PRESS_SECONDS + self.rng.uniform(0.5, 3)
+        return self.point
+
+
+class Touchscreen(Anything):
+    @property
+    def touch_point(self):
+        return SIMULATION.player.touch_point()
+
+
+class AudioOut(Anything):
+    def __init__(self, *args, **kwargs):
+        self.until = 0
+
+    def play(self, wave):
+        self.until = SIMULATION.clock.now + SOUND_SECONDS
+
+    @property
+    def playing(self):
+        SIMULATION.clock.advance(CALL_COST_SECONDS)
+        return SIMULATION.clock.now < self.until
+
+
+class MqttError(Exception):
+    pass
+
+
+class ReadyPin:
+    def __init__(self, esp: "Esp32"):
+        self.esp = esp
+
+    @property
+    def value(self) -> bool:
+        SIMULATION.clock.advance(CALL_COST_SECONDS)
+        return SIMULATION.clock.now < self.esp.busy_until
+
+
+class Esp32:
+    """The ESP32 co-processor, which raises its ready pin while it works on a command. The driver waits for the pin to
+    go low, the time it takes is spent at once"""
+    firmware_version = b"1.7.4"
+
+    def __init__(self):
+        self.busy_until = 0.0
+        self._ready = ReadyPin(self)
+
+    def set_certificate(self, certificate):
+        pass
+
+    def set_private_key(self, key):
+        pass
+
+    def _wait_for_ready(self):
+        SIMULATION.clock.advance(max(self.busy_until - SIMULATION.clock.now, 0))
+
+
+class BrokerSocket:
+    """The socket to the broker, which answers each message after the given latency, or never for a lost one.
+    Connecting keeps the ESP32 busy for the latency, as the TLS handshake it makes. A read waits for the answer up to
+    the timeout set on the socket, and returns nothing if it isn't there by then. The bytes available are known without
+    waiting"""
+
+    def __init__(self, *args, **kwargs):
+        self.timeout = None
+        self.reply_at = None
+
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+    def connect(self, *args, **kwargs):
+        SIMULATION.esp.busy_until = SIMULATION.clock.now + SIMULATION.broker_latency
+        SIMULATION.esp._wait_for_ready()
+
+    def send(self, data, lost: bool = False):
+        self.reply_at = None if lost else SIMULATION.clock.now + SIMULATION.broker_latency
+        return len(data)
+
+    def available(self) -> int:
+        SIMULATION.clock.advance(CALL_COST_SECONDS)
+        return int(self.reply_at is not None and self.reply_at <= SIMULATION.clock.now)
+
+    def recv(self, bufsize):
+        clock = SIMULATION.clock
+        if self.reply_at is not None and (self.timeout is None or self.reply_at <= clock.now + self.timeout):
+            clock.advance(max(self.reply_at - clock.now, 0))
+            self.reply_at = None
+            return b"\x00"
+        if self.timeout is None:
+            raise StopSimulation()
+        clock.advance(self.timeout)
+        return b""
+
+    def close(self):
+        pass
+
+
+class AwsIot(Anything):
+    """Sends each call as a message on a socket of the pool given to MiniMQTT, and waits for the answer as MiniMQTT
+    does: reads of one second up to a timeout of ten seconds. Some acknowledgements of the messages are lost"""
+
+    def __init__(self, *args, **kwargs):
+        self.calls = {}
+        self.published = []
+        self.lost_acks = 0
+        self.socket = None
+
+    def _call(self, name: str, lost: bool = False):
+        self.calls[name] = self.calls.get(name, 0) + 1
+        self.socket.send(name.encode(), lost)
+        self.socket.settimeout(1.0)
+        start = SIMULATION.clock.now
+        while SIMULATION.clock.now - start < 10.0:
+            try:
+                if self.socket.recv(1):
+                    return
+            except OSError as e:
+                if e.args[0] not in (errno.ETIMEDOUT, errno.EAGAIN):
+                    raise
+        raise MqttError(f"{name} not acknowledged")
+
+    def connect(self, *args, **kwargs):
+        self.socket = SIMULATION.socket_pool.socket()
+        self.socket.connect(("broker", 8883))
+        self._call("connect")
+
+    def loop(self, *args, **kwargs):
+        self._call("loop")
+
+    def publish(self, topic, payload, *args, **kwargs):
+        self.published.append((SIMULATION.clock.now, payload))
+        lost = SIMULATION.rng.random() < SIMULATION.lost_acks
+        self.lost_acks += lost
+        self._call("publish", lost)
+
+
+def module(name: str, **attributes) -> types.ModuleType:
+    fake = types.ModuleType(name)
+    fake.__getattr__ = lambda attribute: Anything()
+    fake.__dict__.update(attributes)
+    return fake
+
+
+def install_hardware():
+    """Register the stand-ins of the CircuitPython modules imported by code.py"""
+    esp32spi = module("adafruit_esp32spi.adafruit_esp32spi", ESP_SPIcontrol=lambda *args, **kwargs: SIMULATION.esp)
+    esp32spi_socket = module("adafruit_esp32spi.adafruit_esp32spi_socket", socket=BrokerSocket)
+    minimqtt = module("adafruit_minimqtt.adafruit_minimqtt", MQTT=lambda **kwargs: types.SimpleNamespace(**kwargs),
+                      MMQTTException=MqttError,
+                      set_socket=lambda pool, *args: setattr(SIMULATION, "socket_pool", pool))
+    fakes = {
+        "board": module("board", DISPLAY=Display()),
+        "microcontroller": module("microcontroller", nvm=bytearray(8192)),
+        "displayio": module("displayio", TileGrid=lambda *args, **kwargs: SIMULATION.create_tilegrid(*args, **kwargs)),
+        "audioio": module("audioio", AudioOut=lambda *args: SIMULATION.audio),
+        "audiocore": module("audiocore", WaveFile=Anything),
+        "adafruit_imageload": module("adafruit_imageload", load=lambda *args, **kwargs: (Anything(), Anything())),
+        "adafruit_touchscreen": module("adafruit_touchscreen", Touchscreen=Touchscreen),
+        "adafruit_esp32spi": module("adafruit_esp32spi", adafruit_esp32spi=esp32spi,
+                                    adafruit_esp32spi_socket=esp32spi_socket),
+        "adafruit_esp32spi.adafruit_esp32spi": esp32spi,
+        "adafruit_esp32spi.adafruit_esp32spi_wifimanager": module("adafruit_esp32spi.adafruit_esp32spi_wifimanager"),
+        "adafruit_esp32spi.adafruit_esp32spi_socket": esp32spi_socket,
+        "adafruit_minimqtt": module("adafruit_minimqtt", adafruit_minimqtt=minimqtt),
+        "adafruit_minimqtt.adafruit_minimqtt": minimqtt,
+        "adafruit_aws_iot": module("adafruit_aws_iot", MQTT_CLIENT=lambda client: SIMULATION.aws_iot,
+                                   AWS_IOT_ERROR=MqttError),
+        "adafruit_seesaw": module("adafruit_seesaw"),
+        "adafruit_seesaw.seesaw": module("adafruit_seesaw.seesaw"),
+    }
+    for name in ("busio", "digitalio", "neopixel"):
+        fakes[name] = module(name)
+    sys.modules.update(fakes)
+    # The secrets of the device, not the standard library module
+    sys.modules.pop("secrets", None)
+
+
+class Simulation:
+    def __init__(self, duration: float, broker_latency: float, lost_acks: float, seed: int):
+        self.clock = VirtualClock(duration)
+        self.rng = random.Random(seed + 1)
+        self.player = Player(self.clock, random.Random(seed))
+        self.audio = AudioOut()
+        self.aws_iot = AwsIot()
+        self.esp = Esp32()
+        self.broker_latency = broker_latency
+        self.lost_acks = lost_acks
+        self.tilegrid = None
+        self.socket_pool = None
+
+    def create_tilegrid(self, *args, **kwargs):
+        if "width" not in kwargs:
+            return Anything()
+        self.tilegrid = TileGrid(*args, **kwargs)
+        return self.tilegrid
+
+    def run(self, code_path: str) -> dict:
+        install_hardware()
+        with open(code_path) as f:
+            code = compile(f.read(), code_path, "exec")
+        monotonic, sleep = time.monotonic, time.sleep
+        time.monotonic, time.sleep = self.clock.monotonic, self.clock.sleep
+        sys.path.insert(0, os.path.dirname(code_path))
+        cwd = os.getcwd()
+        os.chdir(os.path.dirname(code_path))
+        # The files of the CIRCUITPY drive are opened with absolute paths, by code.py and by the modules it imports
+        host_open = builtins.open
+        namespace = {"__name__": "__main__", "__file__": code_path}
+        stdout = sys.stdout
+        try:
+            sys.stdout = open(os.devnull, "w")
+            builtins.open = lambda path, *args, **kwargs: host_open(path.lstrip("/"), *args, **kwargs)
+            exec(code, namespace)
+        except StopSimulation:
+            pass
+        finally:
+            builtins.open = host_open
+            sys.stdout.close()
+            sys.stdout = stdout
+            time.monotonic, time.sleep = monotonic, sleep
+            os.chdir(cwd)
+            sys.path.remove(os.path.dirname(code_path))
+        return namespace
+
+    def input_latencies(self, during_games: bool = False) -> list:
+        """Time from each press to the first tile written after it, for the presses which got a response"""
+        latencies = []
+        writes = iter(self.tilegrid.writes)
+        write = next(writes, None)
+        for press in self.player.presses:
+            while write is not None and write < press:
+                write = next(writes, None)
+            if write is not None and not (during_games and press in self.player.between_games):
+                latencies.append(write - press)
+        return latencies
+
+    def published_results(self) -> tuple:
+        """Number of results published, and the sorted distinct sequence numbers among them"""
+        results = [result["seq"] for _, payload in self.aws_iot.published for result in json.loads(payload)["results"]]
+        return len(results), sorted(set(results))
+
+
+SIMULATION = None
+
+
+def main():
+    global SIMULATION
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--seconds", type=float, default=600)
+    parser.add_argument("--broker-latency", type=float, default=1.5)
+    parser.add_argument("--lost-acks", type=float, default=0.0)
+    parser.add_argument("--code", default=os.path.join(ADAFRUIT_PATH, "code.py"))
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    SIMULATION = Simulation(args.seconds, args.broker_latency, args.lost_acks, args.seed)
+    namespace = SIMULATION.run(os.path.abspath(args.code))
+    latencies = sorted(SIMULATION.input_latencies())
+    print(f"{args.seconds:.0f} s simulated with a broker answering in {args.broker_latency} s: "
+          f"{len(SIMULATION.player.presses) + SIMULATION.player.missed} presses, {SIMULATION.player.missed} missed, "
+          f"{len(latencies)} answered, "
+          f"{len(SIMULATION.aws_iot.published)} results published, broker calls {SIMULATION.aws_iot.calls}")
+    print(f"input latency: median {statistics.median(latencies) * 1000:.0f} ms, "
+          f"p95 {latencies[int(len(latencies) * 0.95)] * 1000:.0f} ms, worst {latencies[-1] * 1000:.0f} ms, "
+          f"worst during the games {max(SIMULATION.input_latencies(during_games=True)) * 1000:.0f} ms")
+    if "outbox" in namespace:
+        outbox = namespace["outbox"]
+        published, distinct = SIMULATION.published_results()
+        print(f"outbox: {outbox.next_seq - 1} results recorded, {len(outbox)} waiting, {published} published "
+              f"({len(distinct)} distinct), {SIMULATION.aws_iot.lost_acks} acknowledgements lost")
+        if distinct != list(range(1, len(distinct) + 1)) or len(distinct) + len(outbox) != outbox.next_seq - 1:
+            print("  some results were never published")
+    if "scheduler" in namespace:
+        for task in namespace["scheduler"].timings.values():
+            print(f"  {task.name:>15}: {task.duration.count:6} steps, {task.duration.mean * 1000:7.2f} ms mean, "
+                  f"{task.duration.worst * 1000:7.1f} ms worst, {task.lateness.worst * 1000:7.1f} ms worst lateness, "
+                  f"{task.overruns} over budget")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+import time
+from aws_lambda_powertools import Logger
+
+logger = Logger(child=True)
+
+DEVICE = "device"
+PLAYER = "player"
+HOUR = "hour"
+DAY = "day"
+BUCKET_FORMATS = {HOUR: "%Y%m%d%H", DAY: "%Y%m%d"}
+# DynamoDB limit of items in one transaction
+MAX_TRANSACTION_ITEMS = 100
+
+
+def board_id(kind: str, period: str, received_at: int) -> str:
+    """The leaderboard of the devices or the players for the UTC hour or day of a time in milliseconds"""
+    return f"{kind}#{period}#{time.strftime(BUCKET_FORMATS[period], time.gmtime(received_at / 1000))}"
+
+
+class Leaderboard:
+    """Per-device and per-player won/lost counters, pre-aggregated by hour and by day.
+
+    Each counter is one item "lb#<board>#<name>", with the board id "<kind>#<period>#<bucket>" in the "board"
+    attribute. The table index on board and won serves the top of a board with one Query, without scanning. A game
+    result updates at most four counters, plus a marker item which drops the results published more than once, all in
+    one transaction. The results of a message are recorded together when none of them is a duplicate, so that a batch
+    of results from a device costs one transaction.
+    """
+
+    def __init__(self, table, hour_ttl_seconds: int = 2 * 24 * 3600, day_ttl_seconds: int = 90 * 24 * 3600,
+                 marker_ttl_seconds: int = 7 * 24 * 3600):
+        self.table = table
+        self.ttl_seconds = {HOUR: hour_ttl_seconds, DAY: day_ttl_seconds}
+        self.marker_ttl_seconds = marker_ttl_seconds
+
+    @staticmethod
+    def marker_key(result: dict) -> str:
+        # The results without sequence number are only recorded once per SQS message
+        return f"result#{result.get('clientId')}#{result.get('seq') or 'msg#' + result.get('messageId')}"
+
+    def counters(self, results: list) -> dict:
+        """The won and lost increments of the counters updated by the results, by item key"""
+        counters = {}
+        for result in results:
+            for kind, name in ((DEVICE, result.get("clientId")), (PLAYER, result.get("player"))):
+                if not name:
+                    continue
+                for period in BUCKET_FORMATS:
+                    board = board_id(kind, period, result.get("receivedAt"))
+                    counter = counters.setdefault(f"lb#{board}#{name}", {
+                        "board": board, "name": name, "period": period, "won": 0, "lost": 0})
+                    counter["won" if result.get("won") else "lost"] += 1
+        return counters
+
+    def transaction(self, results: list, now: int) -> list:
+        """The items of the transaction recording the results, in the low-level format of the client"""
+        items = [{"Put": {
+            "TableName": self.table.name,
+            "Item": {"pk": {"S": self.marker_key(result)}, "expiresAt": {"N": str(now + self.marker_ttl_seconds)}},
+            "ConditionExpression": "attribute_not_exists(pk)",
+        }} for result in results]
+        for key, counter in self.counters(results).items():
+            items.append({"Update": {
+                "TableName": self.table.name,
+                "Key": {"pk": {"S": key}},
+                "UpdateExpression": "SET board = :board, #name = :name, expiresAt = :expiresAt ADD won :won, lost :lost",
+                "ExpressionAttributeNames": {"#name": "name"},
+                "ExpressionAttributeValues": {
+                    ":board": {"S": counter["board"]},
+                    ":name": {"S": counter["name"]},
+                    ":expiresAt": {"N": str(now + self.ttl_seconds[counter["period"]])},
+                    ":won": {"N": str(counter["won"])},
+                    ":lost": {"N": str(counter["lost"])},
+                },
+            }})
+        return items
+
+    def write(self, results: list, now: int) -> bool:
+        """Record the results in one transaction. Returns False if one of them was already recorded"""
+        client = self.table.meta.client
+        try:
+            client.transact_write_items(TransactItems=self.transaction(results, now))
+            return True
+        except client.exceptions.TransactionCanceledException as e:
+            reasons = [reason.get("Code") for reason in e.response.get("CancellationReasons", [])]
+            if "ConditionalCheckFailed" in reasons:
+                return False
+            raise
+
+    def record(self, results: list, now: int) -> dict:
+        """Add the results to the counters, once per result whatever the number of times it was received"""
+        by_message = {}
+        for result in results:
+            by_message.setdefault(result.get("messageId"), {})[self.marker_key(result)] = result
+        recorded = duplicates = 0
+        for message_results in by_message.values():
+            message_results = list(message_results.values())
+            # Markers and at most four counters per result
+            if len(message_results) * 5 <= MAX_TRANSACTION_ITEMS and self.write(message_results, now):
+                recorded += len(message_results)
+                continue
+            # Some results of the message were already recorded, or there are too many of them
+            logger.info({"leaderboard_recorded_one_by_one": message_results[0].get("messageId"),
+                         "results": len(message_results)})
+            for result in message_results:
+                if self.write([result], now):
+                    recorded += 1
+                else:
+                    duplicates += 1
+        return {"recorded": recorded, "duplicates": duplicates}
@@ -0,0 +1,261 @@
+import json
+import os
+import time
+import uuid
+from aws_lambda_powertools import Logger, Metrics
+from chaos_runtime import clients, spans
+from lib.leaderboard import Leaderboard
+
+logger = Logger()
+metrics = Metrics()
+timing = spans.Spans(logger, metrics)
+
+PROJECT_TAG = os.environ.get("PROJECT_TAG")
+SCORE_TABLE_NAME = os.environ.get("SCORE_TABLE_NAME")
+STATE_MACHINE_ARN = os.environ.get("STATE_MACHINE_ARN")
+# Maximum number of experiments running at the same time for this project
+MAX_IN_FLIGHT = int(os.environ.get("MAX_IN_FLIGHT", 1))
+# A slot held longer than this is considered leaked by a failed execution and is reclaimed
+SLOT_TTL_SECONDS = int(os.environ.get("SLOT_TTL_SECONDS", 900))
+# Losses without sequence number of the same device received within the same window are considered as
+# re-publications of the same loss
+DEDUP_WINDOW_SECONDS = int(os.environ.get("DEDUP_WINDOW_SECONDS", 10))
+# How long the last loss of a device is kept in the table
+DEDUP_TTL_SECONDS = 3600
+# How long the sequence numbers of the losses are kept in the table. A device publishes its results again until they
+# are acknowledged, which can take as long as it stays offline
+SEQUENCE_TTL_SECONDS = int(os.environ.get("SEQUENCE_TTL_SECONDS", 7 * 24 * 3600))
+# How long the hourly and daily leaderboard counters are kept in the table
+HOURLY_LEADERBOARD_TTL_SECONDS = int(os.environ.get("HOURLY_LEADERBOARD_TTL_SECONDS", 2 * 24 * 3600))
+DAILY_LEADERBOARD_TTL_SECONDS = int(os.environ.get("DAILY_LEADERBOARD_TTL_SECONDS", 90 * 24 * 3600))
+
+sfn = clients.client("stepfunctions")
+""" :type: pyboto3.sfn """
+table = clients.table(SCORE_TABLE_NAME)
+leaderboard = Leaderboard(table, HOURLY_LEADERBOARD_TTL_SECONDS, DAILY_LEADERBOARD_TTL_SECONDS, SEQUENCE_TTL_SECONDS)
+
+
+class NoSlotAvailable(Exception):
+    pass
+
+
+def parse_results(record: dict) -> list:
+    """Read the game results from the SQS record of the message forwarded by the IoT rule. The message is either a
+    batch of results with sequence numbers, or a single loss
+    """
+    body = json.loads(record.get("body"))
+    result = {
+        "messageId": record.get("messageId"),
+        "correlationId": record.get("messageId"),
+        "clientId": body.get("client_id", "unknown"),
+        "player": body.get("player") or None,
+        "receivedAt": int(body.get("received_at", time.time() * 1000)),
+        "won": False,
+    }
+    if "results" not in body:
+        return [result]
+    if body.get("dropped"):
+        logger.warning({"results_dropped_by_device": body.get("dropped"), "clientId": result.get("clientId")})
+    # The device tells how long ago each game ended, when it still knows it
+    return [dict(result, seq=f"{body.get('epoch', 0)}#{r.get('seq')}", durationSeconds=r.get("duration"),
+                 won=r.get("game_result") == "SUCCEEDED", correlationId=r.get("cid") or result.get("messageId"),
+                 gameEndedAt=result.get("receivedAt") - r.get("age_ms") if r.get("age_ms") is not None else None)
+            for r in body.get("results")]
+
+
+def parse_batch(records: list) -> tuple:
+    """The records of the batch holding game results, and their results. The others are dropped with a warning: they
+    would fail again when retried, and hold back the losses queued behind them
+    """
+    parsed, results = [], []
+    for record in records:
+        try:
+            results.extend(parse_results(record))
+        except (TypeError, ValueError, AttributeError) as e:
+            logger.warning({"message_dropped": str(e), "messageId": record.get("messageId"),
+                            "body": record.get("body")})
+            continue
+        parsed.append(record)
+    return parsed, results
+
+
+def parse_losses(record: dict) -> list:
+    """Read the game losses from the SQS record of the message forwarded by the IoT rule"""
+    return [result for result in parse_results(record) if not result.get("won")]
+
+
+def deduplicate(losses: list) -> list:
+    """Drop the losses published more than once within the batch: the same sequence number of a device, or for the
+    losses without sequence number, a loss received less than the de-duplication window after the previous one
+    """
+    last_kept = {}
+    seen = set()
+    unique = []
+    for loss in sorted(losses, key=lambda l: l.get("receivedAt")):
+        if loss.get("seq"):
+            key = (loss.get("clientId"), loss.get("seq"))
+            if key not in seen:
+                seen.add(key)
+                unique.append(loss)
+            continue
+        previous = last_kept.get(loss.get("clientId"))
+        if previous is None or loss.get("receivedAt") - previous >= DEDUP_WINDOW_SECONDS * 1000:
+            last_kept[loss.get("clientId")] = loss.get("receivedAt")
+            unique.append(loss)
+    return unique
+
+
+def acquire_slot(execution_name: str, now: int):
+    """Take one of the in-flight experiment slots of the project. The slots are a map of the execution names in one
+    item, updated with optimistic locking. Slots older than their TTL are reclaimed on the way
+    """
+    key = {"pk": f"inflight#{PROJECT_TAG}"}
+    item = table.get_item(Key=key, ConsistentRead=True).get("Item", {})
+    version = int(item.get("version", 0))
+    slots = item.get("executions", {})
+    expired = [name for name, started_at in slots.items() if now - int(started_at) > SLOT_TTL_SECONDS]
+    if len(slots) - len(expired) >= MAX_IN_FLIGHT:
+        raise NoSlotAvailable(f"{len(slots) - len(expired)} experiments already in flight")
+    names = {"#executions": "executions", "#version": "version", "#name": execution_name}
+    values = {":now": now, ":version": version, ":next": version + 1}
+    if "executions" in item:
+        update = "SET #executions.#name = :now, #version = :next"
+    else:
+        # DynamoDB can't set a key of a map that does not exist yet, create the map with the slot
+        update = "SET #executions = :slots, #version = :next"
+        values[":slots"] = {execution_name: now}
+        del values[":now"]
+        del names["#name"]
+    if expired:
+        names.update({f"#expired{i}": name for i, name in enumerate(expired)})
+        update += " REMOVE " + ", ".join(f"#executions.#expired{i}" for i in range(len(expired)))
+    table.update_item(
+        Key=key,
+        UpdateExpression=update,
+        ConditionExpression="attribute_not_exists(#version) OR #version = :version",
+        ExpressionAttributeNames=names,
+        ExpressionAttributeValues=values,
+    )
+
+
+def release_slot(execution_name: str):
+    table.update_item(
+        Key={"pk": f"inflight#{PROJECT_TAG}"},
+        UpdateExpression="REMOVE #executions.#name",
+        ExpressionAttributeNames={"#executions": "executions", "#name": execution_name},
+    )
+
+
+def remember_loss(loss: dict, now: int) -> bool:
+    """Record the sequence number of the loss, or the time of the last loss of the device, so that a re-publication of
+    the same loss in a later batch is dropped. Returns False for a duplicate
+    """
+    if loss.get("seq"):
+        try:
+            table.put_item(
+                Item={"pk": f"loss#{loss.get('clientId')}#{loss.get('seq')}", "receivedAt": loss.get("receivedAt"),
+                      "expiresAt": now + SEQUENCE_TTL_SECONDS},
+                ConditionExpression="attribute_not_exists(pk)",
+            )
+            return True
+        except table.meta.client.exceptions.ConditionalCheckFailedException:
+            return False
+    try:
+        response = table.update_item(
+            Key={"pk": f"device#{loss.get('clientId')}"},
+            UpdateExpression="SET #lastLossAt = :receivedAt, #expiresAt = :expiresAt",
+            ConditionExpression="attribute_not_exists(#lastLossAt) OR #lastLossAt <= :threshold",
+            ExpressionAttributeNames={"#lastLossAt": "lastLossAt", "#expiresAt": "expiresAt"},
+            ExpressionAttributeValues={
+                ":receivedAt": loss.get("receivedAt"),
+                ":threshold": loss.get("receivedAt") - DEDUP_WINDOW_SECONDS * 1000,
+                ":expiresAt": now + DEDUP_TTL_SECONDS,
+            },
+            ReturnValues="UPDATED_OLD",
+        )
+        loss["previousLossAt"] = response.get("Attributes", {}).get("lastLossAt")
+        return True
+    except table.meta.client.exceptions.ConditionalCheckFailedException:
+        return False
+
+
+def forget_loss(loss: dict):
+    """Forget the sequence number of the loss, or restore the time of the previous loss of the device"""
+    if loss.get("seq"):
+        table.delete_item(Key={"pk": f"loss#{loss.get('clientId')}#{loss.get('seq')}"})
+    elif loss.get("previousLossAt") is None:
+        table.update_item(Key={"pk": f"device#{loss.get('clientId')}"}, UpdateExpression="REMOVE lastLossAt")
+    else:
+        table.update_item(
+            Key={"pk": f"device#{loss.get('clientId')}"},
+            UpdateExpression="SET lastLossAt = :previous",
+            ExpressionAttributeValues={":previous": loss.get("previousLossAt")},
+        )
+
+
+def admit(losses: list, now: int) -> dict:
+    """Start one experiment for all the new losses of the batch, if the project has a free slot"""
+    # De-duplicate within the batch first
+    unique = deduplicate(losses)
+    if not unique:
+        # Only wins, nothing to admit
+        return {"duplicates": 0}
+    execution_name = f"loss-{uuid.uuid4()}"
+    acquire_slot(execution_name, now)
+    new_losses = [loss for loss in unique if remember_loss(loss, now)]
+    if not new_losses:
+        release_slot(execution_name)
+        return {"duplicates": len(losses)}
+    # The trace ties the spans of the stages of the losses together, it is passed on by every state and Lambda
+    trace = {"traceId": execution_name, "correlationIds": [loss.get("correlationId") for loss in new_losses],
+             "admittedAt": spans.now_ms()}
+    try:
+        sfn.start_execution(
+            stateMachineArn=STATE_MACHINE_ARN,
+            name=execution_name,
+            input=json.dumps({"credits": len(new_losses), "trace": trace, "losses": [
+                {"clientId": loss.get("clientId"), "receivedAt": loss.get("receivedAt"),
+                 "correlationId": loss.get("correlationId")} for loss in new_losses]}),
+        )
+    except Exception:
+        # Undo the admission, the messages will be delivered again
+        for loss in new_losses:
+            forget_loss(loss)
+        release_slot(execution_name)
+        raise
+    return {"execution": execution_name, "credits": len(new_losses), "duplicates": len(losses) - len(new_losses),
+            "correlationIds": trace["correlationIds"], "admittedAt": trace["admittedAt"]}
+
+
+def record_spans(losses: list, admission: dict, started_at: int):
+    """Record the spans of the losses credited to the execution, from the device to the start of the execution"""
+    credited = set(admission.get("correlationIds"))
+    for loss in losses:
+        if loss.get("correlationId") in credited:
+            credited.discard(loss.get("correlationId"))
+            trace = {"traceId": admission.get("execution"), "correlationIds": [loss.get("correlationId")]}
+            timing.record(spans.DEVICE, loss.get("gameEndedAt"), loss.get("receivedAt"), trace)
+            timing.record(spans.QUEUE, loss.get("receivedAt"), started_at, trace)
+    timing.record(spans.ADMISSION, started_at, admission.get("admittedAt"),
+                   {"traceId": admission.get("execution"), "correlationIds": admission.get("correlationIds")})
+
+
+@metrics.log_metrics
+@logger.inject_lambda_context(log_event=True)
+def lambda_handler(event, context):
+    started_at = spans.now_ms()
+    records, results = parse_batch(event.get("Records", []))
+    # The leaderboards count each result once, so they can be updated again when the batch is retried
+    logger.info({"leaderboard": leaderboard.record(results, int(time.time()))})
+    losses = [result for result in results if not result.get("won")]
+    try:
+        result = admit(losses, int(time.time()))
+    except (NoSlotAvailable, table.meta.client.exceptions.ConditionalCheckFailedException) as e:
+        # Put the whole batch back in the queue. It is retried after the visibility timeout and coalesced with the
+        # losses received in the meantime
+        logger.info({"admission_delayed": str(e), "losses": len(losses)})
+        return {"batchItemFailures": [{"itemIdentifier": record.get("messageId")} for record in records]}
+    logger.info({"admission": result})
+    if "execution" in result:
+        record_spans(losses, result, started_at)
+    return {"batchItemFailures": []}
@@ -0,0 +1,130 @@
+import os
+import time
+from datetime import datetime, timezone
+from aws_lambda_powertools import Logger, Metrics
+from aws_lambda_powertools.metrics import MetricUnit
+from chaos_runtime import clients, columnar
+
+logger = Logger()
+metrics = Metrics()
+
+HISTORY_BUCKET_NAME = os.environ.get("HISTORY_BUCKET_NAME")
+HISTORY_PREFIX = os.environ.get("HISTORY_PREFIX", "history")
+# The availability figures of the game, kept as they are scored
+COUNTS = ("probes", "failedProbes", "outages")
+DURATIONS = ("availabilityPercent", "downtimeSeconds", "longestOutageSeconds", "timeToRecoverSeconds")
+DAY_MS = 24 * 3600 * 1000
+# Number of days before the current one compacted by every scheduled run. The games archived late, by an execution
+# stopping after midnight or a retried asynchronous invocation, are merged into the segment of their day on a later run
+COMPACT_DAYS = int(os.environ.get("COMPACT_DAYS", 3))
+# Objects per call of the S3 API
+DELETE_BATCH_SIZE = 1000
+
+s3 = clients.client("s3")
+""" :type: pyboto3.s3 """
+
+
+def epoch_ms(timestamp: str) -> int:
+    """Milliseconds since the epoch of an ISO 8601 time of the state machine, e.g. 2024-05-01T10:12:13.456Z"""
+    return int(datetime.fromisoformat(timestamp.replace("Z", "+00:00")).timestamp() * 1000)
+
+
+def day_of(ms: int) -> str:
+    return datetime.fromtimestamp(ms / 1000, timezone.utc).strftime("%Y-%m-%d")
+
+
+def partition(day: str) -> str:
+    return f"{HISTORY_PREFIX}/day={day}/"
+
+
+def game_record(event: dict) -> dict:
+    """The record of the game of an execution of the state machine, from its state when the game is scored"""
+    state = event.get("state") or {}
+    trace = state.get("trace") or {}
+    availability = (state.get("outcome") or {}).get("availability") or {}
+    stopped_at = epoch_ms(event["stoppedAt"]) if event.get("stoppedAt") else int(time.time() * 1000)
+    # The executions started by hand have no trace, their run starts when the experiment is scored
+    started_at = trace.get("experimentStartedAt") or stopped_at
+    record = {
+        "execution": event.get("execution") or trace.get("traceId"),
+        "experimentId": state.get("experimentId"),
+        "template": state.get("template"),
+        "templateId": state.get("templateId"),
+        "status": (state.get("outcome") or {}).get("experimentStatus"),
+        "startedAt": int(started_at),
+        "stoppedAt": stopped_at,
+        "admittedAt": trace.get("admittedAt"),
+        "runSeconds": round((stopped_at - started_at) / 1000, 3),
+        "credits": int(state.get("credits", 1)),
+        # The devices whose losses the experiment is credited to, separated by spaces
+        "devices": " ".join(device for device in state.get("devices") or () if device) or None,
+    }
+    record.update({name: int(availability[name]) for name in COUNTS if name in availability})
+    record.update({name: float(availability[name]) for name in DURATIONS if name in availability})
+    for name, target in (availability.get("targets") or {}).items():
+        record[f"target.{name}"] = float(target.get("availabilityPercent"))
+    return record
+
+
+def archive(event: dict) -> dict:
+    """Write the record of the game as a segment of one row in the partition of the day it stopped"""
+    record = game_record(event)
+    key = f"{partition(day_of(record['stoppedAt']))}run-{record['stoppedAt']}-{record['execution']}.seg"
+    s3.put_object(Bucket=HISTORY_BUCKET_NAME, Key=key, Body=columnar.encode([record]))
+    metrics.add_metric(name="GamesArchived", unit=MetricUnit.Count, value=1)
+    logger.info({"archived": key})
+    return {"key": key}
+
+
+def list_keys(prefix: str) -> list:
+    keys, token = [], None
+    while True:
+        kwargs = {"ContinuationToken": token} if token else {}
+        response = s3.list_objects_v2(Bucket=HISTORY_BUCKET_NAME, Prefix=prefix, **kwargs)
+        keys.extend(item["Key"] for item in response.get("Contents", []))
+        token = response.get("NextContinuationToken")
+        if not token:
+            return keys
+
+
+def compact(day: str) -> dict:
+    """Merge the segments of a day into one, sorted by stop time. The games archived twice, by a retried
+    invocation, are kept once. The merged segment replaces the previous one of the day, then the merged run
+    segments are deleted: a reader listing the day in between reads the games twice and keeps them once
+    """
+    key = f"{partition(day)}day.seg"
+    keys = [k for k in list_keys(partition(day)) if k.endswith(".seg")]
+    if not keys or keys == [key]:
+        return {"day": day, "segments": len(keys)}
+    games = {}
+    for k in keys:
+        segment = columnar.Segment.from_bytes(s3.get_object(Bucket=HISTORY_BUCKET_NAME, Key=k)["Body"].read())
+        for record in segment.records():
+            games[record["execution"]] = {name: value for name, value in record.items() if value is not None}
+    records = sorted(games.values(), key=lambda record: (record["stoppedAt"], record["execution"]))
+    body = columnar.encode(records)
+    s3.put_object(Bucket=HISTORY_BUCKET_NAME, Key=key, Body=body)
+    merged = [k for k in keys if k != key]
+    for start in range(0, len(merged), DELETE_BATCH_SIZE):
+        s3.delete_objects(Bucket=HISTORY_BUCKET_NAME, Delete={
+            "Objects": [{"Key": k} for k in merged[start:start + DELETE_BATCH_SIZE]], "Quiet": True})
+    logger.info({"compacted": key, "segments": len(keys), "games": len(records), "bytes": len(body)})
+    return {"day": day, "segments": len(keys), "games": len(records), "bytes": len(body)}
+
+
+def compact_recent(now_ms: int) -> dict:
+    """Compact the last COMPACT_DAYS days before the current one. A day already compacted without late games costs
+    one listing of its partition
+    """
+    return {"days": [compact(day_of(now_ms - i * DAY_MS)) for i in range(1, COMPACT_DAYS + 1)]}
+
+
+@metrics.log_metrics
+@logger.inject_lambda_context(log_event=True)
+def lambda_handler(event, context):
+    # The hourly schedule compacts the last days before the current one, a day can also be compacted again by hand
+    if event.get("compactDay"):
+        return compact(event["compactDay"])
+    if event.get("source") == "aws.events":
+        return compact_recent(epoch_ms(event["time"]))
+    return archive(event)
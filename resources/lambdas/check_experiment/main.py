@@ -1,18 +1,146 @@
-import boto3
-from aws_lambda_powertools import Logger, Metrics, Tracer
+import json
+import os
+import time
+from aws_lambda_powertools import Logger, Metrics
+from chaos_runtime import clients, spans
 
 logger = Logger()
-tracer = Tracer()
+metrics = Metrics()
+timing = spans.Spans(logger, metrics)
 
-fis = boto3.client("fis")
+SCORE_TABLE_NAME = os.environ.get("SCORE_TABLE_NAME")
+# Adaptive backoff of the polling fallback: the wait doubles after every check, up to the maximum
+POLL_BASE_WAIT_SECONDS = int(os.environ.get("POLL_BASE_WAIT_SECONDS", 5))
+POLL_MAX_WAIT_SECONDS = int(os.environ.get("POLL_MAX_WAIT_SECONDS", 30))
+# How long the experiment records are kept in the table
+RECORD_TTL_SECONDS = 7 * 24 * 3600
+# The states after which the state machine can score the game
+FINAL_STATES = ("completed", "stopping", "stopped", "failed", "cancelled")
+
+fis = clients.client("fis")
 """ :type: pyboto3.fis """
+sfn = clients.client("stepfunctions")
+""" :type: pyboto3.sfn """
+table = clients.table(SCORE_TABLE_NAME) if SCORE_TABLE_NAME else None
 
-@logger.inject_lambda_context(log_event=True)
-def lambda_handler(event, context):
-    # Get the experiment ID from the even payload
+
+def record_experiment(experiment_id: str, condition: dict = None, **attributes) -> dict:
+    """Store attributes of the experiment in its record of the score table and return the updated record.
+    The condition holds the ConditionExpression of the update and its values, if any
+    """
+    attributes["expiresAt"] = int(time.time()) + RECORD_TTL_SECONDS
+    names = {f"#{name}": name for name in attributes}
+    values = {f":{name}": value for name, value in attributes.items()}
+    conditional = {}
+    if condition:
+        conditional["ConditionExpression"] = condition["expression"]
+        values.update(condition.get("values", {}))
+    return table.update_item(
+        Key={"pk": f"experiment#{experiment_id}"},
+        UpdateExpression="SET " + ", ".join(f"#{name} = :{name}" for name in attributes),
+        ExpressionAttributeNames=names,
+        ExpressionAttributeValues=values,
+        ReturnValues="ALL_NEW",
+        **conditional,
+    ).get("Attributes", {})
+
+
+def record_status(experiment_id: str, experiment_state: str, existing_only: bool = False) -> dict:
+    """Store the status of the experiment and return the updated record, or an empty one when it was not updated.
+    EventBridge does not deliver the events in order, so a final status is never replaced by a non final one. With
+    existing_only, only the records of the experiments of the game, created when their execution registers, are updated
+    """
+    existing = "attribute_exists(pk) AND " if existing_only else ""
+    if experiment_state in FINAL_STATES:
+        condition = {"expression": "attribute_exists(pk)"} if existing_only else None
+    else:
+        values = {f":final{i}": state for i, state in enumerate(FINAL_STATES)}
+        # AND binds tighter than OR
+        condition = {"expression": f"{existing}attribute_not_exists(#experimentStatus) OR "
+                                   f"{existing}NOT #experimentStatus IN ({', '.join(values)})",
+                     "values": values}
+    try:
+        return record_experiment(experiment_id, condition=condition, experimentStatus=experiment_state)
+    except table.meta.client.exceptions.ConditionalCheckFailedException:
+        logger.info({"not_recorded": {"experimentId": experiment_id, "experimentStatus": experiment_state}})
+        return {}
+
+
+def resume_execution(record: dict):
+    """Resume the state machine execution waiting on the experiment once it reached a final state"""
+    experiment_id = record.get("pk").split("#", 1)[1]
+    output = {"experimentId": experiment_id, "experimentStatus": record.get("experimentStatus")}
+    try:
+        sfn.send_task_success(taskToken=record.get("taskToken"), output=json.dumps(output))
+        logger.info({"resumed": output})
+        # Only the call which resumed the execution records the span, the later final states and the race between
+        # the event and the registration would count the experiment again
+        record_experiment_span(record.get("trace"))
+    except (sfn.exceptions.TaskTimedOut, sfn.exceptions.InvalidToken, sfn.exceptions.TaskDoesNotExist) as e:
+        # Both the event and the registration can race to resume the execution, or the execution already fell back
+        # to polling. Either way there is nothing left to resume
+        logger.info({"not_resumed": output, "reason": str(e)})
+
+
+def record_experiment_span(trace: dict):
+    """Record the span of the experiment, from its start to its final state"""
+    if trace:
+        timing.record(spans.EXPERIMENT, trace.get("experimentStartedAt"), spans.now_ms(), trace)
+
+
+def on_state_change(event: dict) -> dict:
+    """Handle the "FIS Experiment State Change" event sent by Amazon EventBridge"""
+    experiment_id = event.get("detail").get("experiment-id")
+    experiment_state = event.get("detail").get("new-state").get("status")
+    # The events of the experiments of other projects, or of this game before they register, update no record
+    record = record_status(experiment_id, experiment_state, existing_only=True)
+    if record.get("experimentStatus") in FINAL_STATES and record.get("taskToken"):
+        resume_execution(record)
+    return {"experimentId": experiment_id, "experimentStatus": experiment_state}
+
+
+def register_task_token(event: dict) -> dict:
+    """Store the task token of the state machine execution waiting for the experiment to end.
+    The experiment may already be over when the token is registered, so its state is checked once, after the record
+    is created: the events before it update no record
+    """
+    experiment_id = event.get("experimentId")
+    # The trace of the execution is kept with the token, for the span of the experiment
+    record = record_experiment(experiment_id, taskToken=event.get("taskToken"), trace=event.get("trace") or {})
+    experiment_state = fis.get_experiment(id=experiment_id).get("experiment").get("state").get("status")
+    if experiment_state in FINAL_STATES:
+        record = record_status(experiment_id, experiment_state)
+    if record.get("experimentStatus") in FINAL_STATES:
+        resume_execution(record)
+    return {"experimentId": experiment_id, "experimentStatus": record.get("experimentStatus", experiment_state)}
+
+
+def poll(event: dict) -> dict:
+    """Check the experiment status, and tell the state machine how long to wait before the next check"""
     experiment_id = event.get("experimentId")
-    # Get the experiment status
     experiment = fis.get_experiment(id=experiment_id).get("experiment")
     logger.info({"experiment": experiment})
     experiment_state = experiment.get("state").get("status")
-    return {"experimentId": experiment_id, "experimentStatus": experiment_state}
+    if table and experiment_state in FINAL_STATES:
+        # Let the probes running in parallel know the experiment is over
+        record_status(experiment_id, experiment_state)
+    if experiment_state in FINAL_STATES:
+        record_experiment_span(event.get("trace"))
+    poll_count = int(event.get("pollCount", 0))
+    return {
+        "experimentId": experiment_id,
+        "experimentStatus": experiment_state,
+        "pollCount": poll_count + 1,
+        "waitSeconds": min(POLL_BASE_WAIT_SECONDS * 2 ** poll_count, POLL_MAX_WAIT_SECONDS),
+        "trace": event.get("trace") or {},
+    }
+
+
+@metrics.log_metrics
+@logger.inject_lambda_context(log_event=True)
+def lambda_handler(event, context):
+    if event.get("source") == "aws.fis":
+        return on_state_change(event)
+    if event.get("taskToken"):
+        return register_task_token(event)
+    return poll(event)
@@ -5,37 +5,106 @@
 
 import urllib3
 import json
-http = urllib3.PoolManager()
+import time
+import random
+import threading
+from chaos_runtime import sessions
+
 SUCCESS = "SUCCESS"
 FAILED = "FAILED"
+# CloudFormation rejects the response objects larger than 4096 bytes
+MAX_RESPONSE_SIZE = 4096
+MAX_ATTEMPTS = 6
+BASE_BACKOFF_SECONDS = 0.2
+MAX_BACKOFF_SECONDS = 5
+CONNECT_TIMEOUT_SECONDS = 2
+READ_TIMEOUT_SECONDS = 10
+# Time kept for the function to return after the last attempt
+SAFETY_MARGIN_SECONDS = 0.5
+RETRY_STATUSES = (408, 429, 500, 502, 503, 504)
 
-def send(event, context, responseStatus, responseData, physicalResourceId=None, noEcho=False):
-    responseUrl = event['ResponseURL']
+# The retries are done in send(), to bound them by the remaining time of the function
+http = sessions.pool_manager(maxsize=2, retries=False)
 
-    print(responseUrl)
 
+def buildResponseBody(event, context, responseStatus, responseData, physicalResourceId=None, noEcho=False, reason=None):
     responseBody = {}
     responseBody['Status'] = responseStatus
-    responseBody['Reason'] = 'See the details in CloudWatch Log Stream: ' + context.log_stream_name
+    responseBody['Reason'] = reason or 'See the details in CloudWatch Log Stream: ' + context.log_stream_name
     responseBody['PhysicalResourceId'] = physicalResourceId or context.log_stream_name
     responseBody['StackId'] = event['StackId']
     responseBody['RequestId'] = event['RequestId']
     responseBody['LogicalResourceId'] = event['LogicalResourceId']
     responseBody['NoEcho'] = noEcho
     responseBody['Data'] = responseData
+    return responseBody
+
+
+def encodeResponseBody(responseBody):
+    """Encode the response, and replace a response over the CloudFormation limit by a FAILED one which fits"""
+    body = json.dumps(responseBody).encode('utf-8')
+    if len(body) <= MAX_RESPONSE_SIZE:
+        return body
+    print(f"Response body of {len(body)} bytes is over the {MAX_RESPONSE_SIZE} bytes limit, the data is dropped")
+    responseBody = dict(responseBody, Status=FAILED, Data={},
+                        Reason=f"Response object of {len(body)} bytes is too long. " + responseBody['Reason'])
+    body = json.dumps(responseBody).encode('utf-8')
+    if len(body) > MAX_RESPONSE_SIZE:
+        responseBody['Reason'] = responseBody['Reason'][:MAX_RESPONSE_SIZE - len(body)]
+        body = json.dumps(responseBody).encode('utf-8')
+    return body
+
 
-    json_responseBody = json.dumps(responseBody)
+def send(event, context, responseStatus, responseData, physicalResourceId=None, noEcho=False, reason=None):
+    """Send the response to CloudFormation, retrying with a bounded exponential backoff within the remaining time of
+    the function. Returns True once the response was accepted
+    """
+    responseUrl = event['ResponseURL']
+
+    print(responseUrl)
 
-    print("Response body:\n" + json_responseBody)
+    body = encodeResponseBody(buildResponseBody(event, context, responseStatus, responseData, physicalResourceId,
+                                                noEcho, reason))
+
+    print("Response body:\n" + body.decode('utf-8'))
 
     headers = {
-        'content-type' : '',
-        'content-length' : str(len(json_responseBody))
+        'content-type': '',
+        'content-length': str(len(body))
     }
 
-    try:
-        
-        response = http.request('PUT',responseUrl,body=json_responseBody.encode('utf-8'),headers=headers)
-        print("Status code: " + response.reason)
-    except Exception as e:
-        print("send(..) failed executing requests.put(..): " + str(e))
+    deadline = time.monotonic() + context.get_remaining_time_in_millis() / 1000 - SAFETY_MARGIN_SECONDS
+    for attempt in range(MAX_ATTEMPTS):
+        if attempt:
+            backoff = min(BASE_BACKOFF_SECONDS * 2 ** (attempt - 1), MAX_BACKOFF_SECONDS)
+            time.sleep(min(random.uniform(backoff / 2, backoff), max(deadline - time.monotonic(), 0)))
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        timeout = urllib3.Timeout(connect=min(CONNECT_TIMEOUT_SECONDS, remaining),
+                                  read=min(READ_TIMEOUT_SECONDS, remaining))
+        try:
+            response = http.request('PUT', responseUrl, body=body, headers=headers, timeout=timeout)
+            print("Status code: " + str(response.status) + " " + response.reason)
+            if response.status < 300:
+                return True
+            if response.status not in RETRY_STATUSES:
+                break
+        except Exception as e:
+            print(f"send(..) attempt {attempt + 1} failed: " + str(e))
+    print("send(..) failed, CloudFormation did not get the response")
+    return False
+
+
+def prepare(event):
+    """Open the connection to the response URL in the background, so that it overlaps with the work of the handler
+    and send() reuses it from the pool. The server answers with an error, which is ignored
+    """
+    def connect():
+        try:
+            http.request('HEAD', event['ResponseURL'], timeout=urllib3.Timeout(connect=CONNECT_TIMEOUT_SECONDS, read=2))
+        except Exception as e:
+            print("prepare(..) failed: " + str(e))
+    thread = threading.Thread(target=connect, daemon=True)
+    thread.start()
+    return thread
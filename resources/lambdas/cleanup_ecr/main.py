@@ -1,47 +1,137 @@
 import os
-import boto3
+import time
+import queue
+import random
 import logging
+import threading
 import lib.cfnresponse as cfnresponse
+from chaos_runtime import clients
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
-ecr = boto3.client("ecr")
+# The delete workers share the connections of the client, its pool holds more than DELETE_WORKERS
+ecr = clients.client("ecr")
 
 ECR_REPOSITORY_NAME = os.environ["ECR_REPOSITORY_NAME"]
 PHYSICAL_ID = "CustomResourceToCleanupEcrImages"
+# Number of delete batches sent at the same time
+DELETE_WORKERS = int(os.environ.get("DELETE_WORKERS", 4))
+# Attempts to delete the images of a batch which failed, with an exponential backoff between them
+DELETE_MAX_ATTEMPTS = int(os.environ.get("DELETE_MAX_ATTEMPTS", 5))
+DELETE_BASE_BACKOFF_SECONDS = float(os.environ.get("DELETE_BASE_BACKOFF_SECONDS", 0.5))
+# Maximum number of images per call of the ECR API
+LIST_PAGE_SIZE = 1000
+DELETE_BATCH_SIZE = 100
+# Time kept to answer CloudFormation before the function times out
+SAFETY_MARGIN_SECONDS = 5
+THROTTLING_ERRORS = ("ThrottlingException", "TooManyRequestsException", "ServiceUnavailableException")
+
 
 def lambda_handler(event, context):
-    response_data = {"deletedImages": []}
+    response_data = {"deletedImages": 0}
+    # Connect to CloudFormation while the images are deleted
+    cfnresponse.prepare(event)
     try:
         request = event.get("RequestType").lower()
         logger.info(f"Type of request: {request}")
         if request == "delete":
-            next_token = delete_ecr_images()
-            while next_token:
-                next_token = delete_ecr_images(next_token)
+            deadline = time.monotonic() + context.get_remaining_time_in_millis() / 1000 - SAFETY_MARGIN_SECONDS
+            response_data = delete_ecr_images(deadline)
+            if response_data.get("failedImages") or response_data.get("timedOut"):
+                raise RuntimeError(f"The repository is not empty: {response_data}")
         cfnresponse.send(event, context, cfnresponse.SUCCESS, response_data, physicalResourceId=PHYSICAL_ID)
     except Exception as e:
         logger.exception(e)
         cfnresponse.send(event, context, cfnresponse.FAILED, response_data, physicalResourceId=PHYSICAL_ID)
 
-def delete_ecr_images(next_token: str = None) -> str:
-    """This function list images in ECR repository and delete them
+
+def list_batches(batches: queue.Queue, deadline: float):
+    """List the images of the repository ahead of the deletion and queue them in batches of the API limit"""
+    next_token = None
+    while time.monotonic() < deadline:
+        kwargs = {"nextToken": next_token} if next_token else {}
+        ecr_response = ecr.list_images(repositoryName=ECR_REPOSITORY_NAME, maxResults=LIST_PAGE_SIZE, **kwargs)
+        images = ecr_response.get("imageIds", [])
+        for start in range(0, len(images), DELETE_BATCH_SIZE):
+            # Blocks while the workers are behind, so the listing never runs more than a few batches ahead
+            batches.put(images[start:start + DELETE_BATCH_SIZE])
+        next_token = ecr_response.get("nextToken")
+        if not next_token:
+            break
+
+
+def delete_batch(images: list, deadline: float) -> tuple:
+    """Delete one batch of images, retrying the images which failed with backoff. Returns the numbers of deleted and
+    failed images
+    """
+    deleted = 0
+    for attempt in range(DELETE_MAX_ATTEMPTS):
+        if attempt:
+            backoff = DELETE_BASE_BACKOFF_SECONDS * 2 ** (attempt - 1)
+            time.sleep(min(random.uniform(backoff / 2, backoff), max(deadline - time.monotonic(), 0)))
+        if time.monotonic() >= deadline:
+            break
+        try:
+            delete_response = ecr.batch_delete_image(repositoryName=ECR_REPOSITORY_NAME, imageIds=images)
+        except ecr.exceptions.ClientError as e:
+            if e.response.get("Error", {}).get("Code") not in THROTTLING_ERRORS:
+                raise
+            logger.info({"ECR images deletion throttled": str(e), "attempt": attempt + 1})
+            continue
+        deleted += len(delete_response.get("imageIds", []))
+        failures = delete_response.get("failures", [])
+        # An image not found was deleted in the meantime, by this cleanup or by someone else
+        images = [f.get("imageId") for f in failures if f.get("failureCode") != "ImageNotFound"]
+        if not images:
+            break
+        logger.info({"ECR images deletion failed": failures, "attempt": attempt + 1})
+    return deleted, len(images)
+
+
+def delete_worker(batches: queue.Queue, deadline: float, results: dict, lock: threading.Lock):
+    while True:
+        images = batches.get()
+        if images is None:
+            return
+        try:
+            deleted, failed = delete_batch(images, deadline)
+        except Exception as e:
+            logger.exception(e)
+            deleted, failed = 0, len(images)
+        with lock:
+            results["deletedImages"] += deleted
+            results["failedImages"] += failed
+
+
+def delete_ecr_images(deadline: float) -> dict:
+    """Delete all the images of the ECR repository. The listing runs ahead of a pool of worker threads deleting the
+    batches. As deleting images while paginating can skip some, the repository is swept again until a sweep finds
+    nothing left to delete
     """
-    if not next_token:
-        ecr_response = ecr.list_images(repositoryName=ECR_REPOSITORY_NAME)
-    else:
-        ecr_response = ecr.list_images(
-            repositoryName=ECR_REPOSITORY_NAME,
-            NextToken=next_token
-        )
-    images_list = ecr_response.get("imageIds", [])
-    next_token = ecr_response.get("NextToken")
-
-    if images_list:
-        delete_response = ecr.batch_delete_image(
-            repositoryName=ECR_REPOSITORY_NAME,
-            imageIds=images_list
-        )
-        logger.info({"ECR images deleted": delete_response.get("imageIds", [])})
-        logger.info({"ECR images deletion failed": delete_response.get("failures", [])})
-    return next_token
+    start = time.monotonic()
+    results = {"deletedImages": 0, "failedImages": 0, "sweeps": 0}
+    lock = threading.Lock()
+    while time.monotonic() < deadline:
+        deleted_before = results["deletedImages"]
+        results["failedImages"] = 0
+        results["sweeps"] += 1
+        batches = queue.Queue(maxsize=DELETE_WORKERS * 2)
+        workers = [threading.Thread(target=delete_worker, args=(batches, deadline, results, lock), daemon=True)
+                   for _ in range(DELETE_WORKERS)]
+        for worker in workers:
+            worker.start()
+        try:
+            list_batches(batches, deadline)
+        finally:
+            for _ in workers:
+                batches.put(None)
+            for worker in workers:
+                worker.join()
+        if results["deletedImages"] == deleted_before:
+            break
+    results["timedOut"] = time.monotonic() >= deadline
+    duration = time.monotonic() - start
+    results["durationSeconds"] = round(duration, 3)
+    results["imagesPerSecond"] = round(results["deletedImages"] / duration, 1) if duration else 0
+    logger.info({"ECR images cleanup": results})
+    return results
@@ -0,0 +1,26 @@
+"""Duration of the ECR cleanup of a large repository against a stubbed ECR client, by number of delete workers
+
+    python resources/lambdas/local/bench_cleanup_ecr.py
+"""
+import time
+from loader import load_lambda
+from fakes import FakeEcr
+
+NB_IMAGES = 5000
+LATENCY_SECONDS = 0.05
+FAILURE_RATE = 0.05
+
+
+def main():
+    cleanup = load_lambda("cleanup_ecr", {"ECR_REPOSITORY_NAME": "local", "DELETE_BASE_BACKOFF_SECONDS": "0.05"})
+    for workers in (1, 4, 8, 16):
+        cleanup.ecr = FakeEcr(nb_images=NB_IMAGES, latency_seconds=LATENCY_SECONDS, failure_rate=FAILURE_RATE)
+        cleanup.DELETE_WORKERS = workers
+        result = cleanup.delete_ecr_images(time.monotonic() + 300)
+        print(f"{workers:>2} workers: {result['durationSeconds']:.2f} s, {result['imagesPerSecond']:.0f} images/s, "
+              f"deleted {result['deletedImages']}, failed {result['failedImages']}, sweeps {result['sweeps']}, "
+              f"left {len(cleanup.ecr.images)}, ECR calls {cleanup.ecr.calls}")
+
+
+if __name__ == "__main__":
+    main()
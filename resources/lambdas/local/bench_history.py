@@ -0,0 +1,151 @@
+"""Benchmark of the game history: months of synthetic experiment runs written as the archive Lambda function does, one
+merged segment per day, and queried with the history CLI against loading every run from JSON lines into memory.
+
+The aggregates of the CLI must match those of the runs loaded in memory, for every grouping and for filtered queries.
+The last day is left as the segments of its runs, with a run archived twice by a retried invocation, and the day
+before it holds a run both in its merged segment and in its own, as while the day is being merged.
+
+    python resources/lambdas/local/bench_history.py [--days 180] [--runs-per-day 250]
+"""
+import os
+import json
+import time
+import random
+import argparse
+import tempfile
+import tracemalloc
+import history
+from datetime import datetime, timedelta, timezone
+from chaos_runtime import columnar
+
+TEMPLATES = ("Terminate All ECS Fargate Tasks", "Stop the Nginx Service", "Throttle DynamoDB", "CPU Stress on the App",
+             "Network Latency to DynamoDB", "Reboot the Database", "Blackhole the Static Assets")
+TARGETS = ("app", "nginx", "static", "data")
+DEVICES = tuple(f"device-{i}" for i in range(12))
+
+
+def synthetic_run(rng: random.Random, stopped_at: int, sequence: int) -> dict:
+    """A run whose template breaks the application with its own odds and for its own time"""
+    template = rng.randrange(len(TEMPLATES))
+    broken = rng.random() < 0.05 + 0.12 * template
+    run_seconds = rng.uniform(240, 330)
+    downtime = rng.uniform(5, 30 * (template + 1)) if broken else 0.0
+    probes = rng.randrange(800, 1200)
+    availability = round(100 * (1 - downtime / run_seconds), 2)
+    run = {
+        "execution": f"run-{sequence:08d}", "experimentId": f"EXP{sequence:012x}",
+        "template": f"chaos-game-{TEMPLATES[template]}", "templateId": f"EXT{template:05d}",
+        "status": "stopped" if broken else rng.choice(("completed", "completed", "completed", "failed")),
+        "startedAt": stopped_at - int(run_seconds * 1000), "stoppedAt": stopped_at,
+        "admittedAt": stopped_at - int(run_seconds * 1000) - rng.randrange(200, 900),
+        "runSeconds": round(run_seconds, 3), "credits": rng.randrange(1, 4),
+        "devices": " ".join(rng.sample(DEVICES, rng.randrange(1, 3))),
+        "probes": probes, "failedProbes": int(probes * (100 - availability) / 100), "outages": int(broken),
+        "availabilityPercent": availability, "downtimeSeconds": round(downtime, 3),
+        "longestOutageSeconds": round(downtime, 3), "timeToRecoverSeconds": round(downtime, 3),
+    }
+    run.update({f"target.{name}": availability if name != "data" or broken else 100.0 for name in TARGETS})
+    return run
+
+
+def write_history(folder: str, json_path: str, days: int, runs_per_day: int, seed: int = 0) -> int:
+    """The runs of the days as the archive function leaves them, and the same runs as JSON lines"""
+    rng = random.Random(seed)
+    first_day = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    sequence = 0
+    with open(json_path, "w") as lines:
+        for d in range(days):
+            day = first_day + timedelta(days=d)
+            start_ms = int(day.timestamp() * 1000)
+            stops = sorted(start_ms + rng.randrange(24 * 3600 * 1000) for _ in range(runs_per_day))
+            runs = [synthetic_run(rng, stopped_at, sequence + i) for i, stopped_at in enumerate(stops)]
+            sequence += runs_per_day
+            for run in runs:
+                lines.write(json.dumps(run) + "\n")
+            partition = os.path.join(folder, f"day={day.strftime('%Y-%m-%d')}")
+            os.makedirs(partition)
+            segments = {"day.seg": runs}
+            if d == days - 2:
+                segments[f"run-{runs[-1]['stoppedAt']}-{runs[-1]['execution']}.seg"] = runs[-1:]
+            elif d == days - 1:
+                segments = {f"run-{run['stoppedAt']}-{run['execution']}.seg": [run] for run in runs}
+                segments[f"run-{runs[0]['stoppedAt']}-{runs[0]['execution']}-retry.seg"] = runs[:1]
+            for name, records in segments.items():
+                with open(os.path.join(partition, name), "wb") as f:
+                    f.write(columnar.encode(records))
+    return sequence
+
+
+def naive_query(json_path: str, since: str = None, until: str = None, where: history.Filter = None,
+                group_by: str = "template") -> dict:
+    """The runs all loaded in memory from the JSON lines, then filtered and aggregated"""
+    with open(json_path) as f:
+        runs = [json.loads(line) for line in f]
+    where = where or history.Filter()
+    groups = {}
+    for run in runs:
+        day = datetime.fromtimestamp(run["stoppedAt"] / 1000, timezone.utc).strftime("%Y-%m-%d")
+        if (since and day < since) or (until and day > until) or not where(run):
+            continue
+        for key in history.group_keys(run, group_by):
+            groups.setdefault(key, history.Aggregate()).add(run)
+    return {key: aggregate.row() for key, aggregate in groups.items()}
+
+
+def measure(function, *args, **kwargs) -> tuple:
+    """The result, the duration and the peak of memory allocated, traced in a second run as tracing slows it down"""
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    function(*args, **kwargs)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def same(expected: dict, actual: dict) -> bool:
+    return expected.keys() == actual.keys() and all(
+        expected[key]["runs"] == actual[key]["runs"] and expected[key]["broken"] == actual[key]["broken"] and
+        all(abs((expected[key][name] or 0) - (actual[key][name] or 0)) < 1e-6 for name in expected[key])
+        for key in expected)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--days", type=int, default=180)
+    parser.add_argument("--runs-per-day", type=int, default=250)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        json_path = os.path.join(folder, "runs.jsonl")
+        segments = os.path.join(folder, "history")
+        runs = write_history(segments, json_path, args.days, args.runs_per_day)
+        size = sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(segments) for name in names)
+        print(f"{runs} runs over {args.days} days: {os.path.getsize(json_path) / 2 ** 20:.1f} MiB of JSON lines, "
+              f"{size / 2 ** 20:.1f} MiB of segments")
+        last = (datetime(2024, 1, 1) + timedelta(days=args.days - 1)).strftime("%Y-%m-%d")
+        month = (datetime(2024, 1, 1) + timedelta(days=max(args.days - 30, 0))).strftime("%Y-%m-%d")
+        queries = [
+            ("by template", {"group_by": "template"}),
+            ("by device", {"group_by": "device"}),
+            ("by day", {"group_by": "day"}),
+            ("by status, one template", {"group_by": "status", "where": history.Filter(template="Nginx")}),
+            ("stopped, by template", {"group_by": "template", "where": history.Filter(status=["stopped"])}),
+            ("last month, one device", {"group_by": "template", "since": month, "until": last,
+                                        "where": history.Filter(device="device-3")}),
+        ]
+        print(f"{'query':>24} | {'CLI ms':>7} | {'CLI peak MiB':>12} | {'in memory ms':>12} | {'in memory peak MiB':>18}"
+              f" | segments read")
+        for name, kwargs in queries:
+            result, elapsed, peak = measure(history.query, segments, **kwargs)
+            expected, naive_elapsed, naive_peak = measure(naive_query, json_path, **kwargs)
+            assert same(expected, result["groups"]), f"{name}: the aggregates differ"
+            print(f"{name:>24} | {elapsed * 1000:7.0f} | {peak / 2 ** 20:12.2f} | {naive_elapsed * 1000:12.0f} | "
+                  f"{naive_peak / 2 ** 20:18.1f} | {result['segmentsRead']}")
+        print()
+        history.report(history.query(segments, group_by="template"), "template")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""Duration, requests and memory of one query_app invocation by number of targets probed in parallel, one of them
+never answering before the request timeout, as a tier of the application down would.
+
+The probes share the same budget of threads whatever the number of targets. The invocation must return before the
+Lambda timeout, and the healthy targets must keep their request rate.
+
+    python resources/lambdas/local/bench_probe_targets.py
+"""
+import io
+import json
+import time
+import tracemalloc
+import contextlib
+from loader import load_lambda, LambdaContext
+from fakes import LocalHttpTarget
+
+TIMEOUT_SECONDS = 20
+PROBE_DURATION_SECONDS = 3
+TARGET_RPS = 20
+REQUEST_TIMEOUT_SECONDS = 0.5
+CONCURRENCY = 16
+
+
+def main():
+    app = LocalHttpTarget(latency_seconds=0.002)
+    # Answers after the request timeout, every request to it times out
+    stuck = LocalHttpTarget(latency_seconds=2 * REQUEST_TIMEOUT_SECONDS)
+    try:
+        for nb_targets in (1, 4, 8, 16):
+            targets = {f"target-{i}": f"{app.url}/game/{i}" for i in range(nb_targets - 1)}
+            targets["stuck"] = f"{stuck.url}/game"
+            query = load_lambda("query_app", {
+                "APP_URL": f"{app.url}/game", "PROBE_TARGETS": json.dumps(targets), "PRIMARY_TARGET": "target-0",
+                "CONCURRENCY": str(CONCURRENCY), "PROBE_DURATION_SECONDS": str(PROBE_DURATION_SECONDS),
+                "TARGET_RPS": str(TARGET_RPS), "REQUEST_TIMEOUT_SECONDS": str(REQUEST_TIMEOUT_SECONDS),
+                "POWERTOOLS_SERVICE_NAME": "local", "POWERTOOLS_METRICS_NAMESPACE": "local", "LOG_LEVEL": "WARNING"})
+            tracemalloc.start()
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                result = query.lambda_handler({}, LambdaContext(TIMEOUT_SECONDS))
+            duration = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            figures = result["availability"]["targets"]
+            healthy = [figures[name]["probes"] for name in figures if name != "stuck"]
+            print(f"{nb_targets:>2} targets: {duration:5.2f} s of {TIMEOUT_SECONDS} s, "
+                  f"{min(healthy, default=0):>3}-{max(healthy, default=0):>3} requests per healthy target, "
+                  f"{figures['stuck']['probes']:>3} to the stuck one "
+                  f"({figures['stuck']['availabilityPercent']} % available), peak memory {peak / 1024:.0f} KiB")
+            assert duration < TIMEOUT_SECONDS - query.SAFETY_MARGIN_SECONDS
+    finally:
+        app.close()
+        stuck.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""Warm invocation latency of the AWS SDK calls and HTTP requests of the Lambda functions, with the clients and
+sessions created as the handlers used to, and with the shared ones of the chaos_runtime layer.
+
+Each invocation makes its calls from as many threads as the probes of query_app, against a local server standing in
+for the AWS API and the web application, whose new connections wait for a TLS-like handshake. The server runs in its
+own process, so that it does not compete with the clients for the GIL. The first invocation is the cold one and is
+not counted.
+
+    python resources/lambdas/local/bench_runtime.py
+"""
+import os
+import time
+import multiprocessing
+import concurrent.futures
+from fakes import LocalHttpTarget
+from loader import RUNTIME_PATH  # noqa: F401, puts the runtime layer on the path
+
+INVOCATIONS = 30
+THREADS = 16
+CALLS_PER_THREAD = 3
+HANDSHAKE_SECONDS = 0.05
+LATENCY_SECONDS = 0.01
+
+
+class RemoteTarget:
+    """A LocalHttpTarget running in a child process"""
+
+    def __init__(self, **kwargs):
+        self.pipe, child = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=self.serve, args=(child, kwargs), daemon=True)
+        self.process.start()
+        self.url = self.pipe.recv()
+
+    @staticmethod
+    def serve(pipe, kwargs):
+        target = LocalHttpTarget(**kwargs)
+        pipe.send(target.url)
+        while pipe.recv() == "connections":
+            pipe.send(target.connections)
+        target.close()
+
+    @property
+    def connections(self) -> int:
+        self.pipe.send("connections")
+        return self.pipe.recv()
+
+    def close(self):
+        self.pipe.send("close")
+        self.process.join()
+
+
+def invoke(call) -> float:
+    """Duration in milliseconds of one invocation making its calls in parallel"""
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=THREADS) as executor:
+        for future in [executor.submit(lambda: [call() for _ in range(CALLS_PER_THREAD)]) for _ in range(THREADS)]:
+            future.result()
+    return (time.perf_counter() - start) * 1000
+
+
+def run(name: str, target: RemoteTarget, setup):
+    """setup runs at the start of each invocation and returns the call to make"""
+    durations = []
+    connections = 0
+    for i in range(INVOCATIONS):
+        opened = target.connections
+        durations.append(invoke(setup()))
+        if i:
+            connections += target.connections - opened
+    warm = sorted(durations[1:])
+    p50, p95 = warm[len(warm) // 2], warm[int(len(warm) * 0.95)]
+    print(f"{name:>38}: cold {durations[0]:6.1f} ms, warm p50 {p50:6.1f} ms, p95 {p95:6.1f} ms, "
+          f"{connections / len(warm):5.1f} new connections per warm invocation")
+
+
+def main():
+    target = RemoteTarget(latency_seconds=LATENCY_SECONDS, handshake_seconds=HANDSHAKE_SECONDS)
+    os.environ.update({"AWS_DEFAULT_REGION": "eu-west-1", "AWS_ACCESS_KEY_ID": "local",
+                       "AWS_SECRET_ACCESS_KEY": "local", "AWS_ENDPOINT_URL_DYNAMODB": target.url})
+    import boto3
+    import requests
+    from chaos_runtime import clients, sessions
+    key = {"pk": {"S": "score"}}
+    try:
+        print(f"{THREADS} threads x {CALLS_PER_THREAD} calls per invocation, {INVOCATIONS - 1} warm invocations")
+
+        def client_per_invocation():
+            dynamodb = boto3.client("dynamodb")
+            return lambda: dynamodb.get_item(TableName="local", Key=key)
+        run("DynamoDB, client per invocation", target, client_per_invocation)
+
+        default_client = boto3.client("dynamodb")
+        run("DynamoDB, botocore defaults", target,
+            lambda: lambda: default_client.get_item(TableName="local", Key=key))
+
+        shared_client = clients.client("dynamodb")
+        run("DynamoDB, chaos_runtime client", target,
+            lambda: lambda: shared_client.get_item(TableName="local", Key=key))
+
+        run("HTTP, requests.get", target, lambda: lambda: requests.get(target.url, timeout=2))
+
+        session = sessions.requests_session(THREADS)
+        run("HTTP, chaos_runtime session", target, lambda: lambda: session.get(target.url, timeout=2))
+
+        http = sessions.pool_manager(maxsize=THREADS)
+        run("HTTP, chaos_runtime pool manager", target, lambda: lambda: http.request("GET", target.url))
+    finally:
+        target.close()
+
+
+if __name__ == "__main__":
+    main()
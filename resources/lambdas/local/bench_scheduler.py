@@ -0,0 +1,80 @@
+"""Spread of the picks and latency per pick of each scheduling strategy, with a local DynamoDB stand-in. Then two
+executions picking at the same time with round robin: the picks saved are never lost, so the templates are picked
+evenly unless some picks are given up after too many conflicts. Last, the time per pick with the state kept in
+memory, whatever the number of templates
+
+    python resources/lambdas/local/bench_scheduler.py
+"""
+import os
+import sys
+import time
+import random
+import threading
+from fakes import FakeFis, FakeTable
+from loader import LAMBDAS_PATH
+
+sys.path.insert(0, os.path.join(LAMBDAS_PATH, "trigger_experiment"))
+from lib.scheduler import ExperimentScheduler, STRATEGIES  # noqa: E402
+
+NB_GAMES = 10000
+# Seconds between two lost games, and cool-down of a template
+GAME_INTERVAL_SECONDS = 60
+COOLDOWN_SECONDS = 150
+NB_CONCURRENT_PICKS = 500
+
+
+def main():
+    templates = FakeFis("bench", nb_templates=4).templates
+    templates[0]["tags"]["Weight"] = "3"
+    for strategy in STRATEGIES:
+        table = FakeTable()
+        scheduler = ExperimentScheduler(table=table, strategy=strategy, cooldown_seconds=COOLDOWN_SECONDS)
+        picks = {template["id"]: 0 for template in templates}
+        back_to_back = 0
+        previous = None
+        start = time.perf_counter()
+        for game in range(NB_GAMES):
+            template_id = scheduler.pick(templates, now=game * GAME_INTERVAL_SECONDS, version=1)["id"]
+            picks[template_id] += 1
+            back_to_back += template_id == previous
+            previous = template_id
+        per_pick = (time.perf_counter() - start) / NB_GAMES * 1e6
+        print(f"{strategy:>12}: {per_pick:6.1f} us/pick, back to back: {back_to_back:5d}, "
+              f"table calls per pick: { {k: v / NB_GAMES for k, v in table.calls.items()} }, picks: {picks}")
+
+    # Two warm sandboxes of the trigger function share the state, each call to the table taking 1 ms, and each
+    # execution starting the experiment picked for up to 5 ms before the next one
+    table = FakeTable(latency_seconds=0.001)
+    schedulers = [ExperimentScheduler(table=table, strategy="round_robin") for _ in range(2)]
+    picks = {template["id"]: 0 for template in templates}
+    lock = threading.Lock()
+
+    def execution(scheduler: ExperimentScheduler):
+        for _ in range(NB_CONCURRENT_PICKS):
+            template_id = scheduler.pick(templates, version=1)["id"]
+            with lock:
+                picks[template_id] += 1
+            time.sleep(random.uniform(0, 0.005))
+
+    threads = [threading.Thread(target=execution, args=(scheduler,)) for scheduler in schedulers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    print(f"  concurrent: {2 * NB_CONCURRENT_PICKS} picks, {sum(s.conflicts for s in schedulers)} conflicts picked "
+          f"again, {sum(s.unsaved for s in schedulers)} not saved after {schedulers[0].max_attempts} attempts, "
+          f"picks: {picks}")
+
+    for nb_templates in (4, 400):
+        templates = FakeFis("bench", nb_templates=nb_templates).templates
+        for strategy in STRATEGIES:
+            scheduler = ExperimentScheduler(strategy=strategy, cooldown_seconds=COOLDOWN_SECONDS)
+            start = time.perf_counter()
+            for game in range(NB_GAMES):
+                scheduler.pick(templates, now=game * GAME_INTERVAL_SECONDS, version=1)
+            per_pick = (time.perf_counter() - start) / NB_GAMES * 1e6
+            print(f"{strategy:>12}: {per_pick:6.1f} us/pick in memory with {nb_templates} templates")
+
+
+if __name__ == "__main__":
+    main()
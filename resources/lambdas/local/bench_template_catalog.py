@@ -0,0 +1,37 @@
+"""Cold vs warm latency of the trigger_experiment handler against a stubbed FIS client
+
+    python resources/lambdas/local/bench_template_catalog.py
+"""
+import time
+import statistics
+from loader import load_lambda, LambdaContext
+from fakes import FakeFis
+
+PROJECT_TAG = "chaos-game-local"
+NB_WARM_INVOCATIONS = 50
+
+
+def main():
+    trigger = load_lambda("trigger_experiment", {"PROJECT_TAG": PROJECT_TAG})
+    fake_fis = FakeFis(PROJECT_TAG, nb_templates=4, nb_other_templates=20, page_size=5)
+    trigger.fis = trigger.catalog.fis = fake_fis
+
+    start = time.perf_counter()
+    trigger.lambda_handler({}, LambdaContext())
+    cold = (time.perf_counter() - start) * 1000
+    cold_calls = dict(fake_fis.calls)
+
+    fake_fis.calls.clear()
+    warm = []
+    for _ in range(NB_WARM_INVOCATIONS):
+        start = time.perf_counter()
+        trigger.lambda_handler({}, LambdaContext())
+        warm.append((time.perf_counter() - start) * 1000)
+
+    print(f"cold: {cold:.1f} ms, FIS calls: {cold_calls}")
+    print(f"warm: median {statistics.median(warm):.1f} ms, max {max(warm):.1f} ms, "
+          f"FIS calls per invocation: { {k: v / NB_WARM_INVOCATIONS for k, v in fake_fis.calls.items()} }")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""Benchmark of the Lambda handlers against the local stand-ins: cold start, warm latency and throughput.
+
+The cold start is the import of the handler module in a fresh interpreter, as on a new Lambda sandbox, plus the
+creation of the clients it defers to its first invocation. The import profile is in profile_imports.py. The warm
+latency and the throughput are measured on repeated invocations in the same process.
+
+    python resources/lambdas/local/benchmark.py [--invocations 200] [--cold-runs 5]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+from harness import Harness, PROJECT_TAG
+
+HANDLERS = ("admit_experiment", "trigger_experiment", "check_experiment", "query_app", "cleanup_ecr")
+
+COLD_START_ENVIRONMENT = {"PROJECT_TAG": PROJECT_TAG, "SCORE_TABLE_NAME": "local", "ECR_REPOSITORY_NAME": "local",
+                          "APP_URL": "http://127.0.0.1/game", "POWERTOOLS_METRICS_NAMESPACE": PROJECT_TAG}
+# The clients created lazily are created too, as the first invocation would do
+COLD_START_SCRIPT = """
+import json, time
+start = time.perf_counter()
+from loader import load_lambda
+module = load_lambda({name!r}, {environment!r})
+loaded = time.perf_counter()
+for value in list(vars(module).values()):
+    if type(value).__name__ == "LazyClient":
+        value.resolve()
+print(json.dumps({{"importMs": (loaded - start) * 1000, "firstUseMs": (time.perf_counter() - loaded) * 1000}}))
+"""
+
+
+def cold_start(name: str, runs: int) -> dict:
+    """Median time to import the handler module, and to create the clients it defers to the first invocation"""
+    results = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-c", COLD_START_SCRIPT.format(name=name, environment=COLD_START_ENVIRONMENT)],
+                                cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True,
+                                check=True).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    return {key: statistics.median(result[key] for result in results) for key in ("importMs", "firstUseMs")}
+
+
+def warm_invocations(harness: Harness, invocations: int) -> dict:
+    """One representative event per handler, invoked repeatedly. Returns the latency of each invocation in ms"""
+    experiment = harness.invoke(harness.trigger, {})
+    harness.fis.set_status(experiment["experimentId"], "running")
+    cfn_event = {"RequestType": "Delete", "ResponseURL": f"{harness.app.url}/cfn", "StackId": "local-stack",
+                 "RequestId": "local-request", "LogicalResourceId": "CleanupEcr"}
+    calls = {
+        "admit_experiment": lambda i: (
+            harness.invoke(harness.admit, {"Records": [{"messageId": f"msg-{i}", "body": json.dumps(
+                {"game_result": "FAILED", "client_id": f"device-{i}", "received_at": i})}]}),
+            harness.table.delete_item(Key={"pk": f"inflight#{PROJECT_TAG}"})),
+        "trigger_experiment": lambda i: harness.invoke(harness.trigger, {}),
+        "check_experiment": lambda i: harness.invoke(harness.check, {"experimentId": experiment["experimentId"]}),
+        "query_app": lambda i: harness.invoke(harness.query, dict(experiment), 20),
+        "cleanup_ecr": lambda i: (harness.ecr.__init__(nb_images=250, latency_seconds=0),
+                                  harness.invoke(harness.cleanup, cfn_event, 900)),
+    }
+    latencies = {}
+    for name in HANDLERS:
+        # The probes run for a fixed duration, a few invocations are enough
+        count = invocations if name != "query_app" else max(invocations // 50, 3)
+        durations = []
+        for i in range(count):
+            start = time.perf_counter()
+            calls[name](i)
+            durations.append((time.perf_counter() - start) * 1000)
+        latencies[name] = durations
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--invocations", type=int, default=200)
+    parser.add_argument("--cold-runs", type=int, default=5)
+    args = parser.parse_args()
+
+    # Fixed number of probes instead of a duration, so that the query_app throughput is comparable between runs
+    harness = Harness(probe_seconds=0)
+    try:
+        warm = warm_invocations(harness, args.invocations)
+        probes = harness.app.requests
+    finally:
+        harness.close()
+
+    print(f"{'handler':>20} | {'import ms':>9} | {'first use ms':>12} | {'warm p50 ms':>11} | {'warm p95 ms':>11} | "
+          f"{'invocations/s':>13}")
+    for name in HANDLERS:
+        cold = cold_start(name, args.cold_runs)
+        durations = sorted(warm[name])
+        p95 = durations[min(int(len(durations) * 0.95), len(durations) - 1)]
+        throughput = len(durations) / (sum(durations) / 1000)
+        print(f"{name:>20} | {cold['importMs']:9.1f} | {cold['firstUseMs']:12.1f} | {statistics.median(durations):11.2f} | "
+              f"{p95:11.2f} | {throughput:13.1f}")
+    print(f"query_app sent {probes} probes to the local application")
+
+
+if __name__ == "__main__":
+    main()
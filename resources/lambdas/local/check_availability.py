@@ -0,0 +1,102 @@
+"""Check the availability figures of query_app against a reference computed from the full list of probe windows, on
+long random experiments with outages, probed by several invocations which carry the counters from one to the next.
+
+It also measures the memory kept by the computation, which must not grow with the number of probes.
+
+    python resources/lambdas/local/check_availability.py
+"""
+import json
+import random
+import tracemalloc
+from loader import load_lambda
+
+WINDOW_SECONDS = 1
+PROBES_PER_WINDOW = 5
+EXPERIMENTS = 200
+
+
+def timeline(rng: random.Random, nb_windows: int) -> list:
+    """(start, requests, errors) of the windows of an experiment, with outages of random lengths, and gaps without
+    probes between the invocations
+    """
+    windows = []
+    clock = 1_700_000_000
+    down = False
+    for _ in range(nb_windows):
+        if rng.random() < 0.05:
+            down = not down
+        clock += WINDOW_SECONDS * (rng.randint(2, 3) if rng.random() < 0.1 else 1)
+        requests = rng.randint(1, PROBES_PER_WINDOW)
+        errors = rng.randint(requests // 2 + 1, requests) if down else rng.randint(0, requests // 2)
+        windows.append((clock, requests, errors))
+    return windows
+
+
+def reference(windows: list, error_rate: float) -> dict:
+    """The figures computed from the whole timeline, outage by outage"""
+    outages = []
+    current = None
+    for start, requests, errors in windows:
+        if errors > error_rate * requests:
+            current = current or {"start": start}
+            current["end"] = start + WINDOW_SECONDS
+        elif current:
+            outages.append(dict(current, recovered=start))
+            current = None
+    if current:
+        outages.append(current)
+    recovered = [outage["recovered"] - outage["start"] for outage in outages if "recovered" in outage]
+    probes = sum(requests for _, requests, _ in windows)
+    failed = sum(errors for _, _, errors in windows)
+    return {
+        "probes": probes,
+        "failedProbes": failed,
+        "availabilityPercent": round(100 * (1 - failed / probes), 3),
+        "outages": len(outages),
+        "longestOutageSeconds": max((outage["end"] - outage["start"] for outage in outages), default=0),
+        "timeToRecoverSeconds": round(sum(recovered) / len(recovered), 3) if recovered else 0,
+        "downtimeSeconds": sum(WINDOW_SECONDS for _, requests, errors in windows if errors > error_rate * requests),
+    }
+
+
+def run(query, windows: list, invocations: int) -> dict:
+    """The figures computed by query_app, the windows being split between several invocations"""
+    state = None
+    size = -(-len(windows) // invocations)
+    for i in range(0, len(windows), size):
+        # Each invocation starts from the counters carried in the state machine payload
+        availability = query.Availability(WINDOW_SECONDS, json.loads(json.dumps(state)) if state else None)
+        for window in windows[i:i + size]:
+            availability.add(*window)
+        state = availability.to_dict()
+    return state
+
+
+def main():
+    query = load_lambda("query_app", {"APP_URL": "http://127.0.0.1", "POWERTOOLS_SERVICE_NAME": "local"})
+    rng = random.Random(0)
+    for experiment in range(EXPERIMENTS):
+        windows = timeline(rng, rng.randint(10, 600))
+        expected = reference(windows, query.OUTAGE_ERROR_RATE)
+        figures = run(query, windows, rng.randint(1, 6))
+        wrong = {name: (figures[name], value) for name, value in expected.items() if figures[name] != value}
+        assert not wrong, f"experiment {experiment}: {wrong}"
+    print(f"{EXPERIMENTS} experiments: the figures match the reference")
+
+    for nb_windows in (1_000, 100_000, 1_000_000):
+        windows = timeline(rng, nb_windows)
+        tracemalloc.start()
+        availability = query.Availability(WINDOW_SECONDS)
+        before = tracemalloc.get_traced_memory()[0]
+        for window in windows:
+            availability.add(*window)
+        kept = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+        figures = availability.to_dict()
+        print(f"{nb_windows:>9} windows, {figures['probes']:>9} probes: {figures['availabilityPercent']} %, "
+              f"{figures['outages']} outages, longest {figures['longestOutageSeconds']} s, "
+              f"recovered in {figures['timeToRecoverSeconds']} s, {kept} bytes kept")
+
+
+if __name__ == "__main__":
+    main()
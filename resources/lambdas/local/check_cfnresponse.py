@@ -0,0 +1,60 @@
+"""Checks of the cfnresponse sender of cleanup_ecr against a local HTTP server standing in for the response URL
+
+    python resources/lambdas/local/check_cfnresponse.py
+"""
+import time
+from loader import load_lambda, LambdaContext
+from fakes import LocalHttpTarget
+
+EVENT = {"RequestType": "Delete", "StackId": "local-stack", "RequestId": "local-request",
+         "LogicalResourceId": "CleanupEcr"}
+
+
+def check(name: str, condition: bool, details: str):
+    print(f"{'OK' if condition else 'FAILED':>6} {name}: {details}")
+    assert condition, name
+
+
+def main():
+    cfnresponse = load_lambda("cleanup_ecr", {"ECR_REPOSITORY_NAME": "local"}).cfnresponse
+    cfnresponse.BASE_BACKOFF_SECONDS = 0.05
+
+    target = LocalHttpTarget()
+    event = dict(EVENT, ResponseURL=f"{target.url}/cfn")
+    try:
+        target.put_failures = 3
+        sent = cfnresponse.send(event, LambdaContext(10), cfnresponse.SUCCESS, {"deletedImages": 1})
+        check("retried", sent and len(target.puts) == 1 and target.puts[0]["Status"] == "SUCCESS",
+              f"sent after 3 failures, {len(target.puts)} response recorded")
+
+        target.puts.clear()
+        sent = cfnresponse.send(event, LambdaContext(10), cfnresponse.SUCCESS, {"images": "x" * 5000})
+        check("size", sent and target.puts[0]["Status"] == "FAILED" and target.puts[0]["Data"] == {},
+              f"oversized response sent as {target.puts[0]['Status']}: {target.puts[0]['Reason'][:50]}...")
+
+        target.put_delay_seconds = 3
+        start = time.monotonic()
+        sent = cfnresponse.send(event, LambdaContext(2), cfnresponse.SUCCESS, {})
+        duration = time.monotonic() - start
+        check("deadline", not sent and duration < 2, f"gave up after {duration:.2f} s with 2 s left")
+        target.put_delay_seconds = 0
+
+        connections = target.connections
+        cfnresponse.http.clear()
+        cfnresponse.prepare(event).join()
+        sent = cfnresponse.send(event, LambdaContext(10), cfnresponse.SUCCESS, {})
+        check("prepared", sent and target.connections - connections == 1,
+              f"{target.connections - connections} connection opened for the warm-up and the response")
+    finally:
+        target.close()
+        # The server keeps serving the connections already open
+        cfnresponse.http.clear()
+
+    start = time.monotonic()
+    sent = cfnresponse.send(event, LambdaContext(3), cfnresponse.SUCCESS, {})
+    duration = time.monotonic() - start
+    check("unreachable", not sent and duration < 3, f"gave up after {duration:.2f} s with 3 s left")
+
+
+if __name__ == "__main__":
+    main()
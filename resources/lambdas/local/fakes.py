@@ -0,0 +1,514 @@
+import io
+import re
+import sys
+import copy
+import json
+import time
+import uuid
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from datetime import datetime, timezone
+
+
+class ClientError(Exception):
+    """Stand-in for the botocore ClientError raised by the fake clients"""
+    def __init__(self, code: str, message: str = ""):
+        super().__init__(f"{code}: {message}")
+        self.response = {"Error": {"Code": code, "Message": message}}
+
+
+class FakeExceptions:
+    class ResourceNotFoundException(ClientError):
+        def __init__(self, message: str = ""):
+            super().__init__("ResourceNotFoundException", message)
+
+
+class FakeFis:
+    """In-process stand-in for the FIS client. Every call sleeps for the given latency to mimic the API round trip"""
+    exceptions = FakeExceptions
+
+    def __init__(self, project_tag: str, nb_templates: int = 4, nb_other_templates: int = 0, page_size: int = 2,
+                 latency_seconds: float = 0.05):
+        self.page_size = page_size
+        self.latency_seconds = latency_seconds
+        self.templates = [
+            {"id": f"EXT{i:05d}", "tags": {"Project": project_tag, "Name": f"{project_tag}-template-{i}"}}
+            for i in range(nb_templates)
+        ] + [
+            {"id": f"OTH{i:05d}", "tags": {"Project": "other", "Name": f"other-template-{i}"}}
+            for i in range(nb_other_templates)
+        ]
+        self.experiments = {}
+        self.calls = {}
+
+    def _call(self, name: str):
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+
+    def list_experiment_templates(self, nextToken: str = None, **kwargs) -> dict:
+        self._call("list_experiment_templates")
+        start = int(nextToken or 0)
+        response = {"experimentTemplates": self.templates[start:start + self.page_size]}
+        if start + self.page_size < len(self.templates):
+            response["nextToken"] = str(start + self.page_size)
+        return response
+
+    def start_experiment(self, experimentTemplateId: str, tags: dict = None, **kwargs) -> dict:
+        self._call("start_experiment")
+        if experimentTemplateId not in {template["id"] for template in self.templates}:
+            raise self.exceptions.ResourceNotFoundException(experimentTemplateId)
+        experiment = {"id": f"EXP{uuid.uuid4().hex[:12]}", "experimentTemplateId": experimentTemplateId,
+                      "tags": tags or {}, "state": {"status": "initiating"}}
+        self.experiments[experiment["id"]] = experiment
+        return {"experiment": experiment}
+
+    def get_experiment(self, id: str) -> dict:
+        self._call("get_experiment")
+        if id not in self.experiments:
+            raise self.exceptions.ResourceNotFoundException(id)
+        return {"experiment": self.experiments[id]}
+
+    def set_status(self, experiment_id: str, status: str):
+        self.experiments[experiment_id]["state"]["status"] = status
+
+
+class ConditionalCheckFailedException(ClientError):
+    def __init__(self, message: str = "The conditional request failed"):
+        super().__init__("ConditionalCheckFailedException", message)
+
+
+class TransactionCanceledException(ClientError):
+    def __init__(self, reasons: list):
+        super().__init__("TransactionCanceledException", "Transaction cancelled")
+        self.response["CancellationReasons"] = [{"Code": reason} for reason in reasons]
+
+
+def _untyped(value: dict):
+    """Python value of an attribute value in the low-level format of the DynamoDB client, strings and numbers only"""
+    if "S" in value:
+        return value["S"]
+    number = float(value["N"])
+    return int(number) if number.is_integer() else number
+
+
+class FakeTable:
+    """In-process stand-in for a boto3 DynamoDB Table resource with a "pk" partition key.
+
+    It understands the subset of the expression language used by this project: SET with plain values,
+    if_not_exists() and +/- arithmetic, ADD and REMOVE clauses, and conditions made of attribute_exists(),
+    attribute_not_exists(), size(), comparisons and [NOT] IN joined by AND / OR. Its meta.client runs transactions
+    of Put and Update items on the table.
+    """
+
+    class exceptions:
+        ConditionalCheckFailedException = ConditionalCheckFailedException
+        TransactionCanceledException = TransactionCanceledException
+
+    def __init__(self, latency_seconds: float = 0, name: str = "local"):
+        self.name = name
+        self.meta = SimpleNamespace(client=SimpleNamespace(exceptions=self.exceptions,
+                                                           transact_write_items=self.transact_write_items))
+        self.items = {}
+        self.latency_seconds = latency_seconds
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def _call(self, name: str):
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+
+    @staticmethod
+    def _path(token: str, names: dict) -> list:
+        return [names.get(part, part) for part in token.strip().split(".")]
+
+    @staticmethod
+    def _get(item: dict, path: list):
+        for part in path:
+            if not isinstance(item, dict) or part not in item:
+                return None
+            item = item[part]
+        return item
+
+    @staticmethod
+    def _set(item: dict, path: list, value):
+        for part in path[:-1]:
+            item = item.setdefault(part, {})
+        item[path[-1]] = value
+
+    @staticmethod
+    def _remove(item: dict, path: list):
+        for part in path[:-1]:
+            item = item.get(part, {})
+        item.pop(path[-1], None)
+
+    def _operand(self, item: dict, token: str, names: dict, values: dict):
+        token = token.strip()
+        if token.startswith(":"):
+            return values[token]
+        match = re.fullmatch(r"if_not_exists\((.+),(.+)\)", token)
+        if match:
+            current = self._get(item, self._path(match.group(1), names))
+            return current if current is not None else self._operand(item, match.group(2), names, values)
+        match = re.fullmatch(r"size\((.+)\)", token)
+        if match:
+            current = self._get(item, self._path(match.group(1), names))
+            return len(current) if current is not None else 0
+        return self._get(item, self._path(token, names))
+
+    def _value(self, item: dict, expression: str, names: dict, values: dict):
+        match = re.fullmatch(r"(.*\S)\s*([+-])\s*(:\w+)", expression.strip())
+        if match:
+            left = self._operand(item, match.group(1), names, values)
+            right = values[match.group(3)]
+            return left + right if match.group(2) == "+" else left - right
+        return self._operand(item, expression, names, values)
+
+    def _condition(self, item: dict, expression: str, names: dict, values: dict) -> bool:
+        if not expression:
+            return True
+        for alternative in re.split(r"\s+OR\s+", expression):
+            if all(self._predicate(item, predicate, names, values)
+                   for predicate in re.split(r"\s+AND\s+", alternative)):
+                return True
+        return False
+
+    def _predicate(self, item: dict, predicate: str, names: dict, values: dict) -> bool:
+        predicate = predicate.strip().strip("()") if predicate.strip().startswith("(") else predicate.strip()
+        match = re.fullmatch(r"attribute_(not_)?exists\((.+)\)", predicate)
+        if match:
+            exists = self._get(item, self._path(match.group(2), names)) is not None
+            return not exists if match.group(1) else exists
+        match = re.fullmatch(r"(NOT\s+)?(.+?)\s+IN\s+\((.+)\)", predicate)
+        if match:
+            current = self._operand(item, match.group(2), names, values)
+            found = current is not None and current in [values[value.strip()] for value in match.group(3).split(",")]
+            return not found if match.group(1) else found
+        match = re.fullmatch(r"(.+?)\s*(<>|<=|>=|=|<|>)\s*(.+)", predicate)
+        left = self._operand(item, match.group(1), names, values)
+        right = self._operand(item, match.group(3), names, values)
+        if left is None or right is None:
+            return match.group(2) == "<>" and left != right
+        return {"=": left == right, "<>": left != right, "<": left < right, "<=": left <= right,
+                ">": left > right, ">=": left >= right}[match.group(2)]
+
+    def _update(self, item: dict, expression: str, names: dict, values: dict):
+        clauses = re.split(r"\b(SET|ADD|REMOVE)\b", expression)
+        for keyword, body in zip(clauses[1::2], clauses[2::2]):
+            for action in [a for a in re.split(r",(?![^()]*\))", body) if a.strip()]:
+                if keyword == "SET":
+                    path, value = action.split("=", 1)
+                    self._set(item, self._path(path, names), self._value(item, value, names, values))
+                elif keyword == "ADD":
+                    path, value = action.split()
+                    path = self._path(path, names)
+                    current = self._get(item, path)
+                    increment = values[value]
+                    if isinstance(increment, set):
+                        self._set(item, path, (current or set()) | increment)
+                    else:
+                        self._set(item, path, (current or 0) + increment)
+                else:
+                    self._remove(item, self._path(action, names))
+
+    def get_item(self, Key: dict, ConsistentRead: bool = False, **kwargs) -> dict:
+        self._call("get_item")
+        with self.lock:
+            item = self.items.get(Key["pk"])
+            return {"Item": copy.deepcopy(item)} if item is not None else {}
+
+    def put_item(self, Item: dict, ConditionExpression: str = None, ExpressionAttributeNames: dict = None,
+                 ExpressionAttributeValues: dict = None, **kwargs) -> dict:
+        self._call("put_item")
+        with self.lock:
+            current = self.items.get(Item["pk"], {})
+            if not self._condition(current, ConditionExpression, ExpressionAttributeNames or {},
+                                   ExpressionAttributeValues or {}):
+                raise ConditionalCheckFailedException()
+            self.items[Item["pk"]] = copy.deepcopy(Item)
+        return {}
+
+    def update_item(self, Key: dict, UpdateExpression: str, ExpressionAttributeNames: dict = None,
+                    ExpressionAttributeValues: dict = None, ConditionExpression: str = None,
+                    ReturnValues: str = "NONE", **kwargs) -> dict:
+        self._call("update_item")
+        names, values = ExpressionAttributeNames or {}, ExpressionAttributeValues or {}
+        with self.lock:
+            item = copy.deepcopy(self.items.get(Key["pk"], {}))
+            if not self._condition(item, ConditionExpression, names, values):
+                raise ConditionalCheckFailedException()
+            item.update(Key)
+            self._update(item, UpdateExpression, names, values)
+            self.items[Key["pk"]] = item
+            return {"Attributes": copy.deepcopy(item)} if ReturnValues != "NONE" else {}
+
+    def delete_item(self, Key: dict, **kwargs) -> dict:
+        self._call("delete_item")
+        with self.lock:
+            self.items.pop(Key["pk"], None)
+        return {}
+
+    def transact_write_items(self, TransactItems: list, **kwargs) -> dict:
+        self._call("transact_write_items")
+        with self.lock:
+            written = {}
+            reasons = []
+            for action in TransactItems:
+                kind, request = next(iter(action.items()))
+                names = request.get("ExpressionAttributeNames", {})
+                values = {name: _untyped(value) for name, value in request.get("ExpressionAttributeValues", {}).items()}
+                key = _untyped((request.get("Item") or request.get("Key"))["pk"])
+                item = copy.deepcopy(self.items.get(key, {}))
+                if not self._condition(item, request.get("ConditionExpression"), names, values):
+                    reasons.append("ConditionalCheckFailed")
+                    continue
+                reasons.append("None")
+                if kind == "Put":
+                    written[key] = {name: _untyped(value) for name, value in request["Item"].items()}
+                else:
+                    item["pk"] = key
+                    self._update(item, request["UpdateExpression"], names, values)
+                    written[key] = item
+            if "ConditionalCheckFailed" in reasons:
+                raise TransactionCanceledException(reasons)
+            self.items.update(written)
+        return {}
+
+
+class FakeStepFunctions:
+    """In-process stand-in for the Step Functions client, recording the started executions and the task results"""
+
+    class exceptions:
+        class ExecutionAlreadyExists(ClientError):
+            def __init__(self, message: str = ""):
+                super().__init__("ExecutionAlreadyExists", message)
+
+        class TaskTimedOut(ClientError):
+            def __init__(self, message: str = ""):
+                super().__init__("TaskTimedOut", message)
+
+        class InvalidToken(ClientError):
+            def __init__(self, message: str = ""):
+                super().__init__("InvalidToken", message)
+
+        class TaskDoesNotExist(ClientError):
+            def __init__(self, message: str = ""):
+                super().__init__("TaskDoesNotExist", message)
+
+    def __init__(self):
+        self.executions = {}
+        self.task_results = {}
+        self.calls = {}
+
+    def _call(self, name: str):
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    def start_execution(self, stateMachineArn: str, name: str = None, input: str = "{}", **kwargs) -> dict:
+        self._call("start_execution")
+        name = name or uuid.uuid4().hex
+        if name in self.executions:
+            raise self.exceptions.ExecutionAlreadyExists(name)
+        self.executions[name] = {"stateMachineArn": stateMachineArn, "input": input, "status": "RUNNING"}
+        return {"executionArn": f"{stateMachineArn}:{name}"}
+
+    def send_task_success(self, taskToken: str, output: str) -> dict:
+        self._call("send_task_success")
+        if taskToken in self.task_results:
+            raise self.exceptions.TaskDoesNotExist(taskToken)
+        self.task_results[taskToken] = output
+        return {}
+
+
+class FakeEcr:
+    """In-process stand-in for the ECR client, holding the images of one repository"""
+    exceptions = SimpleNamespace(ClientError=ClientError)
+
+    def __init__(self, nb_images: int = 250, page_size: int = 100, latency_seconds: float = 0.02,
+                 failure_rate: float = 0, seed: int = 0):
+        self.images = {f"sha256:{i:064x}": f"tag-{i}" for i in range(nb_images)}
+        self.page_size = page_size
+        self.latency_seconds = latency_seconds
+        self.failure_rate = failure_rate
+        self.rng = random.Random(seed)
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def _call(self, name: str):
+        with self.lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+
+    def list_images(self, repositoryName: str, nextToken: str = None, maxResults: int = None, **kwargs) -> dict:
+        self._call("list_images")
+        page_size = min(maxResults or self.page_size, 1000)
+        with self.lock:
+            digests = sorted(self.images)
+        start = int(nextToken or 0)
+        response = {"imageIds": [{"imageDigest": d, "imageTag": self.images[d]} for d in digests[start:start + page_size]]}
+        if start + page_size < len(digests):
+            response["nextToken"] = str(start + page_size)
+        return response
+
+    def batch_delete_image(self, repositoryName: str, imageIds: list, **kwargs) -> dict:
+        self._call("batch_delete_image")
+        if len(imageIds) > 100:
+            raise ClientError("InvalidParameterException", "imageIds must contain at most 100 items")
+        deleted, failures = [], []
+        with self.lock:
+            for image_id in imageIds:
+                digest = image_id.get("imageDigest")
+                if digest not in self.images:
+                    failures.append({"imageId": image_id, "failureCode": "ImageNotFound"})
+                elif self.rng.random() < self.failure_rate:
+                    failures.append({"imageId": image_id, "failureCode": "ImageReferencedByManifestList"})
+                else:
+                    del self.images[digest]
+                    deleted.append(image_id)
+        return {"imageIds": deleted, "failures": failures}
+
+
+class FakeS3:
+    """In-process stand-in for the S3 client, holding the objects of every bucket by key"""
+
+    def __init__(self, page_size: int = 1000):
+        self.objects = {}
+        self.page_size = page_size
+        self.calls = {}
+
+    def _call(self, name: str):
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    def put_object(self, Bucket: str, Key: str, Body: bytes, **kwargs) -> dict:
+        self._call("put_object")
+        self.objects[(Bucket, Key)] = (bytes(Body), datetime.now(timezone.utc))
+        return {}
+
+    def get_object(self, Bucket: str, Key: str, **kwargs) -> dict:
+        self._call("get_object")
+        if (Bucket, Key) not in self.objects:
+            raise ClientError("NoSuchKey", Key)
+        body, modified = self.objects[(Bucket, Key)]
+        return {"Body": io.BytesIO(body), "ContentLength": len(body), "LastModified": modified}
+
+    def list_objects_v2(self, Bucket: str, Prefix: str = "", ContinuationToken: str = None, **kwargs) -> dict:
+        self._call("list_objects_v2")
+        keys = sorted(key for bucket, key in self.objects if bucket == Bucket and key.startswith(Prefix))
+        start = int(ContinuationToken or 0)
+        contents = [{"Key": key, "Size": len(self.objects[(Bucket, key)][0]),
+                     "LastModified": self.objects[(Bucket, key)][1]} for key in keys[start:start + self.page_size]]
+        response = {"Contents": contents, "KeyCount": len(contents)}
+        if start + self.page_size < len(keys):
+            response["NextContinuationToken"] = str(start + self.page_size)
+        return response
+
+    def delete_objects(self, Bucket: str, Delete: dict, **kwargs) -> dict:
+        self._call("delete_objects")
+        if len(Delete["Objects"]) > 1000:
+            raise ClientError("MalformedXML", "at most 1000 objects per request")
+        for item in Delete["Objects"]:
+            self.objects.pop((Bucket, item["Key"]), None)
+        return {}
+
+
+class LocalHttpTarget:
+    """Local HTTP server standing in for the web application behind the ALB, and for the CloudFormation response URL.
+
+    GET requests get a 200, or a 503 while the target is failing or for the paths starting with one of
+    failing_paths. PUT requests are recorded, after the given number
+    of failed ones and the given delay. HEAD requests get a 403, as a presigned PUT URL would answer. POST requests
+    get an empty JSON object, as an AWS JSON API would answer, e.g. a DynamoDB GetItem of a missing item. Each new
+    connection waits for handshake_seconds, standing in for the TLS handshake.
+    """
+
+    def __init__(self, latency_seconds: float = 0, handshake_seconds: float = 0):
+        self.failing = False
+        self.failing_paths = ()
+        self.latency_seconds = latency_seconds
+        self.handshake_seconds = handshake_seconds
+        self.requests = 0
+        self.puts = []
+        self.put_failures = 0
+        self.put_delay_seconds = 0
+        self.connections = 0
+        target = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # The headers and the body are written separately, Nagle's algorithm would delay the body of every
+            # response on a kept-alive connection
+            disable_nagle_algorithm = True
+
+            def setup(self):
+                super().setup()
+                target.connections += 1
+                if target.handshake_seconds:
+                    time.sleep(target.handshake_seconds)
+
+            def log_message(self, format, *args):
+                pass
+
+            def reply(self, status: int, body: bytes):
+                self.send_response(status)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                target.requests += 1
+                if target.latency_seconds:
+                    time.sleep(target.latency_seconds)
+                failing = target.failing or self.path.startswith(tuple(target.failing_paths))
+                self.reply(503 if failing else 200, b"down" if failing else b"monster")
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                target.requests += 1
+                if target.latency_seconds:
+                    time.sleep(target.latency_seconds)
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-amz-json-1.0")
+                self.send_header("x-amzn-RequestId", "local")
+                self.send_header("Content-Length", "2")
+                self.end_headers()
+                self.wfile.write(b"{}")
+
+            def do_HEAD(self):
+                self.send_response(403)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def do_PUT(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if target.put_delay_seconds:
+                    time.sleep(target.put_delay_seconds)
+                if target.put_failures:
+                    target.put_failures -= 1
+                    self.reply(503, b"SlowDown")
+                    return
+                target.puts.append(json.loads(body or b"{}"))
+                self.reply(200, b"")
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler, bind_and_activate=False)
+        self.server.daemon_threads = True
+        # The clients connecting at the same time must not overflow the default listen backlog of 5
+        self.server.request_queue_size = 128
+        self.server.server_bind()
+        self.server.server_activate()
+        report_error = self.server.handle_error
+
+        def handle_error(request, client_address):
+            # The clients timing out close their connection before the response
+            if not isinstance(sys.exc_info()[1], ConnectionError):
+                report_error(request, client_address)
+        self.server.handle_error = handle_error
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,233 @@
+"""Offline simulation of the full chaos pipeline: game loss admission, experiment trigger, application probes,
+experiment completion, score update and game history, plus the ECR cleanup of the stack deletion.
+
+The Lambda handlers run unchanged against in-process stand-ins for FIS, DynamoDB, Step Functions, S3 and ECR, and a local
+HTTP server standing in for the web application, which can be made to fail. The spans logged by the handlers give
+the latency report of the stages.
+
+    python resources/lambdas/local/harness.py
+"""
+import io
+import os
+import json
+import time
+import random
+import tempfile
+import warnings
+import contextlib
+import history
+import latency_report
+from datetime import datetime, timezone
+from loader import load_lambda, LambdaContext
+from fakes import FakeEcr, FakeFis, FakeS3, FakeStepFunctions, FakeTable, LocalHttpTarget
+
+PROJECT_TAG = "chaos-game-local"
+# How the state machine scores the final experiment status
+SCORES = {"completed": "won", "stopping": "lost", "stopped": "lost"}
+# The invocations which record no span have no metric to publish
+warnings.filterwarnings("ignore", message="No application metrics to publish")
+with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "..", "webapp-config.json")) as f:
+    SCORE_SHARDS = json.load(f)["score"]["shards"]
+
+
+class Harness:
+    def __init__(self, probe_seconds: float = 1, nb_images: int = 250):
+        self.app = LocalHttpTarget()
+        self.table = FakeTable()
+        self.fis = FakeFis(PROJECT_TAG, latency_seconds=0)
+        self.sfn = FakeStepFunctions()
+        self.ecr = FakeEcr(nb_images=nb_images, latency_seconds=0)
+        self.s3 = FakeS3()
+        environment = {
+            "PROJECT_TAG": PROJECT_TAG,
+            "SCORE_TABLE_NAME": "local",
+            "STATE_MACHINE_ARN": f"arn:aws:states:eu-west-1:123456789012:stateMachine:{PROJECT_TAG}-fis-process",
+            "SCHEDULER_STRATEGY": "least_recent",
+            "APP_URL": f"{self.app.url}/game",
+            # The tiers of the application, as the stack probes them
+            "PROBE_TARGETS": json.dumps({"app": f"{self.app.url}/game", "nginx": f"{self.app.url}/health",
+                                         "static": f"{self.app.url}/game/css/style.css",
+                                         "data": f"{self.app.url}/game/leaderboard?by=device&period=day&top=1"}),
+            "PROBE_DURATION_SECONDS": str(probe_seconds),
+            "TARGET_RPS": "50",
+            "REQUEST_TIMEOUT_SECONDS": "0.5",
+            "ECR_REPOSITORY_NAME": "local",
+            "HISTORY_BUCKET_NAME": "local",
+            "POWERTOOLS_METRICS_NAMESPACE": PROJECT_TAG,
+            "POWERTOOLS_SERVICE_NAME": "local",
+            # The spans are logged at the INFO level
+            "LOG_LEVEL": "INFO",
+        }
+        self.admit = load_lambda("admit_experiment", environment)
+        self.admit.table, self.admit.sfn, self.admit.leaderboard.table = self.table, self.sfn, self.table
+        self.trigger = load_lambda("trigger_experiment", environment)
+        self.trigger.fis = self.trigger.catalog.fis = self.fis
+        self.trigger.scheduler.table = self.table
+        self.check = load_lambda("check_experiment", environment)
+        self.check.fis, self.check.sfn, self.check.table = self.fis, self.sfn, self.table
+        self.query = load_lambda("query_app", environment)
+        self.cleanup = load_lambda("cleanup_ecr", environment)
+        self.cleanup.ecr = self.ecr
+        self.archive = load_lambda("archive_game", environment)
+        self.archive.s3 = self.s3
+        # The log lines of the handlers, and those the state machine would write
+        self.log_stream = io.StringIO()
+        for module in (self.admit, self.trigger, self.check, self.query):
+            module.logger.registered_handler.setStream(self.log_stream)
+        self.sequence = 0
+
+    def close(self):
+        self.app.close()
+
+    def invoke(self, module, event: dict, timeout_seconds: float = 3):
+        """Invoke a handler as Lambda would, keeping its logs and metrics out of the harness output"""
+        with contextlib.redirect_stdout(self.log_stream):
+            return module.lambda_handler(event, LambdaContext(timeout_seconds))
+
+    @property
+    def logs(self) -> list:
+        return self.log_stream.getvalue().splitlines()
+
+    def lose_a_game(self, outcome: str = "completed", app_failing: bool = False, send_event: bool = True,
+                    client_id: str = "device-0", failing_paths: tuple = ()) -> dict:
+        """Play the pipeline for one game loss and return the time spent in each stage"""
+        timings = {}
+
+        def stage(name: str, function, *args, **kwargs):
+            start = time.perf_counter()
+            result = function(*args, **kwargs)
+            timings[name] = (time.perf_counter() - start) * 1000
+            return result
+
+        # The device publishes the loss a little after the game over, and the IoT rule sends it to the admission queue
+        self.sequence += 1
+        result = {"seq": self.sequence, "game_result": "FAILED", "duration": 60, "cid": f"local-{self.sequence}",
+                  "age_ms": 150}
+        body = {"results": [result], "epoch": 1, "client_id": client_id, "received_at": int(time.time() * 1000)}
+        records = {"Records": [{"messageId": f"msg-{time.monotonic_ns()}", "body": json.dumps(body)}]}
+        before = set(self.sfn.executions)
+        admission = stage("admit", self.invoke, self.admit, records)
+        if admission.get("batchItemFailures"):
+            return {"admitted": False, "timings": timings}
+        execution_name = (set(self.sfn.executions) - before).pop()
+        execution_input = json.loads(self.sfn.executions[execution_name]["input"])
+
+        # The state machine triggers the experiment, then waits for its end while probing the application
+        experiment = stage("trigger", self.invoke, self.trigger, execution_input)
+        task_token = f"token-{execution_name}"
+        stage("register", self.invoke, self.check, {"experimentId": experiment["experimentId"], "taskToken": task_token,
+                                                    "trace": experiment["trace"]})
+        self.fis.set_status(experiment["experimentId"], "running")
+        # The application is checked twice. The failure asked for, of the whole application or of some of its paths,
+        # lasts for the first check, and the application is recovered for the second
+        checked = dict(experiment)
+        for check in (1, 2):
+            self.app.failing = app_failing and check == 1
+            self.app.failing_paths = failing_paths if check == 1 else ()
+            checked = stage(f"probe {check}", self.invoke, self.query, checked, 20)
+        self.app.failing, self.app.failing_paths = False, ()
+        availability = checked["availability"]
+        self.fis.set_status(experiment["experimentId"], outcome)
+
+        # The experiment end resumes the execution, or the execution falls back to polling
+        if send_event:
+            event = {"source": "aws.fis", "detail-type": "FIS Experiment State Change",
+                     "detail": {"experiment-id": experiment["experimentId"], "new-state": {"status": outcome}}}
+            stage("event", self.invoke, self.check, event)
+            status = json.loads(self.sfn.task_results[task_token])["experimentStatus"]
+        else:
+            status = stage("poll", self.invoke, self.check, {"experimentId": experiment["experimentId"],
+                                                             "trace": experiment["trace"]})["experimentStatus"]
+
+        # The state machine frees the experiment slot and updates the score
+        stage("release", self.admit.release_slot, execution_name)
+        figures = ("probes", "failedProbes", "availabilityPercent", "downtimeSeconds", "outages",
+                   "longestOutageSeconds", "timeToRecoverSeconds")
+        stage("availability", self.table.update_item, Key={"pk": f"experiment#{experiment['experimentId']}"},
+              UpdateExpression="SET availability = :availability",
+              ExpressionAttributeValues={":availability": dict(
+                  {name: availability[name] for name in figures},
+                  targets={name: target["availabilityPercent"] for name, target in availability["targets"].items()})})
+        # The state machine archives the game without waiting, with its state when the game is scored
+        state = dict(experiment, outcome={"experimentStatus": status, "availability": availability})
+        stage("archive", self.invoke, self.archive, {
+            "state": state, "execution": execution_name,
+            "stoppedAt": datetime.now(timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z")})
+        if status in SCORES:
+            stage("score", self.table.update_item, Key={"pk": f"score#{random.randrange(SCORE_SHARDS)}"},
+                  UpdateExpression=f"ADD {SCORES[status]} :inc, probes :probes, failedProbes :failedProbes, "
+                                   f"downtimeSeconds :downtimeSeconds",
+                  ExpressionAttributeValues={":inc": experiment["credits"], ":probes": availability["probes"],
+                                             ":failedProbes": availability["failedProbes"],
+                                             ":downtimeSeconds": availability["downtimeSeconds"]})
+            print(json.dumps({
+                "type": "TaskStateExited", "details": {"name": "Update Win Score" if status == "completed"
+                                                       else "Update Loose Score"},
+                "execution_arn": f"arn:aws:states:eu-west-1:123456789012:execution:{PROJECT_TAG}:{execution_name}",
+                "event_timestamp": str(int(time.time() * 1000))}), file=self.log_stream)
+        return {"admitted": True, "experiment": experiment["experimentId"], "status": status, "timings": timings,
+                "availability": self.table.get_item(Key={"pk": f"experiment#{experiment['experimentId']}"})["Item"]
+                ["availability"]}
+
+    def score(self) -> dict:
+        """The score as the web application shows it, summed over the legacy item and the shards"""
+        score = {"won": 0, "lost": 0, "probes": 0, "failedProbes": 0, "downtimeSeconds": 0}
+        for pk in ["score"] + [f"score#{shard}" for shard in range(SCORE_SHARDS)]:
+            item = self.table.get_item(Key={"pk": pk}).get("Item", {})
+            for attribute in score:
+                score[attribute] += item.get(attribute, 0)
+        return score
+
+    def history(self, group_by: str = "template") -> dict:
+        """Compact the game history of the day, mirror it in a local folder and query it as the history CLI does"""
+        today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+        compaction = self.invoke(self.archive, {"compactDay": today})
+        with tempfile.TemporaryDirectory() as folder:
+            history.sync(self.s3, "local", folder)
+            return dict(history.query(folder, group_by=group_by), compaction=compaction)
+
+    def delete_stack(self) -> dict:
+        """Run the ECR cleanup custom resource as CloudFormation does on the stack deletion"""
+        event = {"RequestType": "Delete", "ResponseURL": f"{self.app.url}/cfn", "StackId": "local-stack",
+                 "RequestId": "local-request", "LogicalResourceId": "CleanupEcr"}
+        start = time.perf_counter()
+        self.invoke(self.cleanup, event, 900)
+        return {"durationMs": (time.perf_counter() - start) * 1000, "remainingImages": len(self.ecr.images),
+                "response": self.app.puts[-1] if self.app.puts else None}
+
+
+def main():
+    harness = Harness()
+    try:
+        games = [
+            ("healthy application", {"outcome": "completed"}),
+            ("application down", {"outcome": "stopped", "app_failing": True, "client_id": "device-1"}),
+            ("no state change event", {"outcome": "completed", "send_event": False, "client_id": "device-2"}),
+            ("database down", {"outcome": "completed", "failing_paths": ("/game/leaderboard",),
+                               "client_id": "device-3"}),
+        ]
+        for name, kwargs in games:
+            result = harness.lose_a_game(**kwargs)
+            timings = ", ".join(f"{stage} {ms:.1f} ms" for stage, ms in result["timings"].items())
+            print(f"{name:>22}: {result.get('status')} - {timings}")
+            availability = result["availability"]
+            print(f"{'':>22}  availability {availability['availabilityPercent']} %, "
+                  f"{availability['outages']} outages, longest {availability['longestOutageSeconds']} s, "
+                  f"recovered in {availability['timeToRecoverSeconds']} s - by target: "
+                  + ", ".join(f"{name} {percent} %" for name, percent in availability["targets"].items()))
+        print(f"score: {harness.score()}")
+        latency_report.report(*latency_report.parse(harness.logs))
+        print(f"probes received by the application: {harness.app.requests}")
+        games = harness.history(group_by="device")
+        compaction = games["compaction"]
+        print(f"history: {compaction['segments']} segments of the day merged into one of {compaction['bytes']} bytes")
+        history.report(games, "device")
+        cleanup = harness.delete_stack()
+        print(f"ECR cleanup: {cleanup['durationMs']:.1f} ms, {cleanup['remainingImages']} images left, "
+              f"response {cleanup['response'] and cleanup['response']['Status']}")
+    finally:
+        harness.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+"""History of the games, one record per experiment run: its template, start and stop times, final status, the
+availability of the application and of each target probed, and the devices whose losses triggered it.
+
+The archive Lambda function writes the records to S3 as columnar segments partitioned by day, and merges the segments
+of each day once it is over. The sync command mirrors the segments in a local folder, the query command filters and
+aggregates them. A query reads the headers of the segments first, skips the days and the segments their statistics
+rule out, and decompresses only the columns it needs, one segment at a time: months of runs are queried without
+holding them in memory.
+
+    python resources/lambdas/local/history.py sync --prefix <stack prefix> [--dir history]
+    python resources/lambdas/local/history.py query [--dir history] [--since 2024-01-01] [--until 2024-03-31]
+        [--template Nginx] [--status stopped] [--device device-1] [--group-by template|status|device|day]
+"""
+import os
+import sys
+import argparse
+from datetime import datetime, timezone
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "runtime", "python"))
+from chaos_runtime.columnar import Segment  # noqa: E402
+
+HISTORY_PREFIX = "history"
+# The final statuses of the experiments stopped by the alarm on the errors of the application
+BROKEN = ("stopping", "stopped")
+GROUPS = ("template", "status", "device", "day")
+# The columns of the groups named differently
+GROUP_COLUMNS = {"device": "devices", "day": "stoppedAt"}
+# The columns the aggregates are computed from
+FIGURES = ("status", "runSeconds", "downtimeSeconds", "availabilityPercent", "timeToRecoverSeconds")
+
+
+def bucket_of(prefix: str) -> str:
+    """The history bucket of a deployed stack, from the environment of its archive function"""
+    import boto3
+    configuration = boto3.client("lambda").get_function_configuration(FunctionName=f"{prefix}-archive-game")
+    return configuration["Environment"]["Variables"]["HISTORY_BUCKET_NAME"]
+
+
+def sync(s3, bucket: str, folder: str) -> dict:
+    """Download the segments missing or changed locally, and delete the local ones merged away since"""
+    remote, token = {}, None
+    while True:
+        kwargs = {"ContinuationToken": token} if token else {}
+        response = s3.list_objects_v2(Bucket=bucket, Prefix=f"{HISTORY_PREFIX}/", **kwargs)
+        for item in response.get("Contents", []):
+            remote[item["Key"][len(HISTORY_PREFIX) + 1:]] = item
+        token = response.get("NextContinuationToken")
+        if not token:
+            break
+    downloaded = deleted = 0
+    for name, item in remote.items():
+        path = os.path.join(folder, *name.split("/"))
+        modified = item["LastModified"].timestamp()
+        if os.path.exists(path) and os.path.getsize(path) == item["Size"] and os.path.getmtime(path) >= modified:
+            continue
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(s3.get_object(Bucket=bucket, Key=item["Key"])["Body"].read())
+        os.utime(path, (modified, modified))
+        downloaded += 1
+    for day in os.listdir(folder) if os.path.isdir(folder) else ():
+        if not os.path.isdir(os.path.join(folder, day)):
+            continue
+        for name in os.listdir(os.path.join(folder, day)):
+            if name.endswith(".seg") and f"{day}/{name}" not in remote:
+                os.remove(os.path.join(folder, day, name))
+                deleted += 1
+    return {"segments": len(remote), "downloaded": downloaded, "deleted": deleted}
+
+
+def segments(folder: str, since: str = None, until: str = None):
+    """The segments of the days within [since, until], day by day"""
+    for day in sorted(os.listdir(folder)):
+        if not day.startswith("day="):
+            continue
+        date = day[len("day="):]
+        if (since and date < since) or (until and date > until):
+            continue
+        names = sorted(name for name in os.listdir(os.path.join(folder, day)) if name.endswith(".seg"))
+        yield date, [Segment.from_file(os.path.join(folder, day, name)) for name in names]
+
+
+class Filter:
+    """The runs of a template, of a status or of a device. The template matches a part of its name"""
+
+    def __init__(self, template: str = None, status: list = None, device: str = None):
+        self.template = template
+        self.status = status
+        self.device = device
+
+    @property
+    def columns(self) -> tuple:
+        return tuple(name for name, value in (("template", self.template), ("status", self.status),
+                                              ("devices", self.device)) if value)
+
+    def may_match(self, segment: Segment) -> bool:
+        """False when the header of the segment shows none of its runs match"""
+        if self.status and not segment.may_contain("status", values=self.status):
+            return False
+        for name, wanted in (("template", self.template), ("devices", self.device)):
+            values = segment.columns.get(name, {}).get("values")
+            if wanted and (name not in segment.columns or
+                           (values is not None and not any(self._matches(name, value) for value in values))):
+                return False
+        return True
+
+    def _matches(self, name: str, value) -> bool:
+        if value is None:
+            return False
+        if name == "template":
+            return self.template in value
+        if name == "devices":
+            return self.device in value.split()
+        return value in self.status
+
+    def __call__(self, run: dict) -> bool:
+        return all(self._matches(name, run[name]) for name, wanted in
+                   (("template", self.template), ("status", self.status), ("devices", self.device)) if wanted)
+
+
+class Aggregate:
+    def __init__(self):
+        self.runs = self.broken = 0
+        self.run_seconds = self.downtime_seconds = self.availability = 0.0
+        self.longest_downtime_seconds = 0.0
+        self.probed = self.recovered = 0
+        self.recovery_seconds = 0.0
+
+    def add(self, run: dict):
+        self.runs += 1
+        self.broken += run["status"] in BROKEN
+        self.run_seconds += run["runSeconds"] or 0
+        if run["availabilityPercent"] is not None:
+            self.probed += 1
+            self.availability += run["availabilityPercent"]
+            self.downtime_seconds += run["downtimeSeconds"] or 0
+            self.longest_downtime_seconds = max(self.longest_downtime_seconds, run["downtimeSeconds"] or 0)
+        if run["timeToRecoverSeconds"]:
+            self.recovered += 1
+            self.recovery_seconds += run["timeToRecoverSeconds"]
+
+    def row(self) -> dict:
+        return {
+            "runs": self.runs,
+            "broken": self.broken,
+            "brokenPercent": 100 * self.broken / self.runs,
+            "meanRunSeconds": self.run_seconds / self.runs,
+            "meanDowntimeSeconds": self.downtime_seconds / self.probed if self.probed else 0,
+            "longestDowntimeSeconds": self.longest_downtime_seconds,
+            "meanAvailabilityPercent": self.availability / self.probed if self.probed else None,
+            "meanTimeToRecoverSeconds": self.recovery_seconds / self.recovered if self.recovered else 0,
+        }
+
+
+def group_keys(run: dict, group_by: str) -> list:
+    if group_by == "device":
+        return (run["devices"] or "").split() or ["-"]
+    if group_by == "day":
+        return [datetime.fromtimestamp(run["stoppedAt"] / 1000, timezone.utc).strftime("%Y-%m-%d")]
+    return [run[group_by] or "-"]
+
+
+def query(folder: str, since: str = None, until: str = None, where: Filter = None, group_by: str = "template") -> dict:
+    """The aggregates of the runs matching the filter by group, and the numbers of segments read and skipped"""
+    where = where or Filter()
+    columns = {"execution", "stoppedAt", *FIGURES, *where.columns, GROUP_COLUMNS.get(group_by, group_by)}
+    groups, read, skipped = {}, 0, 0
+    for _, day in segments(folder, since, until):
+        # A day being merged may hold a run in its merged segment and in its own, it is counted once
+        seen = set()
+        for segment in day:
+            if not where.may_match(segment):
+                skipped += 1
+                continue
+            read += 1
+            for run in segment.records(columns):
+                if run["execution"] in seen or not where(run):
+                    continue
+                seen.add(run["execution"])
+                for key in group_keys(run, group_by):
+                    groups.setdefault(key, Aggregate()).add(run)
+    rows = {key: aggregate.row() for key, aggregate in groups.items()}
+    # The days in order, the other groups from the one breaking the application the most
+    order = (lambda item: item[0]) if group_by == "day" else \
+        (lambda item: (-item[1]["broken"], -item[1]["meanDowntimeSeconds"], item[0]))
+    return {"groups": dict(sorted(rows.items(), key=order)),
+            "segmentsRead": read, "segmentsSkipped": skipped}
+
+
+def report(result: dict, group_by: str):
+    width = max([len(group_by)] + [len(key) for key in result["groups"]])
+    print(f"{group_by:<{width}} {'runs':>6} {'broken':>6} {'broken %':>8} {'run s':>7} {'down s':>7} {'max down s':>10} "
+          f"{'avail %':>7} {'TTR s':>7}")
+    for key, row in result["groups"].items():
+        availability = row["meanAvailabilityPercent"]
+        print(f"{key:<{width}} {row['runs']:>6} {row['broken']:>6} {row['brokenPercent']:>8.1f} "
+              f"{row['meanRunSeconds']:>7.0f} {row['meanDowntimeSeconds']:>7.1f} {row['longestDowntimeSeconds']:>10.1f} "
+              f"{'-' if availability is None else f'{availability:.2f}':>7} {row['meanTimeToRecoverSeconds']:>7.1f}")
+    print(f"{result['segmentsRead']} segments read, {result['segmentsSkipped']} skipped from their header")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    sync_parser = commands.add_parser("sync", help="Mirror the history bucket in the local folder")
+    sync_parser.add_argument("--prefix", help="Prefix of the stack resources, to find its history bucket")
+    sync_parser.add_argument("--bucket", help="Name of the history bucket")
+    sync_parser.add_argument("--dir", default=HISTORY_PREFIX, help="Local folder of the history")
+    query_parser = commands.add_parser("query", help="Aggregate the runs of the local history")
+    query_parser.add_argument("--dir", default=HISTORY_PREFIX, help="Local folder of the history")
+    query_parser.add_argument("--since", help="First day, as YYYY-MM-DD")
+    query_parser.add_argument("--until", help="Last day, as YYYY-MM-DD")
+    query_parser.add_argument("--template", help="Part of the name of the experiment templates")
+    query_parser.add_argument("--status", action="append", help="Final status of the experiments, can be repeated")
+    query_parser.add_argument("--device", help="Device whose loss triggered the experiments")
+    query_parser.add_argument("--group-by", choices=GROUPS, default="template")
+    args = parser.parse_args()
+
+    if args.command == "sync":
+        if not args.prefix and not args.bucket:
+            sync_parser.error("either --prefix or --bucket is required")
+        import boto3
+        print(sync(boto3.client("s3"), args.bucket or bucket_of(args.prefix), args.dir))
+    else:
+        where = Filter(template=args.template, status=args.status, device=args.device)
+        report(query(args.dir, args.since, args.until, where, args.group_by), args.group_by)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""Latency of each stage of a game loss, from the game over on the device to the score update, computed from the logs.
+
+The admission, trigger and check Lambda functions log one span per stage, tied together by the trace ID (the name of
+the state machine execution) and the correlation IDs of the losses, created by the devices. The time of the score
+update comes from the state machine logs. The probe Lambda logs the span of each check of the application, reported
+apart from the stages as it runs alongside the experiment. The logs are read from CloudWatch Logs for a deployed stack,
+or from files of JSON lines.
+
+    python resources/lambdas/local/latency_report.py --prefix <stack prefix> [--hours 24]
+    python resources/lambdas/local/latency_report.py --file lambdas.log --file state-machine.log
+"""
+import json
+import time
+import argparse
+
+# The stages in the order of the pipeline, as named in the spans of chaos_runtime/spans.py
+STAGES = ("device", "queue", "admission", "start", "trigger", "experiment", "score")
+# The first check of the application of each execution, which runs alongside the experiment
+PROBE = "probe"
+SCORE_STATES = ("Update Win Score", "Update Loose Score")
+LAMBDAS = ("admit-experiment", "trigger-experiment", "check-experiment", "query-app")
+
+
+def parse(lines) -> tuple:
+    """The spans logged by the Lambda functions, and the score update times by execution name, from JSON log lines"""
+    spans = []
+    scored_at = {}
+    for line in lines:
+        # The Lambda runtime and the local harness may prefix the JSON with other fields
+        start = line.find("{")
+        if start < 0:
+            continue
+        try:
+            record = json.loads(line[start:])
+        except ValueError:
+            continue
+        message = record.get("message")
+        if isinstance(message, dict) and "span" in message:
+            spans.append(message)
+        elif record.get("type") == "TaskStateExited" and record.get("details", {}).get("name") in SCORE_STATES:
+            execution = record.get("execution_arn", "").rsplit(":", 1)[-1]
+            scored_at[execution] = min(int(record.get("event_timestamp")), scored_at.get(execution, float("inf")))
+    return spans, scored_at
+
+
+def stage_latencies(spans: list, scored_at: dict) -> tuple:
+    """The durations in milliseconds of each stage, and the end-to-end durations by correlation ID"""
+    # The first span of each stage of each trace, and of each correlation ID for the stages before the admission
+    first = {}
+    for span in sorted(spans, key=lambda s: s.get("startMs")):
+        key = (span.get("span"), span.get("traceId"), tuple(span.get("correlationIds") or ()))
+        first.setdefault(key, span)
+    latencies = {stage: [] for stage in STAGES + (PROBE,)}
+    starts = {}
+    experiment_ends = {}
+    for (stage, trace_id, correlation_ids), span in first.items():
+        latencies.setdefault(stage, []).append(span.get("durationMs"))
+        if stage in ("device", "queue"):
+            # The loss starts at the game over on the device when it is known, at its reception otherwise
+            for correlation_id in correlation_ids:
+                known = starts.get((trace_id, correlation_id))
+                starts[(trace_id, correlation_id)] = span["startMs"] if known is None else min(known, span["startMs"])
+        elif stage == "experiment":
+            experiment_ends[trace_id] = span["startMs"] + span["durationMs"]
+    for trace_id, ended_at in experiment_ends.items():
+        if trace_id in scored_at:
+            latencies["score"].append(scored_at[trace_id] - ended_at)
+    totals = [scored_at[trace_id] - started_at for (trace_id, _), started_at in starts.items() if trace_id in scored_at]
+    return latencies, totals
+
+
+def percentile(values: list, p: float) -> float:
+    values = sorted(values)
+    return values[min(int(len(values) * p / 100), len(values) - 1)]
+
+
+def report(spans: list, scored_at: dict):
+    latencies, totals = stage_latencies(spans, scored_at)
+    print(f"{'stage':>12} {'count':>6} {'p50 ms':>10} {'p90 ms':>10} {'p99 ms':>10} {'max ms':>10}")
+    for stage, values in list(latencies.items()) + [("end to end", totals)]:
+        if not values:
+            print(f"{stage:>12} {0:>6}")
+            continue
+        print(f"{stage:>12} {len(values):>6} {percentile(values, 50):>10.0f} {percentile(values, 90):>10.0f} "
+              f"{percentile(values, 99):>10.0f} {max(values):>10.0f}")
+
+
+def cloudwatch_lines(prefix: str, hours: float):
+    """The log lines of the Lambda functions and of the state machine of a deployed stack"""
+    import boto3
+    logs = boto3.client("logs")
+    start_time = int((time.time() - hours * 3600) * 1000)
+    groups = [(f"/aws/lambda/{prefix}-{name}", "{ $.message.span = * }") for name in LAMBDAS]
+    groups.append((f"/aws/step-function/{prefix}-fis-state-machine/access", '{ $.type = "TaskStateExited" }'))
+    for group, pattern in groups:
+        paginator = logs.get_paginator("filter_log_events")
+        for page in paginator.paginate(logGroupName=group, startTime=start_time, filterPattern=pattern):
+            for event in page.get("events", []):
+                yield event.get("message")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--prefix", help="Prefix of the stack resources, to read its CloudWatch Logs")
+    parser.add_argument("--hours", type=float, default=24)
+    parser.add_argument("--file", action="append", default=[], help="File of JSON log lines")
+    args = parser.parse_args()
+    if not args.prefix and not args.file:
+        parser.error("either --prefix or --file is required")
+
+    lines = []
+    for path in args.file:
+        with open(path) as f:
+            lines.extend(f)
+    if args.prefix:
+        lines.extend(cloudwatch_lines(args.prefix, args.hours))
+    report(*parse(lines))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""Replay thousands of game-loss events through the admission of admit_experiment, against local stand-ins for
+Step Functions and DynamoDB, and check that every loss is credited exactly once
+
+    python resources/lambdas/local/load_admission.py
+"""
+import json
+import random
+import time
+from loader import load_lambda
+from fakes import FakeStepFunctions, FakeTable
+
+NB_DEVICES = 50
+NB_LOSSES = 5000
+# Probability that a device re-publishes a message after a reconnection
+REPUBLISH_PROBABILITY = 0.2
+# Probability that a device with an outbox wins a game, and that it is offline after a game
+WIN_PROBABILITY = 0.3
+OFFLINE_PROBABILITY = 0.1
+# Simulated seconds between two games lost by the same device, SQS batching window and experiment duration
+MIN_GAME_SECONDS = 20
+MAX_GAME_SECONDS = 120
+BATCHING_WINDOW_SECONDS = 5
+EXPERIMENT_SECONDS = 300
+MAX_IN_FLIGHT = 2
+
+
+def generate_events(rng: random.Random) -> list:
+    """SQS records as received by the Lambda, sorted by arrival time. A re-published message is a new MQTT message, so
+    the IoT rule stamps it with a new reception time.
+
+    The even devices send their results in batches with sequence numbers, wins included, and sometimes stay offline
+    for a few games. The odd devices send every loss on its own, without sequence number.
+    """
+    events = []
+    clocks = [rng.uniform(0, MAX_GAME_SECONDS) for _ in range(NB_DEVICES)]
+    outboxes = [[] for _ in range(NB_DEVICES)]
+    sequences = [0] * NB_DEVICES
+    for i in range(NB_LOSSES):
+        device = rng.randrange(NB_DEVICES)
+        clocks[device] += rng.uniform(MIN_GAME_SECONDS, MAX_GAME_SECONDS)
+        if device % 2 == 0:
+            while rng.random() < WIN_PROBABILITY:
+                sequences[device] += 1
+                outboxes[device].append({"seq": sequences[device], "game_result": "SUCCEEDED", "duration": 60})
+            sequences[device] += 1
+            outboxes[device].append({"seq": sequences[device], "game_result": "FAILED", "duration": 60})
+            if rng.random() < OFFLINE_PROBABILITY and i < NB_LOSSES - NB_DEVICES:
+                continue
+            body = {"results": outboxes[device], "epoch": device, "client_id": f"device-{device}"}
+            outboxes[device] = []
+        else:
+            body = {"game_result": "FAILED", "client_id": f"device-{device}"}
+        publications = [clocks[device]]
+        if rng.random() < REPUBLISH_PROBABILITY:
+            publications.append(clocks[device] + rng.uniform(0.1, 3))
+        for j, arrival in enumerate(publications):
+            body = dict(body, received_at=int(arrival * 1000))
+            events.append({"messageId": f"msg-{i}-{j}", "body": json.dumps(body), "arrival": arrival})
+    # The devices still offline at the end come back online
+    for device, results in enumerate(outboxes):
+        if results:
+            clocks[device] += MAX_GAME_SECONDS
+            body = {"results": results, "epoch": device, "client_id": f"device-{device}",
+                    "received_at": int(clocks[device] * 1000)}
+            events.append({"messageId": f"msg-flush-{device}", "body": json.dumps(body), "arrival": clocks[device]})
+    return sorted(events, key=lambda event: event["arrival"])
+
+
+def main():
+    admit = load_lambda("admit_experiment", {
+        "PROJECT_TAG": "chaos-game-local",
+        "SCORE_TABLE_NAME": "local",
+        "STATE_MACHINE_ARN": "arn:aws:states:eu-west-1:123456789012:stateMachine:local",
+        "MAX_IN_FLIGHT": str(MAX_IN_FLIGHT),
+    })
+    admit.table = FakeTable()
+    admit.sfn = sfn = FakeStepFunctions()
+    events = generate_events(random.Random(42))
+
+    queue = []
+    running = []
+    max_in_flight = 0
+    next_event = 0
+    clock = 0.0
+    start = time.perf_counter()
+    while next_event < len(events) or queue:
+        clock += BATCHING_WINDOW_SECONDS
+        # Executions finishing release their slot, as the state machine does
+        for name, ends_at in [r for r in running if r[1] <= clock]:
+            admit.release_slot(name)
+            running.remove((name, ends_at))
+        while next_event < len(events) and events[next_event]["arrival"] <= clock:
+            queue.append(events[next_event])
+            next_event += 1
+        batch, queue = queue[:100], queue[100:]
+        if not batch:
+            continue
+        losses = [loss for record in batch for loss in admit.parse_losses(record)]
+        try:
+            result = admit.admit(losses, int(clock))
+        except admit.NoSlotAvailable:
+            # The batch goes back to the queue and is coalesced with the next losses
+            queue = batch + queue
+            continue
+        if "execution" in result:
+            running.append((result["execution"], clock + EXPERIMENT_SECONDS))
+            max_in_flight = max(max_in_flight, len(running))
+    elapsed = time.perf_counter() - start
+
+    credits = sum(json.loads(execution["input"])["credits"] for execution in sfn.executions.values())
+    unique_losses = NB_LOSSES
+    print(f"events: {len(events)}, unique losses: {unique_losses}, credited: {credits}, "
+          f"experiments: {len(sfn.executions)}, max in flight: {max_in_flight}/{MAX_IN_FLIGHT}")
+    print(f"simulated {clock / 3600:.1f} h in {elapsed:.2f} s, {len(events) / elapsed:.0f} events/s, "
+          f"table calls: {admit.table.calls}")
+    assert credits == unique_losses, "every loss must be credited exactly once"
+    assert max_in_flight <= MAX_IN_FLIGHT
+
+
+if __name__ == "__main__":
+    main()
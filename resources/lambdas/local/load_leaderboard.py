@@ -0,0 +1,109 @@
+"""Replay the game results of thousands of devices and players through the leaderboard of admit_experiment, against a
+local stand-in for DynamoDB. It checks that every result is counted exactly once in its hourly and daily counters,
+and that the cost of a game does not grow with the number of devices and players.
+
+    python resources/lambdas/local/load_leaderboard.py
+"""
+import json
+import time
+import random
+from loader import load_lambda
+from fakes import FakeTable
+
+SCALES = ((100, 250), (1000, 2500), (4000, 10000))
+GAMES_PER_DEVICE = 20
+SIMULATED_SECONDS = 2 * 24 * 3600
+# Probability that a device re-publishes a message, and that the SQS batch is delivered again
+REPUBLISH_PROBABILITY = 0.2
+REDELIVERY_PROBABILITY = 0.1
+WIN_PROBABILITY = 0.4
+SQS_BATCH_SIZE = 100
+
+
+def generate_events(rng: random.Random, nb_devices: int, nb_players: int) -> tuple:
+    """SQS records sorted by arrival time, and the unique results as (device, player, reception time, won) tuples"""
+    events = []
+    unique = []
+    for device in range(nb_devices):
+        clock = time.time() - SIMULATED_SECONDS + rng.uniform(0, SIMULATED_SECONDS / GAMES_PER_DEVICE)
+        seq = 0
+        while seq < GAMES_PER_DEVICE:
+            # A player plays a few games in a row, published in one batch
+            player = f"player-{rng.randrange(nb_players)}" if rng.random() < 0.8 else None
+            results = []
+            for _ in range(rng.randint(1, 5)):
+                seq += 1
+                results.append({"seq": seq, "game_result": "SUCCEEDED" if rng.random() < WIN_PROBABILITY else "FAILED",
+                                "duration": 60})
+            clock += rng.uniform(60, 2 * SIMULATED_SECONDS / GAMES_PER_DEVICE)
+            body = {"results": results, "epoch": device, "client_id": f"device-{device}", "player": player}
+            for result in results:
+                unique.append((f"device-{device}", player, int(clock * 1000), result["game_result"] == "SUCCEEDED"))
+            publications = [clock]
+            if rng.random() < REPUBLISH_PROBABILITY:
+                publications.append(clock + rng.uniform(0.1, 3))
+            for j, arrival in enumerate(publications):
+                # A re-published message is received later, but in the same bucket for this check
+                events.append({"messageId": f"msg-{device}-{seq}-{j}", "arrival": arrival,
+                               "body": json.dumps(dict(body, received_at=int(clock * 1000)))})
+    return sorted(events, key=lambda event: event["arrival"]), unique
+
+
+def expected_counters(admit, unique: list) -> dict:
+    """The counters computed from the unique results"""
+    counters = {}
+    for device, player, received_at, won in unique:
+        result = {"clientId": device, "player": player, "receivedAt": received_at, "won": won}
+        for key, counter in admit.leaderboard.counters([result]).items():
+            total = counters.setdefault(key, {"won": 0, "lost": 0})
+            total["won"] += counter["won"]
+            total["lost"] += counter["lost"]
+    return counters
+
+
+def top(table: FakeTable, board: str, n: int) -> list:
+    """The top of a board, as the web application queries it from the table index"""
+    items = [item for item in table.items.values() if item.get("board") == board]
+    return sorted(items, key=lambda item: item["won"], reverse=True)[:n]
+
+
+def run(nb_devices: int, nb_players: int, seed: int = 0):
+    rng = random.Random(seed)
+    admit = load_lambda("admit_experiment", {"SCORE_TABLE_NAME": "local", "LOG_LEVEL": "WARNING",
+                                             "POWERTOOLS_SERVICE_NAME": "local"})
+    table = FakeTable()
+    admit.leaderboard.table = table
+    events, unique = generate_events(rng, nb_devices, nb_players)
+
+    start = time.perf_counter()
+    totals = {"recorded": 0, "duplicates": 0}
+    for i in range(0, len(events), SQS_BATCH_SIZE):
+        batch = events[i:i + SQS_BATCH_SIZE]
+        deliveries = 2 if rng.random() < REDELIVERY_PROBABILITY else 1
+        for _ in range(deliveries):
+            results = [result for record in batch for result in admit.parse_results(record)]
+            for name, count in admit.leaderboard.record(results, int(time.time())).items():
+                totals[name] += count
+    elapsed = time.perf_counter() - start
+
+    expected = expected_counters(admit, unique)
+    counters = {pk: item for pk, item in table.items.items() if pk.startswith("lb#")}
+    wrong = [key for key in expected if {k: counters.get(key, {}).get(k) for k in ("won", "lost")} != expected[key]]
+    transactions = table.calls.get("transact_write_items", 0)
+    print(f"{nb_devices:5} devices, {nb_players:5} players: {len(unique)} results, {len(events)} messages, "
+          f"{totals['duplicates']} duplicates dropped, {len(counters)} counters, "
+          f"{transactions / len(unique):.2f} transactions per result, {len(unique) / elapsed:.0f} results/s")
+    board = max(item["board"] for item in counters.values() if item["board"].startswith("player#day#"))
+    leaders = ", ".join(f"{item['name']} {item['won']}/{item['lost']}" for item in top(table, board, 3))
+    print(f"{'':25}top of {board}: {leaders}")
+    assert totals["recorded"] == len(unique), f"{totals['recorded']} results recorded instead of {len(unique)}"
+    assert not wrong and len(counters) == len(expected), f"{len(wrong)} counters differ from the results"
+
+
+def main():
+    for nb_devices, nb_players in SCALES:
+        run(nb_devices, nb_players)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+import os
+import sys
+import time
+import importlib.util
+
+LAMBDAS_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# The shared runtime layer, found under /opt/python in Lambda
+RUNTIME_PATH = os.path.join(LAMBDAS_PATH, "runtime", "python")
+if RUNTIME_PATH not in sys.path:
+    sys.path.append(RUNTIME_PATH)
+
+
+def load_lambda(name: str, environment: dict = None):
+    """Import the main.py module of one of the Lambda functions under its own name, with the Lambda folder first on
+    the path so that its "lib" package is the one imported
+    """
+    os.environ.setdefault("AWS_DEFAULT_REGION", "eu-west-1")
+    # Set on every function by the stack, the metrics of the handlers cannot be flushed without a namespace
+    os.environ.setdefault("POWERTOOLS_SERVICE_NAME", "local")
+    os.environ.setdefault("POWERTOOLS_METRICS_NAMESPACE", "local")
+    os.environ.update(environment or {})
+    code_path = os.path.join(LAMBDAS_PATH, name)
+    # Each Lambda has its own "lib" package, forget the one of the previously loaded Lambda
+    for module_name in [m for m in sys.modules if m == "lib" or m.startswith("lib.")]:
+        del sys.modules[module_name]
+    sys.path.insert(0, code_path)
+    try:
+        spec = importlib.util.spec_from_file_location(f"{name}_main", os.path.join(code_path, "main.py"))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    finally:
+        sys.path.remove(code_path)
+    return module
+
+
+class LambdaContext:
+    """Minimal stand-in for the Lambda context object"""
+    function_name = "local"
+    function_version = "$LATEST"
+    invoked_function_arn = "arn:aws:lambda:eu-west-1:123456789012:function:local"
+    memory_limit_in_mb = 128
+    aws_request_id = "local-request"
+    log_group_name = "/aws/lambda/local"
+    log_stream_name = "local"
+
+    def __init__(self, timeout_seconds: float = 3):
+        self.deadline = time.monotonic() + timeout_seconds
+
+    def get_remaining_time_in_millis(self) -> int:
+        return int((self.deadline - time.monotonic()) * 1000)
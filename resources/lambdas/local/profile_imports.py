@@ -0,0 +1,48 @@
+"""Import-time profile of the Lambda handlers: which packages their module load spends its time on.
+
+Each handler is loaded in a fresh interpreter with "python -X importtime", and the self time of every imported module
+is summed per top-level package.
+
+    python resources/lambdas/local/profile_imports.py [--top 8] [--eager]
+"""
+import os
+import sys
+import argparse
+import subprocess
+from benchmark import HANDLERS, COLD_START_ENVIRONMENT
+
+LOAD_SCRIPT = "from loader import load_lambda; load_lambda({name!r}, {environment!r})"
+
+
+def profile(name: str, eager: bool = False) -> dict:
+    """Return the import time in ms of each top-level package imported by the handler module"""
+    environment = dict(COLD_START_ENVIRONMENT, LAZY_INIT=str(not eager).lower())
+    stderr = subprocess.run([sys.executable, "-X", "importtime", "-c", LOAD_SCRIPT.format(name=name, environment=environment)],
+                            cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True,
+                            check=True).stderr
+    packages = {}
+    for line in stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_us, _, module = line[len("import time:"):].split("|")
+        package = module.strip().split(".")[0]
+        packages[package] = packages.get(package, 0) + int(self_us) / 1000
+    return packages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--top", type=int, default=8)
+    parser.add_argument("--eager", action="store_true", help="create the clients at the module load (LAZY_INIT=false)")
+    args = parser.parse_args()
+
+    for name in HANDLERS:
+        packages = profile(name, args.eager)
+        print(f"{name}: {sum(packages.values()):.1f} ms")
+        for package, duration in sorted(packages.items(), key=lambda p: p[1], reverse=True)[:args.top]:
+            print(f"  {package:>28} {duration:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,26 +1,322 @@
 import os
+import json
 import time
+import threading
 import requests
 import concurrent.futures
-from requests.adapters import HTTPAdapter, Retry
-from aws_lambda_powertools import Logger
+from urllib.parse import urlsplit
+from aws_lambda_powertools import Logger, Metrics
+from aws_lambda_powertools.metrics import MetricUnit
+from chaos_runtime import sessions, spans
 
 logger = Logger()
+metrics = Metrics()
+timing = spans.Spans(logger, metrics)
 
 APP_URL = os.environ.get("APP_URL")
+# The endpoints probed in parallel, by name, e.g. {"nginx": ".../health", "app": ".../game", "static": ...}, to tell
+# which tier of the application broke. Only APP_URL is probed when not set
+TARGETS = json.loads(os.environ.get("PROBE_TARGETS") or "{}") or {"app": APP_URL}
+# The target whose availability scores the game
+PRIMARY_TARGET = os.environ.get("PRIMARY_TARGET", "app")
+if PRIMARY_TARGET not in TARGETS:
+    PRIMARY_TARGET = next(iter(TARGETS))
+# Maximum number of requests per target when PROBE_DURATION_SECONDS is not set
 NB_TRIES = int(os.environ.get("NB_TRIES", 20))
+# Number of probes running in parallel over all the targets, each one keeping its connection alive between requests
+CONCURRENCY = int(os.environ.get("CONCURRENCY", 10))
+# When set, the probes run for this duration instead of stopping after NB_TRIES requests
+PROBE_DURATION_SECONDS = float(os.environ.get("PROBE_DURATION_SECONDS", 0))
+# Request rate of each target. 0 means as fast as the probes can go
+TARGET_RPS = float(os.environ.get("TARGET_RPS", 0))
+REQUEST_TIMEOUT_SECONDS = float(os.environ.get("REQUEST_TIMEOUT_SECONDS", 2))
+# Length of the time windows in which the probe results are aggregated and streamed out
+WINDOW_SECONDS = float(os.environ.get("WINDOW_SECONDS", 1))
+# Time kept aside at the end of the Lambda invocation to aggregate and log the results
+SAFETY_MARGIN_SECONDS = 1.5
+# Upper bounds in milliseconds of the latency histogram buckets. The last bucket catches everything above
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+# A time window is counted as an outage when more than this share of its probes failed
+OUTAGE_ERROR_RATE = float(os.environ.get("OUTAGE_ERROR_RATE", 0.5))
 
-def establish_one_session(i):
-    s = requests.Session()
-    s.mount('http://', HTTPAdapter(max_retries=Retry(total=1, backoff_factor=0)))
-    r = s.get(APP_URL)
-    return {"try": i+1, "status_code": r.status_code, "url":APP_URL}
 
+# One HTTP session shared by all the probes, which lives across warm invocations. The connection pool of each host is
+# sized to the number of probes so that every probe reuses its own keep-alive connection instead of paying a new TCP
+# handshake on every request
+session = sessions.requests_session(CONCURRENCY, retries=1,
+                                    hosts=max(1, len({urlsplit(url or "").netloc for url in TARGETS.values()})))
+
+
+class Pacer:
+    """Hand out request slots to the probes, so that all of them together hold the target request rate
+    until the deadline or the maximum number of requests is reached
+    """
+    def __init__(self, deadline: float, max_requests: int = 0, rps: float = 0):
+        self.deadline = deadline
+        self.max_requests = max_requests
+        self.interval = 1 / rps if rps > 0 else 0
+        self.issued = 0
+        self.next_slot = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> bool:
+        """Wait for the next request slot. Returns False when the probes should stop"""
+        with self.lock:
+            if self.max_requests and self.issued >= self.max_requests:
+                return False
+            slot = max(self.next_slot, time.monotonic())
+            if slot >= self.deadline:
+                return False
+            self.next_slot = slot + self.interval
+            self.issued += 1
+        delay = slot - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        return True
+
+
+class Histogram:
+    """Fixed-size latency histogram, so memory does not grow with the number of probes"""
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.count = 0
+        self.max = 0
+
+    def add(self, latency_ms: float):
+        index = 0
+        while index < len(LATENCY_BUCKETS_MS) and latency_ms > LATENCY_BUCKETS_MS[index]:
+            index += 1
+        self.buckets[index] += 1
+        self.count += 1
+        self.max = max(self.max, latency_ms)
+
+    def merge(self, other: "Histogram"):
+        self.buckets = [a + b for a, b in zip(self.buckets, other.buckets)]
+        self.count += other.count
+        self.max = max(self.max, other.max)
+
+    def percentile(self, pct: float) -> float:
+        """Upper bound of the bucket holding the percentile. The maximum is used for the last bucket"""
+        rank = pct / 100 * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.buckets):
+            seen += bucket_count
+            if bucket_count and seen >= rank:
+                return LATENCY_BUCKETS_MS[index] if index < len(LATENCY_BUCKETS_MS) else round(self.max, 2)
+        return 0
+
+
+class Window:
+    """Aggregate of the probe results received during one time window"""
+    def __init__(self, start: float):
+        self.start = start
+        self.statuses = {}
+        self.latency = Histogram()
+
+    @property
+    def errors(self) -> int:
+        return sum(count for status, count in self.statuses.items() if status not in ("2xx", "3xx"))
+
+    def add(self, status: str, latency_ms: float):
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        self.latency.add(latency_ms)
+
+    def merge(self, other: "Window"):
+        for status, count in other.statuses.items():
+            self.statuses[status] = self.statuses.get(status, 0) + count
+        self.latency.merge(other.latency)
+
+
+class Availability:
+    """Availability of the application over the whole experiment, computed in one pass over the time windows of the
+    probe results, in time order. Only counters are kept, whatever the number of probes and windows.
+
+    A window is down when more than OUTAGE_ERROR_RATE of its probes failed, and an outage lasts from its first down
+    window to the next window up. The experiment is probed by several invocations, the counters are carried from one
+    to the next in the state machine payload.
+    """
+    def __init__(self, window_seconds: float, state: dict = None):
+        self.window_seconds = window_seconds
+        state = state or {}
+        self.probes = state.get("probes", 0)
+        self.failed_probes = state.get("failedProbes", 0)
+        self.windows = state.get("windows", 0)
+        self.down_windows = state.get("downWindows", 0)
+        self.outages = state.get("outages", 0)
+        self.recovered_outages = state.get("recoveredOutages", 0)
+        self.recovery_seconds = state.get("recoverySeconds", 0)
+        self.longest_outage_seconds = state.get("longestOutageSeconds", 0)
+        # Start of the outage in progress, None while the application is up
+        self.outage_started_at = state.get("outageStartedAt")
+        self.last_window_at = state.get("lastWindowAt")
+
+    def add(self, start: float, requests: int, errors: int):
+        self.probes += requests
+        self.failed_probes += errors
+        if not requests or (self.last_window_at is not None and start <= self.last_window_at):
+            # The rest of a window already counted by the previous invocation
+            return
+        self.windows += 1
+        self.last_window_at = start
+        if errors > OUTAGE_ERROR_RATE * requests:
+            self.down_windows += 1
+            if self.outage_started_at is None:
+                self.outage_started_at = start
+                self.outages += 1
+            self.longest_outage_seconds = max(self.longest_outage_seconds,
+                                              start + self.window_seconds - self.outage_started_at)
+        elif self.outage_started_at is not None:
+            self.recovered_outages += 1
+            self.recovery_seconds += start - self.outage_started_at
+            self.outage_started_at = None
+
+    def to_dict(self) -> dict:
+        """The counters to carry to the next invocation, and the service level figures of the experiment so far"""
+        return {
+            "probes": self.probes,
+            "failedProbes": self.failed_probes,
+            "windows": self.windows,
+            "downWindows": self.down_windows,
+            "outages": self.outages,
+            "recoveredOutages": self.recovered_outages,
+            "recoverySeconds": round(self.recovery_seconds, 3),
+            "longestOutageSeconds": round(self.longest_outage_seconds, 3),
+            "outageStartedAt": self.outage_started_at,
+            "lastWindowAt": self.last_window_at,
+            # Share of the probes which succeeded, 100 % when nothing was probed
+            "availabilityPercent": round(100 * (1 - self.failed_probes / self.probes), 3) if self.probes else 100,
+            "downtimeSeconds": round(self.down_windows * self.window_seconds, 3),
+            # Mean time from the start of an outage to the first window up again
+            "timeToRecoverSeconds": round(self.recovery_seconds / self.recovered_outages, 3)
+            if self.recovered_outages else 0,
+        }
+
+
+class ResultStream:
+    """Aggregate the probe results of one target per time window and stream each closed window out as EMF metrics,
+    with the target as dimension. Only the open windows and one running total are kept in memory, and the windows
+    already flushed survive a Lambda timeout. The closed windows also feed the availability of the target
+    """
+    def __init__(self, window_seconds: float, availability: Availability = None, target: str = "app"):
+        self.window_seconds = window_seconds
+        self.target = target
+        self.windows = {}
+        self.total = Window(time.time())
+        self.availability = availability or Availability(window_seconds)
+        self.lock = threading.Lock()
+
+    def record(self, status: str, latency_ms: float):
+        key = int(time.time() // self.window_seconds)
+        with self.lock:
+            if key not in self.windows:
+                self.windows[key] = Window(key * self.window_seconds)
+            self.windows[key].add(status, latency_ms)
+
+    def flush(self, final: bool = False):
+        """Publish every window already closed, or all of them for the final flush"""
+        current = int(time.time() // self.window_seconds)
+        with self.lock:
+            closed = sorted(key for key in self.windows if final or key < current)
+            windows = [self.windows.pop(key) for key in closed]
+        for window in windows:
+            self.publish(window)
+
+    def publish(self, window: Window):
+        self.total.merge(window)
+        self.availability.add(window.start, window.latency.count, window.errors)
+        metrics.add_dimension(name="target", value=self.target)
+        metrics.add_metric(name="ProbeRequests", unit=MetricUnit.Count, value=window.latency.count)
+        metrics.add_metric(name="ProbeErrors", unit=MetricUnit.Count, value=window.errors)
+        metrics.add_metric(name="ProbeLatencyP50", unit=MetricUnit.Milliseconds, value=window.latency.percentile(50))
+        metrics.add_metric(name="ProbeLatencyP99", unit=MetricUnit.Milliseconds, value=window.latency.percentile(99))
+        metrics.add_metadata(key="window", value={
+            "start": window.start,
+            "statuses": window.statuses,
+            "latencyBucketsMs": LATENCY_BUCKETS_MS,
+            "latencyHistogram": window.latency.buckets,
+        })
+        metrics.flush_metrics()
+
+
+def status_class(status_code: int) -> str:
+    return f"{status_code // 100}xx"
+
+
+def probe(url: str, pacer: Pacer, stream: ResultStream):
+    """Send requests to one target until the pacer tells to stop"""
+    while pacer.acquire():
+        start = time.perf_counter()
+        try:
+            r = session.get(url, timeout=REQUEST_TIMEOUT_SECONDS)
+            status = status_class(r.status_code)
+        except requests.exceptions.RequestException as e:
+            status = type(e).__name__
+        stream.record(status, (time.perf_counter() - start) * 1000)
+
+
+def summarize(url: str, total: Window, elapsed: float) -> dict:
+    return {
+        "url": url,
+        "requests": total.latency.count,
+        "errors": total.errors,
+        "statuses": total.statuses,
+        "durationSeconds": round(elapsed, 3),
+        "throughputRps": round(total.latency.count / elapsed, 2) if elapsed > 0 else 0,
+        "latencyMs": {
+            "p50": total.latency.percentile(50),
+            "p95": total.latency.percentile(95),
+            "p99": total.latency.percentile(99),
+            "max": round(total.latency.max, 2),
+        },
+    }
+
+
+@metrics.log_metrics
+@logger.inject_lambda_context
 def lambda_handler(event, context):
-    # Establish 10 sessions in parallel to the application
-    # Different sessions are opened to generate one error metric each when the application is down
-    with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
-        responses = executor.map(establish_one_session, range(NB_TRIES))
-    # Log the responses
-    logger.info({"responses": list(responses)})
-    return event
\ No newline at end of file
+    started_at = spans.now_ms()
+    # The trace of the execution probing the application, to correlate its probes with the game losses. The
+    # executions started by hand have no trace
+    trace = event.get("trace") or {}
+    logger.append_keys(traceId=trace.get("traceId"), correlationIds=trace.get("correlationIds"))
+    # Never run past the Lambda timeout, whatever the configured probe duration. The last request issued before the
+    # deadline can still take up to twice the request timeout with its retry
+    start = time.monotonic()
+    time_left = (context.get_remaining_time_in_millis() / 1000 - SAFETY_MARGIN_SECONDS
+                 - 2 * REQUEST_TIMEOUT_SECONDS)
+    if PROBE_DURATION_SECONDS > 0:
+        deadline, max_requests = start + min(PROBE_DURATION_SECONDS, time_left), 0
+    else:
+        deadline, max_requests = start + time_left, NB_TRIES
+    # The availability counters of the previous invocations probing the same experiment. Those of the primary target
+    # are also at the top, where the state machine reads them
+    previous = event.get("availability") or {}
+    counters = previous.get("targets") or {PRIMARY_TARGET: previous}
+    streams = {name: ResultStream(WINDOW_SECONDS, Availability(WINDOW_SECONDS, counters.get(name)), name)
+               for name in TARGETS}
+    # Every target has its own pacer and its share of the probes, so that a target timing out does not slow down the
+    # probes of the others
+    probes_per_target = max(1, CONCURRENCY // len(TARGETS))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=probes_per_target * len(TARGETS)) as executor:
+        pending = set()
+        for name, url in TARGETS.items():
+            pacer = Pacer(deadline, max_requests=max_requests, rps=TARGET_RPS)
+            pending.update(executor.submit(probe, url, pacer, streams[name]) for _ in range(probes_per_target))
+        # Stream out each window once it is closed
+        while pending:
+            done, pending = concurrent.futures.wait(pending, timeout=WINDOW_SECONDS)
+            for future in done:
+                future.result()
+            for stream in streams.values():
+                stream.flush()
+    for stream in streams.values():
+        stream.flush(final=True)
+    # Log the aggregated results, and hand the availability over to the next invocation and to the scoring
+    elapsed = time.monotonic() - start
+    targets = {name: stream.availability.to_dict() for name, stream in streams.items()}
+    availability = dict(targets[PRIMARY_TARGET], targets=targets)
+    logger.info({"probe": {name: summarize(TARGETS[name], stream.total, elapsed) for name, stream in streams.items()},
+                 "availability": availability})
+    # Recorded once the windows are flushed, so that the span metric is not published with their target dimension
+    timing.record(spans.PROBE, started_at, spans.now_ms(), trace)
+    return dict(event, availability=availability)
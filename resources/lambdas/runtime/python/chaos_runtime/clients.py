@@ -0,0 +1,79 @@
+import os
+import threading
+
+# With lazy initialization, boto3 is imported and the clients are created on their first use instead of at the module
+# load, so that the cold start only pays for the clients the invocation needs. Set it to "false" to create them during
+# the init phase, which runs with a full vCPU whatever the memory size of the function
+LAZY_INIT = os.environ.get("LAZY_INIT", "true").lower() == "true"
+# Settings of the AWS SDK clients. The botocore defaults wait up to 60 s to connect and to read a response, keep 10
+# connections per client and retry with the legacy mode, which does not slow down when the API throttles
+CONNECT_TIMEOUT_SECONDS = float(os.environ.get("CLIENT_CONNECT_TIMEOUT_SECONDS", 2))
+READ_TIMEOUT_SECONDS = float(os.environ.get("CLIENT_READ_TIMEOUT_SECONDS", 10))
+MAX_POOL_CONNECTIONS = int(os.environ.get("CLIENT_MAX_POOL_CONNECTIONS", 25))
+MAX_ATTEMPTS = int(os.environ.get("CLIENT_MAX_ATTEMPTS", 5))
+RETRY_MODE = os.environ.get("CLIENT_RETRY_MODE", "adaptive")
+
+# The clients and resources created in the execution environment, reused by the warm invocations
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+class LazyClient:
+    """Stand-in for a boto3 client or resource, created on the first access to one of its attributes"""
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._client = None
+        self._lock = threading.Lock()
+
+    def resolve(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._factory()
+        return self._client
+
+    def __getattr__(self, name):
+        return getattr(self.resolve(), name)
+
+
+def _lazy(factory):
+    return LazyClient(factory) if LAZY_INIT else factory()
+
+
+def _get_or_create(key: tuple, factory):
+    # boto3 clients must not be created concurrently from the same session
+    with _shared_lock:
+        if key not in _shared:
+            _shared[key] = factory()
+        return _shared[key]
+
+
+def config(**overrides):
+    """The botocore configuration of the clients, with the given settings replaced"""
+    from botocore.config import Config
+    settings = {
+        "connect_timeout": CONNECT_TIMEOUT_SECONDS,
+        "read_timeout": READ_TIMEOUT_SECONDS,
+        "max_pool_connections": MAX_POOL_CONNECTIONS,
+        "retries": {"max_attempts": MAX_ATTEMPTS, "mode": RETRY_MODE},
+        "tcp_keepalive": True,
+    }
+    settings.update(overrides)
+    return Config(**settings)
+
+
+def client(service_name: str, **overrides):
+    """The boto3 client of a service, shared by the callers asking for the same settings"""
+    def create():
+        import boto3
+        return boto3.client(service_name, config=config(**overrides))
+    return _lazy(lambda: _get_or_create(("client", service_name, repr(sorted(overrides.items()))), create))
+
+
+def table(table_name: str, **overrides):
+    """A DynamoDB table, from the DynamoDB resource shared by the callers asking for the same settings"""
+    def create():
+        import boto3
+        return boto3.resource("dynamodb", config=config(**overrides))
+    return _lazy(lambda: _get_or_create(("dynamodb", repr(sorted(overrides.items()))), create).Table(table_name))
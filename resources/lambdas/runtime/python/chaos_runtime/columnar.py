@@ -0,0 +1,167 @@
+import sys
+import json
+import zlib
+import struct
+from array import array
+from itertools import accumulate
+
+# A segment holds records column by column. Each column is compressed on its own, and the header tells where it is
+# and gives its statistics: the bounds of the numbers and the distinct values of the strings, when there are few. A
+# reader can skip a whole segment from its header, and decompresses only the columns it reads.
+#
+#   MAGIC | header length (4 bytes, little endian) | header (JSON) | column blocks (zlib)
+MAGIC = b"CGSEG1\n"
+INT = "int"
+FLOAT = "float"
+STRING = "str"
+# The distinct values of the string columns with at most that many are kept in the header
+MAX_HEADER_VALUES = 64
+_NULL_CODE = 0xFFFFFFFF
+_LENGTH = struct.Struct("<I")
+
+
+def _little_endian(values: array) -> bytes:
+    if sys.byteorder != "little":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _from_little_endian(typecode: str, data: bytes) -> array:
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values
+
+
+def column_type(values: list) -> str:
+    present = [value for value in values if value is not None]
+    if all(isinstance(value, int) and not isinstance(value, bool) for value in present):
+        return INT
+    if all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in present):
+        return FLOAT
+    if all(isinstance(value, str) for value in present):
+        return STRING
+    raise TypeError(f"the values of a column must all be numbers or all be strings: {present[:3]}")
+
+
+def _encode_column(kind: str, values: list) -> tuple:
+    """The block of a column, and its statistics"""
+    present = [value for value in values if value is not None]
+    stats = {"nulls": len(values) - len(present)}
+    validity = bytes(value is not None for value in values)
+    if kind == STRING:
+        dictionary = sorted(set(present))
+        codes = {value: code for code, value in enumerate(dictionary)}
+        encoded = json.dumps(dictionary, separators=(",", ":")).encode()
+        block = _LENGTH.pack(len(encoded)) + encoded + _little_endian(
+            array("I", (_NULL_CODE if value is None else codes[value] for value in values)))
+        if len(dictionary) <= MAX_HEADER_VALUES:
+            stats["values"] = dictionary
+        return block, stats
+    if present:
+        stats.update(min=min(present), max=max(present))
+    if kind == INT:
+        # The differences between consecutive values, e.g. of the times, compress better than the values
+        deltas, previous = array("q"), 0
+        for value in values:
+            if value is not None:
+                deltas.append(value - previous)
+                previous = value
+        return validity + _little_endian(deltas), stats
+    return validity + _little_endian(array("d", (value for value in present))), stats
+
+
+def encode(records: list) -> bytes:
+    """A segment of the records, dictionaries of numbers and strings. The columns are the keys of all the records,
+    missing or None values are nulls
+    """
+    header = {"rows": len(records), "columns": {}}
+    blocks, offset = [], 0
+    for name in sorted({name for record in records for name in record}):
+        values = [record.get(name) for record in records]
+        kind = column_type(values)
+        block, stats = _encode_column(kind, values)
+        block = zlib.compress(block, 6)
+        header["columns"][name] = dict(stats, type=kind, offset=offset, length=len(block))
+        blocks.append(block)
+        offset += len(block)
+    encoded = json.dumps(header, separators=(",", ":")).encode()
+    return MAGIC + _LENGTH.pack(len(encoded)) + encoded + b"".join(blocks)
+
+
+class Segment:
+    """A segment whose columns are read and decoded when asked for, from the bytes of the segment or from a file"""
+
+    def __init__(self, header: dict, read_block):
+        self.rows = header["rows"]
+        self.columns = header["columns"]
+        self._read_block = read_block
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "Segment":
+        prefix = len(MAGIC) + _LENGTH.size
+        header, start = cls._header(data[:prefix], lambda length: data[prefix:prefix + length])
+        return cls(header, lambda offset, length: data[start + offset:start + offset + length])
+
+    @classmethod
+    def from_file(cls, path: str) -> "Segment":
+        """Only the header is read, the blocks are read from the file when their column is asked for"""
+        with open(path, "rb") as f:
+            header, start = cls._header(f.read(len(MAGIC) + _LENGTH.size), f.read)
+
+        def read_block(offset: int, length: int) -> bytes:
+            with open(path, "rb") as f:
+                f.seek(start + offset)
+                return f.read(length)
+        return cls(header, read_block)
+
+    @staticmethod
+    def _header(prefix: bytes, read) -> tuple:
+        if not prefix.startswith(MAGIC):
+            raise ValueError("not a segment")
+        (length,) = _LENGTH.unpack_from(prefix, len(MAGIC))
+        start = len(MAGIC) + _LENGTH.size
+        return json.loads(read(length)), start + length
+
+    def may_contain(self, name: str, low=None, high=None, values=None) -> bool:
+        """False when the statistics of the column show no row is within [low, high] or among the values"""
+        column = self.columns.get(name)
+        if column is None:
+            return low is None and high is None and values is None
+        if column["nulls"] == self.rows:
+            return False
+        if low is not None and "max" in column and column["max"] < low:
+            return False
+        if high is not None and "min" in column and column["min"] > high:
+            return False
+        if values is not None and "values" in column:
+            return any(value in values for value in column["values"])
+        return True
+
+    def column(self, name: str) -> list:
+        """The values of a column, None for the nulls and for all the rows when the segment has no such column"""
+        column = self.columns.get(name)
+        if column is None:
+            return [None] * self.rows
+        block = zlib.decompress(self._read_block(column["offset"], column["length"]))
+        if column["type"] == STRING:
+            (length,) = _LENGTH.unpack_from(block)
+            dictionary = json.loads(block[_LENGTH.size:_LENGTH.size + length])
+            codes = _from_little_endian("I", block[_LENGTH.size + length:])
+            return [None if code == _NULL_CODE else dictionary[code] for code in codes]
+        validity, data = block[:self.rows], block[self.rows:]
+        present = _from_little_endian("q" if column["type"] == INT else "d", data)
+        if column["type"] == INT:
+            present = accumulate(present)
+        if not column["nulls"]:
+            return list(present)
+        present = iter(present)
+        return [next(present) if valid else None for valid in validity]
+
+    def records(self, names=None) -> list:
+        """The records with the given columns, all of them by default"""
+        names = list(self.columns) if names is None else list(names)
+        columns = [self.column(name) for name in names]
+        return [dict(zip(names, row)) for row in zip(*columns)] if names else [{} for _ in range(self.rows)]
@@ -0,0 +1,41 @@
+import threading
+
+# The HTTP connection pools created in the execution environment. Their connections are kept alive between the warm
+# invocations, which skip the TCP and TLS handshakes
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def _get_or_create(key: tuple, factory):
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = factory()
+        return _pools[key]
+
+
+def pool_manager(maxsize: int = 10, retries=False, connect_timeout: float = 2, read_timeout: float = 10):
+    """A urllib3 pool manager keeping up to maxsize connections alive per host.
+
+    The retries are disabled by default, for the callers which bound them by the remaining time of the function.
+    """
+    def create():
+        import urllib3
+        return urllib3.PoolManager(maxsize=maxsize, retries=retries,
+                                   timeout=urllib3.Timeout(connect=connect_timeout, read=read_timeout))
+    return _get_or_create(("urllib3", maxsize, retries, connect_timeout, read_timeout), create)
+
+
+def requests_session(pool_size: int = 10, retries: int = 1, backoff_factor: float = 0, hosts: int = 1):
+    """A requests session keeping up to pool_size connections alive per host, to give one to each thread using it,
+    for up to the given number of hosts
+    """
+    def create():
+        import requests
+        from requests.adapters import HTTPAdapter, Retry
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=hosts, pool_maxsize=pool_size,
+                              max_retries=Retry(total=retries, backoff_factor=backoff_factor))
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+    return _get_or_create(("requests", pool_size, retries, backoff_factor, hosts), create)
@@ -0,0 +1,41 @@
+import time
+from aws_lambda_powertools.metrics import MetricUnit
+
+# The stages of a game loss, from the device to the score update, in order. The last one is measured from the state
+# machine logs by the latency report
+DEVICE = "device"          # game over on the device -> message received by the IoT rule
+QUEUE = "queue"            # IoT rule -> admission Lambda, including the waits for a free experiment slot
+ADMISSION = "admission"    # admission Lambda -> state machine execution started
+START = "start"            # execution started -> trigger Lambda
+TRIGGER = "trigger"        # trigger Lambda -> FIS experiment started
+EXPERIMENT = "experiment"  # FIS experiment started -> final state received
+SCORE = "score"            # final state received -> score updated by the state machine
+STAGES = (DEVICE, QUEUE, ADMISSION, START, TRIGGER, EXPERIMENT, SCORE)
+# The checks of the application run alongside the experiment, outside of the stages
+PROBE = "probe"            # one invocation of the probe Lambda
+
+
+def now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+class Spans:
+    """Timing spans of the stages of a game loss, tied together by the trace of the state machine execution: its
+    name and the correlation IDs of the losses it is credited to, created by the devices.
+
+    Each span is logged as one structured record, which the latency report reads, and added as a metric named after
+    the stage, e.g. "QueueLatency". The metrics are flushed by the log_metrics decorator of the handler.
+    """
+
+    def __init__(self, logger, metrics):
+        self.logger = logger
+        self.metrics = metrics
+
+    def record(self, stage: str, start_ms: int, end_ms: int, trace: dict):
+        """Record one span, unless one of its ends is unknown"""
+        if start_ms is None or end_ms is None:
+            return
+        duration = end_ms - start_ms
+        self.logger.info({"span": stage, "traceId": trace.get("traceId"), "correlationIds": trace.get("correlationIds"),
+                          "startMs": start_ms, "durationMs": duration})
+        self.metrics.add_metric(name=f"{stage.title()}Latency", unit=MetricUnit.Milliseconds, value=max(duration, 0))
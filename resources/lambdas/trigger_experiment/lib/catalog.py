@@ -0,0 +1,95 @@
+import time
+import threading
+from aws_lambda_powertools import Logger
+
+logger = Logger(child=True)
+
+
+class TemplateCatalog:
+    """In-memory index of the FIS experiment templates of one project, kept across warm invocations.
+
+    The index is keyed by template ID and by the template "Name" tag. It is refreshed from the FIS API when it is
+    older than the TTL. Up to the maximum staleness, the stale index is served while a background thread revalidates
+    it, so a warm trigger never pays the listing on its critical path. The version changes with every refresh.
+    """
+
+    def __init__(self, fis_client, project_tag: str, ttl_seconds: float = 300, max_stale_seconds: float = 3600):
+        self.fis = fis_client
+        self.project_tag = project_tag
+        self.ttl_seconds = ttl_seconds
+        self.max_stale_seconds = max_stale_seconds
+        self.by_id = {}
+        self.by_name = {}
+        self.loaded_at = None
+        self.version = 0
+        self.lock = threading.Lock()
+        self.revalidation = None
+
+    @property
+    def age(self) -> float:
+        return time.monotonic() - self.loaded_at if self.loaded_at is not None else float("inf")
+
+    def list_project_templates(self) -> list:
+        """Page through all the experiment templates and keep the ones with the "Project" tag of this project"""
+        templates = []
+        kwargs = {}
+        while True:
+            response = self.fis.list_experiment_templates(**kwargs)
+            templates.extend(template for template in response.get("experimentTemplates", [])
+                             if template.get("tags", {}).get("Project") == self.project_tag)
+            if not response.get("nextToken"):
+                return templates
+            kwargs = {"nextToken": response.get("nextToken")}
+
+    def refresh(self):
+        templates = self.list_project_templates()
+        by_id = {template.get("id"): template for template in templates}
+        by_name = {template.get("tags", {}).get("Name"): template for template in templates}
+        # Swap the indexes at once so that readers never see a half-built catalog
+        with self.lock:
+            self.by_id, self.by_name = by_id, by_name
+            self.loaded_at = time.monotonic()
+            self.version += 1
+        logger.info(f"Experiment templates catalog refreshed with {len(by_id)} templates")
+
+    def _revalidate(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            # Keep serving the stale catalog, the next invocation will try again
+            logger.exception(e)
+
+    def revalidate_in_background(self):
+        with self.lock:
+            if self.revalidation and self.revalidation.is_alive():
+                return
+            self.revalidation = threading.Thread(target=self._revalidate, daemon=True)
+            self.revalidation.start()
+
+    def wait_for_revalidation(self):
+        """Join the background revalidation before the invocation returns, the Lambda sandbox is frozen after that"""
+        revalidation = self.revalidation
+        if revalidation:
+            revalidation.join()
+
+    def invalidate(self):
+        with self.lock:
+            self.loaded_at = None
+
+    def templates(self) -> list:
+        age = self.age
+        if age > self.max_stale_seconds or not self.by_id:
+            self.refresh()
+        elif age > self.ttl_seconds:
+            self.revalidate_in_background()
+        return list(self.by_id.values())
+
+    def snapshot(self) -> tuple:
+        """The version of the catalog and its templates, read together"""
+        self.templates()
+        with self.lock:
+            return self.version, list(self.by_id.values())
+
+    def get_by_name(self, name: str) -> dict:
+        self.templates()
+        return self.by_name.get(name)
@@ -0,0 +1,202 @@
+import time
+import random
+import hashlib
+from aws_lambda_powertools import Logger
+
+logger = Logger(child=True)
+
+RANDOM = "random"
+WEIGHTED = "weighted"
+ROUND_ROBIN = "round_robin"
+LEAST_RECENT = "least_recent"
+STRATEGIES = (RANDOM, WEIGHTED, ROUND_ROBIN, LEAST_RECENT)
+# Draws of a random strategy among the templates cooling down before looking for the available ones
+MAX_DRAWS = 8
+
+
+class AliasTable:
+    """Walker's alias table, to draw a weighted random index in O(1) whatever the number of templates"""
+
+    def __init__(self, weights: list):
+        n = len(weights)
+        total = sum(weights)
+        scaled = [w * n / total for w in weights]
+        self.probability = [0.0] * n
+        self.alias = list(range(n))
+        small = [i for i, w in enumerate(scaled) if w < 1]
+        large = [i for i, w in enumerate(scaled) if w >= 1]
+        while small and large:
+            s, l = small.pop(), large.pop()
+            self.probability[s] = scaled[s]
+            self.alias[s] = l
+            scaled[l] -= 1 - scaled[s]
+            (small if scaled[l] < 1 else large).append(l)
+        for i in small + large:
+            self.probability[i] = 1.0
+
+    def draw(self, rng: random.Random) -> int:
+        i = rng.randrange(len(self.probability))
+        return i if rng.random() < self.probability[i] else self.alias[i]
+
+
+class ExperimentScheduler:
+    """Pick the next experiment template to run.
+
+    The strategy is one of "random", "weighted" (by the template weight tag), "round_robin" or "least_recent".
+    Templates run less than the cool-down ago are skipped, unless they are all cooling down in which case the least
+    recently run one is picked. The scheduling state is one item of the DynamoDB score table, so a pick costs one
+    GetItem and one UpdateItem whatever the number of games already played. Without a table, the state is only kept
+    in memory.
+
+    The state is versioned: it is only written if no other execution wrote it since it was read, otherwise it is read
+    again and the template picked again. The least recently run templates are kept in order in the state, so that
+    least_recent takes the first one instead of comparing the last runs of all the templates.
+    """
+
+    def __init__(self, table=None, strategy: str = RANDOM, cooldown_seconds: float = 0, weight_tag: str = "Weight",
+                 state_key: str = "scheduler", rng: random.Random = None, max_attempts: int = 5,
+                 retry_delay_seconds: float = 0.02):
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown scheduling strategy {strategy}, expected one of {STRATEGIES}")
+        self.table = table
+        self.strategy = strategy
+        self.cooldown_seconds = cooldown_seconds
+        self.weight_tag = weight_tag
+        self.state_key = state_key
+        self.rng = rng or random.Random()
+        self.max_attempts = max_attempts
+        self.retry_delay_seconds = retry_delay_seconds
+        self.local_state = {}
+        # Precomputed per version of the catalog, and only rebuilt when it changes
+        self.catalog_version = None
+        self.template_ids = ()
+        self.by_id = {}
+        self.positions = {}
+        self.alias_table = None
+        # Identifies the set of templates in the state, to tell whether its order of the templates is up to date
+        self.templates_key = ""
+        # The picks written again after another execution wrote the state, and the ones given up
+        self.conflicts = 0
+        self.unsaved = 0
+
+    def prepare(self, templates: list, version=None):
+        """Index the templates, only once per version of the catalog when it is given"""
+        if version is not None and version == self.catalog_version:
+            return
+        self.catalog_version = version
+        self.by_id = {template.get("id"): template for template in templates}
+        template_ids = tuple(sorted(self.by_id))
+        if template_ids == self.template_ids:
+            return
+        self.template_ids = template_ids
+        self.positions = {template_id: index for index, template_id in enumerate(template_ids)}
+        self.alias_table = AliasTable([self.weight(self.by_id[template_id]) for template_id in template_ids])
+        self.templates_key = hashlib.sha1(",".join(template_ids).encode()).hexdigest()[:16]
+
+    def weight(self, template: dict) -> float:
+        try:
+            return max(float(template.get("tags", {}).get(self.weight_tag, 1)), 0.0) or 1e-9
+        except ValueError:
+            return 1.0
+
+    def load_state(self) -> dict:
+        if self.table is None:
+            return self.local_state
+        return self.table.get_item(Key={"pk": self.state_key}, ConsistentRead=True).get("Item", {})
+
+    def save_state(self, state: dict, template_id: str, cursor: int, order: list, now: float) -> bool:
+        """Write the pick to the state, unless it changed since it was read. Returns False in that case"""
+        version = int(state.get("version", 0))
+        if self.table is None:
+            self.local_state.update({f"last_{template_id}": now, "cursor": cursor, "version": version + 1})
+            if order is not None:
+                self.local_state.update(order=order, templates=self.templates_key)
+            return True
+        names = {"#last": f"last_{template_id}", "#cursor": "cursor", "#version": "version"}
+        values = {":now": int(now), ":cursor": cursor, ":version": version, ":next": version + 1}
+        update = "SET #last = :now, #cursor = :cursor, #version = :next"
+        if order is not None:
+            names.update({"#order": "order", "#templates": "templates"})
+            values.update({":order": order, ":templates": self.templates_key})
+            update += ", #order = :order, #templates = :templates"
+        try:
+            self.table.update_item(
+                Key={"pk": self.state_key},
+                UpdateExpression=update,
+                ConditionExpression="attribute_not_exists(#version) OR #version = :version",
+                ExpressionAttributeNames=names,
+                ExpressionAttributeValues=values,
+            )
+            return True
+        except self.table.meta.client.exceptions.ConditionalCheckFailedException:
+            self.conflicts += 1
+            return False
+
+    def least_recent_order(self, state: dict) -> list:
+        """The templates, least recently run first. The order of the state is used as is when it holds the same
+        templates, otherwise it is rebuilt from their last runs
+        """
+        order = state.get("order")
+        if order and state.get("templates") == self.templates_key:
+            return list(order)
+        return sorted(self.template_ids, key=lambda template_id: float(state.get(f"last_{template_id}", "-inf")))
+
+    def choose(self, state: dict, now: float) -> tuple:
+        """The index of the template to run, and the order of the templates to store for least_recent"""
+        n = len(self.template_ids)
+        cursor = int(state.get("cursor", 0))
+
+        def last_run(index: int) -> float:
+            # Templates never run are always available
+            return float(state.get(f"last_{self.template_ids[index]}", "-inf"))
+
+        def available(index: int) -> bool:
+            return now - last_run(index) >= self.cooldown_seconds
+
+        if self.strategy == LEAST_RECENT:
+            # The first one is the least recently run: when it is cooling down, all the others are too
+            order = self.least_recent_order(state)
+            order.append(order.pop(0))
+            return self.positions[order[-1]], order
+        if self.strategy == ROUND_ROBIN:
+            index = next((i % n for i in range(cursor, cursor + n) if available(i % n)), None)
+        else:
+            # Draw again while the template drawn is cooling down, which keeps the odds of the strategy among the
+            # available templates. After a few draws, they are most likely all cooling down
+            for _ in range(MAX_DRAWS):
+                index = self.alias_table.draw(self.rng) if self.strategy == WEIGHTED else self.rng.randrange(n)
+                if available(index):
+                    break
+        if index is None or not available(index):
+            candidates = [i for i in range(n) if available(i)]
+            if candidates and self.strategy == WEIGHTED:
+                weights = [self.weight(self.by_id[self.template_ids[i]]) for i in candidates]
+                index = self.rng.choices(candidates, weights=weights)[0]
+            elif candidates:
+                index = self.rng.choice(candidates)
+            else:
+                index = min(range(n), key=last_run)
+        return index, None
+
+    def pick(self, templates: list, now: float = None, version=None) -> dict:
+        """Pick a template among the ones of the catalog, whose version saves indexing them again when it is given"""
+        if not templates:
+            raise ValueError("No experiment template to pick from")
+        now = time.time() if now is None else now
+        self.prepare(templates, version)
+        n = len(self.template_ids)
+        for attempt in range(self.max_attempts):
+            state = self.load_state()
+            index, order = self.choose(state, now)
+            template_id = self.template_ids[index]
+            if self.save_state(state, template_id, (index + 1) % n, order, now):
+                break
+            # Another execution picked at the same time, pick again from its state after a random wait, so that the
+            # two executions do not collide again
+            if attempt + 1 < self.max_attempts:
+                time.sleep(self.rng.uniform(0, self.retry_delay_seconds * 2 ** attempt))
+        else:
+            self.unsaved += 1
+            logger.warning({"scheduler": self.strategy, "not_saved": template_id, "attempts": self.max_attempts})
+        logger.info({"scheduler": self.strategy, "picked": template_id, "cursor": (index + 1) % n})
+        return self.by_id[template_id]
@@ -1,36 +1,73 @@
 import json
 import os
-import random
-import boto3
-from aws_lambda_powertools import Logger, Metrics, Tracer
+from aws_lambda_powertools import Logger, Metrics
+from chaos_runtime import clients, spans
+from lib.catalog import TemplateCatalog
+from lib.scheduler import ExperimentScheduler
 
 logger = Logger()
-tracer = Tracer()
+metrics = Metrics()
+timing = spans.Spans(logger, metrics)
 
 PROJECT_TAG = os.environ.get("PROJECT_TAG")
+TEMPLATE_CACHE_TTL_SECONDS = float(os.environ.get("TEMPLATE_CACHE_TTL_SECONDS", 300))
+TEMPLATE_CACHE_MAX_STALE_SECONDS = float(os.environ.get("TEMPLATE_CACHE_MAX_STALE_SECONDS", 3600))
+SCORE_TABLE_NAME = os.environ.get("SCORE_TABLE_NAME")
+# One of "random", "weighted", "round_robin" or "least_recent"
+SCHEDULER_STRATEGY = os.environ.get("SCHEDULER_STRATEGY", "random")
+SCHEDULER_COOLDOWN_SECONDS = float(os.environ.get("SCHEDULER_COOLDOWN_SECONDS", 0))
 
-fis = boto3.client("fis")
+fis = clients.client("fis")
 """ :type: pyboto3.fis """
 
+# The catalog of the experiment templates lives across warm invocations
+catalog = TemplateCatalog(fis, PROJECT_TAG,
+                          ttl_seconds=TEMPLATE_CACHE_TTL_SECONDS,
+                          max_stale_seconds=TEMPLATE_CACHE_MAX_STALE_SECONDS)
+# The scheduling state is stored in the score table when there is one
+scheduler = ExperimentScheduler(
+    table=clients.table(SCORE_TABLE_NAME) if SCORE_TABLE_NAME else None,
+    strategy=SCHEDULER_STRATEGY,
+    cooldown_seconds=SCHEDULER_COOLDOWN_SECONDS)
+
+
+def start_experiment(template: dict) -> dict:
+    return fis.start_experiment(
+        experimentTemplateId=template.get("id"),
+        tags={"Project": PROJECT_TAG}).get("experiment")
+
+
+@metrics.log_metrics
 @logger.inject_lambda_context(log_event=True)
 def lambda_handler(event, context):
-    # Get the list of experiment templates
-    list_templates_response = fis.list_experiment_templates()
-    experiment_templates = list_templates_response.get("experimentTemplates")
-    while list_templates_response.get("nextToken"):
-        list_templates_response = fis.list_experiment_templates(NextToken=list_templates_response.get("nextToken"))
-        experiment_templates.extend(list_templates_response.get("experimentTemplates"))
-    # Keep only the experiment templates that have the "Project" tag set to this project value
-    # To trigger a specific experiment add in the if condition something like
-    # and "All ECS Fargate Task from the Nginx Service" in template.get("tags").get("Name")
-    experiment_templates = [template for template in experiment_templates
-                            if template.get("tags", {}).get("Project") == PROJECT_TAG]
+    started_at = spans.now_ms()
+    # The executions started by hand have no trace
+    trace = event.get("trace") or {}
+    # Get the experiment templates of this project from the catalog. It only calls the FIS API when it is cold or stale
+    # To trigger a specific experiment use something like
+    # catalog.get_by_name(f"{PROJECT_TAG}-Terminate All ECS Fargate Task from the Nginx Service")
+    catalog_version, experiment_templates = catalog.snapshot()
     logger.info({"experiment_templates": experiment_templates})
-    # Pick one experiment randomly
-    experiment_to_trigger = random.choice(experiment_templates)
+    # Pick one experiment with the configured scheduling strategy, which indexes the templates once per catalog version
+    experiment_to_trigger = scheduler.pick(experiment_templates, version=catalog_version)
     logger.info({"chosen_experiment": experiment_to_trigger.get("tags").get("Name")})
     # Trigger the experiment
-    experiment = fis.start_experiment(
-        experimentTemplateId=experiment_to_trigger.get("id"),
-        tags={"Project": PROJECT_TAG}).get("experiment")
-    return {"experimentId": experiment.get("id")}
+    try:
+        experiment = start_experiment(experiment_to_trigger)
+    except fis.exceptions.ResourceNotFoundException:
+        # The template was deleted since the catalog was loaded, reload it and pick again
+        catalog.invalidate()
+        catalog_version, experiment_templates = catalog.snapshot()
+        experiment_to_trigger = scheduler.pick(experiment_templates, version=catalog_version)
+        logger.info({"chosen_experiment": experiment_to_trigger.get("tags").get("Name")})
+        experiment = start_experiment(experiment_to_trigger)
+    experiment_started_at = spans.now_ms()
+    timing.record(spans.START, trace.get("admittedAt"), started_at, trace)
+    timing.record(spans.TRIGGER, started_at, experiment_started_at, trace)
+    catalog.wait_for_revalidation()
+    # Pass on the number of game losses this experiment is credited to, and the trace. The template and the devices
+    # of the losses are kept for the history of the games
+    return {"experimentId": experiment.get("id"), "credits": event.get("credits", 1),
+            "template": experiment_to_trigger.get("tags").get("Name"), "templateId": experiment_to_trigger.get("id"),
+            "devices": [loss.get("clientId") for loss in event.get("losses") or []],
+            "trace": dict(trace, experimentStartedAt=experiment_started_at)}
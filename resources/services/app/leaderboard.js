@@ -0,0 +1,91 @@
+// Leaderboards of the devices and players, read from the hourly and daily counters of the DynamoDB table
+//
+// The admission Lambda adds every game result to the counters of its device and player for the hour and the day it
+// was received. Each counter item has the id of its board, '<device|player>#<hour|day>#<bucket>', and the table index
+// on the board and the number of games won returns the top of a board with one Query. The boards are cached for a
+// short time, the requests for a board being read wait for the same Query, and the last board read is served when the
+// Query fails.
+
+const KINDS = ['device', 'player'];
+const PERIODS = ['hour', 'day'];
+const MAX_TOP = 100;
+
+// The id of the board of the devices or players for the UTC hour or day of a date
+function boardId(kind, period, date = new Date()) {
+  const digits = date.toISOString().replace(/\D/g, '');
+  return `${kind}#${period}#${digits.slice(0, period === 'hour' ? 10 : 8)}`;
+}
+
+class Leaderboard {
+  /**
+   * @param {object} documentClient The DynamoDB Document client, only its query method is used
+   * @param {object} options tableName, indexName: the index on the board and won attributes, ttlMs: time a board
+   *                 is served from the cache
+   */
+  constructor(documentClient, { tableName, indexName = 'leaderboard', ttlMs = 5000 }) {
+    this.documentClient = documentClient;
+    this.tableName = tableName;
+    this.indexName = indexName;
+    this.ttlMs = ttlMs;
+    // The boards read, and being read, by board id
+    this.boards = new Map();
+  }
+
+  /**
+   * The devices or players with the most games won in the current hour or day
+   *
+   * @param {string} kind 'device' or 'player'
+   * @param {string} period 'hour' or 'day'
+   * @param {number} n Number of entries, up to 100
+   * @returns {Promise<{board: string, entries: Array<{name: string, won: number, lost: number}>}>}
+   */
+  async top(kind, period, n = 10) {
+    if (!KINDS.includes(kind) || !PERIODS.includes(period)) {
+      throw new RangeError(`Unknown leaderboard ${kind} by ${period}`);
+    }
+    const board = boardId(kind, period);
+    let cached = this.boards.get(board);
+    if (!cached) {
+      // A new hour or day started, the previous board is not served anymore
+      for (const id of this.boards.keys()) {
+        if (id.startsWith(`${kind}#${period}#`)) {
+          this.boards.delete(id);
+        }
+      }
+      cached = { entries: null, expiresAt: 0, refreshing: null };
+      this.boards.set(board, cached);
+    }
+    if (!cached.entries || Date.now() >= cached.expiresAt) {
+      if (!cached.refreshing) {
+        cached.refreshing = this.read(board).then(entries => {
+          cached.entries = entries;
+          cached.expiresAt = Date.now() + this.ttlMs;
+          return entries;
+        }).finally(() => { cached.refreshing = null; });
+      }
+      try {
+        await cached.refreshing;
+      } catch (err) {
+        // Serve the last board read, if any
+        if (!cached.entries) {
+          throw err;
+        }
+      }
+    }
+    return { board, entries: cached.entries.slice(0, Math.min(n, MAX_TOP)) };
+  }
+
+  async read(board) {
+    const data = await this.documentClient.query({
+      TableName: this.tableName,
+      IndexName: this.indexName,
+      KeyConditionExpression: 'board = :board',
+      ExpressionAttributeValues: { ':board': board },
+      ScanIndexForward: false,
+      Limit: MAX_TOP,
+    }).promise();
+    return (data.Items || []).map(item => ({ name: item.name, won: item.won || 0, lost: item.lost || 0 }));
+  }
+}
+
+module.exports = { Leaderboard, boardId, KINDS, PERIODS };
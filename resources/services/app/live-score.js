@@ -0,0 +1,233 @@
+// Live game score pushed to the browsers with Server-Sent Events
+//
+// The score page keeps a connection open on the events of the score instead of being reloaded. The score items of
+// the DynamoDB table are followed through the stream of the table: when a score item changes, the score is read once,
+// whatever the number of browsers connected, and the new score is written to all of them. A comment is sent now and
+// then on the idle connections, so that the load balancer and Nginx keep them open.
+//
+// Without a stream, e.g. when running locally, the score is read at a fixed interval instead, still once for all the
+// browsers.
+
+// The score items, as named in score.js
+function isScoreKey(pk) {
+  return pk === 'score' || pk.startsWith('score#');
+}
+
+// Follows the changes of the score items in the DynamoDB stream of the table, and calls onChange once for every
+// batch of records holding some. Each task of the service reads every shard, DynamoDB Streams serves up to 5 reads
+// per second per shard, so a poll every second leaves room for 4 tasks
+class ScoreStream {
+  /**
+   * @param {object} streamsClient The DynamoDB Streams client, only its describeStream, getShardIterator and
+   *                 getRecords methods are used
+   * @param {object} options streamArn, onChange: called when score items changed, pollMs: time between two reads
+   *                 of the shards, maxBackoffMs: longest wait after a failed read
+   */
+  constructor(streamsClient, { streamArn, onChange, pollMs = 1000, maxBackoffMs = 10000 }) {
+    this.streamsClient = streamsClient;
+    this.streamArn = streamArn;
+    this.onChange = onChange;
+    this.pollMs = pollMs;
+    this.maxBackoffMs = maxBackoffMs;
+    // The iterators of the open shards being read, by shard id
+    this.iterators = new Map();
+    // The shards read to their end, whose children are read from their start
+    this.closed = new Set();
+    this.started = false;
+    this.timer = null;
+    this.stats = { polls: 0, records: 0, changes: 0, errors: 0 };
+  }
+
+  start() {
+    const loop = async (waitMs) => {
+      let backoffMs = 0;
+      try {
+        await this.poll();
+      } catch (err) {
+        this.stats.errors++;
+        console.log('Error reading the score stream', err);
+        // Start again from the shards of the stream, the score is read again as changes may have been missed
+        this.iterators.clear();
+        this.started = false;
+        backoffMs = Math.min(Math.max(2 * waitMs, this.pollMs), this.maxBackoffMs);
+      }
+      if (this.timer !== null) {
+        this.timer = setTimeout(() => loop(backoffMs), backoffMs || this.pollMs);
+      }
+    };
+    this.timer = setTimeout(() => loop(0), 0);
+  }
+
+  stop() {
+    clearTimeout(this.timer);
+    this.timer = null;
+  }
+
+  async poll() {
+    this.stats.polls++;
+    if (!this.started || this.iterators.size === 0) {
+      await this.refreshShards();
+    }
+    let changed = false;
+    let shardClosed = false;
+    for (const [shardId, iterator] of this.iterators) {
+      const data = await this.streamsClient.getRecords({ ShardIterator: iterator, Limit: 1000 }).promise();
+      const records = data.Records || [];
+      this.stats.records += records.length;
+      changed = changed || records.some(record => isScoreKey(record.dynamodb.Keys.pk.S));
+      if (data.NextShardIterator) {
+        this.iterators.set(shardId, data.NextShardIterator);
+      } else {
+        this.iterators.delete(shardId);
+        this.closed.add(shardId);
+        shardClosed = true;
+      }
+    }
+    if (shardClosed) {
+      await this.refreshShards();
+    }
+    if (changed) {
+      this.stats.changes++;
+      this.onChange();
+    }
+  }
+
+  // Read the open shards not read yet: from their latest record when starting, from their start when their parent
+  // was read to its end
+  async refreshShards() {
+    const resync = !this.started;
+    let exclusiveStartShardId;
+    do {
+      const data = await this.streamsClient.describeStream({
+        StreamArn: this.streamArn, ExclusiveStartShardId: exclusiveStartShardId,
+      }).promise();
+      const description = data.StreamDescription;
+      for (const shard of description.Shards) {
+        const open = !shard.SequenceNumberRange.EndingSequenceNumber;
+        if (!open || this.iterators.has(shard.ShardId) || this.closed.has(shard.ShardId)) {
+          continue;
+        }
+        const type = this.started && this.closed.has(shard.ParentShardId) ? 'TRIM_HORIZON' : 'LATEST';
+        const iterator = await this.streamsClient.getShardIterator({
+          StreamArn: this.streamArn, ShardId: shard.ShardId, ShardIteratorType: type,
+        }).promise();
+        this.iterators.set(shard.ShardId, iterator.ShardIterator);
+      }
+      exclusiveStartShardId = description.LastEvaluatedShardId;
+    } while (exclusiveStartShardId);
+    this.started = true;
+    if (resync) {
+      // The changes before the first read of the shards are not in the stream records read
+      this.onChange();
+    }
+  }
+}
+
+class LiveScore {
+  /**
+   * @param {object} scoreCache The ScoreCache of the score page
+   * @param {object} options heartbeatMs: time between two comments on the connections, retryMs: time the browsers
+   *                 wait before connecting again
+   */
+  constructor(scoreCache, { heartbeatMs = 15000, retryMs = 3000 } = {}) {
+    this.scoreCache = scoreCache;
+    this.retryMs = retryMs;
+    this.clients = new Set();
+    // The last score event sent, also sent to the browsers when they connect
+    this.event = null;
+    this.sequence = 0;
+    // The read in progress, and whether the score changed again while it was running
+    this.reading = null;
+    this.dirty = false;
+    this.stats = { connected: 0, peak: 0, reads: 0, pushes: 0, messages: 0 };
+    this.heartbeat = setInterval(() => this.write(': keep-alive\n\n'), heartbeatMs);
+    this.heartbeat.unref();
+  }
+
+  /**
+   * Keep the response open as a stream of score events
+   *
+   * @param {http.IncomingMessage} req
+   * @param {http.ServerResponse} res
+   */
+  async subscribe(req, res) {
+    res.writeHead(200, {
+      'Content-Type': 'text/event-stream',
+      'Cache-Control': 'no-cache, no-transform',
+      'Connection': 'keep-alive',
+      // Nginx passes the events on as they come
+      'X-Accel-Buffering': 'no',
+    });
+    res.write(`retry: ${this.retryMs}\n\n`);
+    this.clients.add(res);
+    this.stats.connected = this.clients.size;
+    this.stats.peak = Math.max(this.stats.peak, this.clients.size);
+    req.on('close', () => {
+      this.clients.delete(res);
+      this.stats.connected = this.clients.size;
+    });
+    if (!this.event) {
+      try {
+        // The first browsers wait for the same read of the score, from the cache of the score page
+        this.event = this.format(await this.scoreCache.get());
+      } catch (err) {
+        console.log("Error", err);
+        return;
+      }
+    }
+    res.write(this.event);
+  }
+
+  format(score) {
+    this.sequence++;
+    return `id: ${this.sequence}\nevent: score\ndata: ${JSON.stringify(score)}\n\n`;
+  }
+
+  /**
+   * The score changed: read it once and push it to all the browsers. The changes arriving during the read are
+   * coalesced into one more read
+   */
+  changed() {
+    if (this.reading) {
+      this.dirty = true;
+      return this.reading;
+    }
+    this.reading = (async () => {
+      do {
+        this.dirty = false;
+        this.stats.reads++;
+        try {
+          // The read also refreshes the cache of the score page
+          const score = await this.scoreCache.read();
+          const data = JSON.stringify(score);
+          if (!this.event || !this.event.endsWith(`data: ${data}\n\n`)) {
+            this.event = this.format(score);
+            this.stats.pushes++;
+            this.write(this.event);
+          }
+        } catch (err) {
+          console.log("Error", err);
+        }
+      } while (this.dirty);
+    })().finally(() => { this.reading = null; });
+    return this.reading;
+  }
+
+  write(message) {
+    for (const res of this.clients) {
+      res.write(message);
+      this.stats.messages++;
+    }
+  }
+
+  // End the connections, e.g. before the server closes
+  close() {
+    clearInterval(this.heartbeat);
+    for (const res of this.clients) {
+      res.end();
+    }
+    this.clients.clear();
+  }
+}
+
+module.exports = { LiveScore, ScoreStream, isScoreKey };
@@ -0,0 +1,285 @@
+#!/usr/bin/env node
+// Load test of the live score against a local DynamoDB stand-in with a stream
+//
+// Browsers show the score page while the state machine adds game results to the score. Reloaded every 5 seconds, as
+// the page used to be, every browser asks for the page and the score is read from the table, on every view without
+// the cache or once per second with it. Live, every browser keeps a connection open on the score events, and the
+// score is read once per change of the score items seen in the table stream, then written to all the connections.
+//
+// The web application runs in a child process, as one task of the service, so that its memory and CPU are measured
+// apart from the browsers. The latency of an update is the time from the score update in the table to the browser
+// showing it.
+//
+//     node resources/services/app/local/load-live-score.js [seconds] [browsers, e.g. 1000,4000,8000] [games/s]
+const http = require('http');
+const { fork } = require('child_process');
+const { ScoreCache } = require('../score');
+const { LiveScore, ScoreStream } = require('../live-score');
+const { LocalDynamoDB, TABLE_NAME, SHARDS } = require('./load-score');
+
+const SECONDS = parseFloat(process.argv[2]) || 10;
+const BROWSERS = (process.argv[3] || '1000,4000,8000').split(',').map(n => parseInt(n, 10));
+const GAMES_PER_SECOND = parseFloat(process.argv[4]) || 0.5;
+const RELOAD_MS = 5000;
+const STREAM_POLL_MS = 1000;
+// Browsers connecting at the same time
+const CONNECT_BATCH = 200;
+const MODES = {
+  'reload, no cache': { live: false, ttlMs: 0 },
+  'reload, cached': { live: false, ttlMs: 1000 },
+  'live': { live: true, ttlMs: 1000 },
+};
+
+const sleep = ms => new Promise(resolve => setTimeout(resolve, ms));
+const now = () => performance.timeOrigin + performance.now();
+
+// The stream of the local table: one shard holding the keys of the items updated
+class LocalStreams {
+  constructor(db) {
+    this.records = [];
+    this.calls = { describeStream: 0, getShardIterator: 0, getRecords: 0 };
+    const update = db.update.bind(db);
+    db.update = params => {
+      const request = update(params);
+      return { promise: async () => {
+        const result = await request.promise();
+        this.records.push({ dynamodb: { Keys: { pk: { S: params.Key.pk } } } });
+        return result;
+      } };
+    };
+  }
+
+  describeStream() {
+    this.calls.describeStream++;
+    return { promise: async () => ({ StreamDescription: {
+      Shards: [{ ShardId: 'shard-0', SequenceNumberRange: { StartingSequenceNumber: '0' } }],
+    } }) };
+  }
+
+  getShardIterator(params) {
+    this.calls.getShardIterator++;
+    const position = params.ShardIteratorType === 'LATEST' ? this.records.length : 0;
+    return { promise: async () => ({ ShardIterator: `${position}` }) };
+  }
+
+  getRecords(params) {
+    this.calls.getRecords++;
+    return { promise: async () => {
+      const position = parseInt(params.ShardIterator, 10);
+      const records = this.records.slice(position, position + params.Limit);
+      return { Records: records, NextShardIterator: `${position + records.length}` };
+    } };
+  }
+}
+
+// One task of the web application, with the state machine adding the game results to the score
+async function server(mode) {
+  const db = new LocalDynamoDB();
+  const streams = new LocalStreams(db);
+  const scoreCache = new ScoreCache(db, { tableName: TABLE_NAME, shards: SHARDS, ttlMs: mode.ttlMs });
+  const liveScore = new LiveScore(scoreCache);
+  const scoreStream = new ScoreStream(streams, {
+    streamArn: 'local', pollMs: STREAM_POLL_MS, onChange: () => liveScore.changed(),
+  });
+  if (mode.live) {
+    scoreStream.start();
+  }
+  let pageViews = 0;
+  const httpServer = http.createServer((req, res) => {
+    if (req.url === '/score/events') {
+      liveScore.subscribe(req, res);
+      return;
+    }
+    pageViews++;
+    scoreCache.get().then(score => res.end(JSON.stringify(score)), () => res.end('{}'));
+  });
+  httpServer.maxConnections = Infinity;
+  httpServer.keepAliveTimeout = 2 * RELOAD_MS;
+  await new Promise(resolve => httpServer.listen(0, '127.0.0.1', resolve));
+
+  let writes = [];
+  let total = 0;
+  let window = null;
+  // The games end at random times, at the given rate
+  let writer = null;
+  const write = async () => {
+    const attribute = Math.random() < 0.5 ? 'won' : 'lost';
+    await db.update({
+      TableName: TABLE_NAME, Key: { pk: `score#${Math.floor(Math.random() * SHARDS)}` },
+      UpdateExpression: `ADD ${attribute} :inc`, ExpressionAttributeValues: { ':inc': 1 },
+    }).promise();
+    total++;
+    writes.push([total, now()]);
+    writer = setTimeout(write, -Math.log(1 - Math.random()) * 1000 / GAMES_PER_SECOND);
+  };
+  write();
+
+  const snapshot = () => ({
+    at: now(), cpu: process.cpuUsage(), memory: process.memoryUsage(), pageViews,
+    batchGet: db.calls.batchGet, getRecords: streams.calls.getRecords, connected: liveScore.clients.size,
+  });
+  process.on('message', message => {
+    if (message === 'idle') {
+      global.gc && global.gc();
+      process.send({ idle: snapshot() });
+    } else if (message === 'start') {
+      global.gc && global.gc();
+      writes = [];
+      window = snapshot();
+      process.send({ started: window });
+    } else if (message === 'stop') {
+      clearTimeout(writer);
+      process.send({ stopped: snapshot(), start: window, writes });
+    } else if (message === 'exit') {
+      scoreStream.stop();
+      liveScore.close();
+      process.exit();
+    }
+  });
+  process.send({ port: httpServer.address().port });
+}
+
+function request(child, message, key) {
+  return new Promise(resolve => {
+    const listener = reply => {
+      if (key in reply) {
+        child.off('message', listener);
+        resolve(reply);
+      }
+    };
+    child.on('message', listener);
+    child.send(message);
+  });
+}
+
+// The browsers: the score totals they show, and when they showed them
+function browsers(port, count, live, seen) {
+  const agent = new http.Agent({ keepAlive: true, maxSockets: Infinity });
+  const requests = [];
+  let stopped = false;
+  const show = (browser, score) => {
+    const shown = score.won + score.lost;
+    if (shown > browser.shown) {
+      seen.push([browser.shown, shown, now()]);
+      browser.shown = shown;
+    }
+  };
+  const connect = browser => new Promise(resolve => {
+    const req = http.get({ host: '127.0.0.1', port, path: '/score/events', agent }, res => {
+      let buffer = '';
+      res.setEncoding('utf8');
+      res.on('data', chunk => {
+        buffer += chunk;
+        let end;
+        while ((end = buffer.indexOf('\n\n')) >= 0) {
+          const message = buffer.slice(0, end);
+          buffer = buffer.slice(end + 2);
+          const data = message.split('\n').find(line => line.startsWith('data: '));
+          if (data) {
+            show(browser, JSON.parse(data.slice(6)));
+            resolve();
+          }
+        }
+      });
+    });
+    req.on('error', resolve);
+    requests.push(req);
+  });
+  const reload = async browser => {
+    // The browsers opened the page at different times
+    await sleep(Math.random() * RELOAD_MS);
+    while (!stopped) {
+      await new Promise(resolve => {
+        http.get({ host: '127.0.0.1', port, path: '/', agent }, res => {
+          let body = '';
+          res.setEncoding('utf8');
+          res.on('data', chunk => { body += chunk; });
+          res.on('end', () => {
+            show(browser, JSON.parse(body));
+            resolve();
+          });
+        }).on('error', resolve);
+      });
+      await sleep(RELOAD_MS);
+    }
+  };
+  const all = [...Array(count)].map(() => ({ shown: -1 }));
+  return {
+    async open() {
+      if (live) {
+        for (let start = 0; start < count; start += CONNECT_BATCH) {
+          await Promise.all(all.slice(start, start + CONNECT_BATCH).map(connect));
+        }
+      } else {
+        all.forEach(reload);
+      }
+    },
+    close() {
+      stopped = true;
+      requests.forEach(req => req.destroy());
+      agent.destroy();
+    },
+  };
+}
+
+function percentile(values, p) {
+  return values.length ? values[Math.min(Math.floor(values.length * p / 100), values.length - 1)] : NaN;
+}
+
+async function run(name, mode, count) {
+  const child = fork(__filename, [SECONDS, BROWSERS.join(','), GAMES_PER_SECOND, '--server', name].map(String),
+    { execArgv: ['--expose-gc'] });
+  const { port } = await request(child, 'ready', 'port').catch(() => ({}));
+  const idle = (await request(child, 'idle', 'idle')).idle;
+  const seen = [];
+  const clients = browsers(port, count, mode.live, seen);
+  await clients.open();
+  // Let the reloads spread over their period
+  await sleep(mode.live ? 100 : RELOAD_MS);
+  const { started } = await request(child, 'start', 'started');
+  const from = seen.length;
+  await sleep(SECONDS * 1000);
+  const { stopped, writes } = await request(child, 'stop', 'stopped');
+  // The browsers show the last updates by their next reload, or the next read of the stream
+  await sleep((mode.live ? 0 : RELOAD_MS) + 2 * STREAM_POLL_MS);
+  clients.close();
+  child.send('exit');
+
+  // The latency of every update shown by every browser
+  const writtenAt = new Map(writes);
+  const latencies = [];
+  for (const [before, shown, at] of seen.slice(from)) {
+    for (let total = Math.max(before, 0) + 1; total <= shown; total++) {
+      if (writtenAt.has(total)) {
+        latencies.push(at - writtenAt.get(total));
+      }
+    }
+  }
+  latencies.sort((a, b) => a - b);
+  const seconds = (stopped.at - started.at) / 1000;
+  const cpu = (stopped.cpu.user + stopped.cpu.system - started.cpu.user - started.cpu.system) / 1e6 / seconds;
+  const memory = (started.memory.rss - idle.memory.rss) / count / 1024;
+  console.log(`${name.padStart(16)} | ${String(count).padStart(8)} | ${String(started.connected).padStart(9)} | ` +
+    `${memory.toFixed(1).padStart(11)} | ${(100 * cpu).toFixed(0).padStart(5)} | ` +
+    `${((stopped.pageViews - started.pageViews) / seconds).toFixed(0).padStart(12)} | ` +
+    `${((stopped.batchGet - started.batchGet) / seconds * 60).toFixed(0).padStart(15)} | ` +
+    `${((stopped.getRecords - started.getRecords) / seconds * 60).toFixed(0).padStart(16)} | ` +
+    `${String(writes.length).padStart(7)} | ${percentile(latencies, 50).toFixed(0).padStart(6)} | ` +
+    `${percentile(latencies, 99).toFixed(0).padStart(6)}`);
+}
+
+if (process.argv[5] === '--server') {
+  server(MODES[process.argv[6]]);
+} else {
+  (async () => {
+    console.log(`${SECONDS} s per run, ${GAMES_PER_SECOND} game results/s, reload every ${RELOAD_MS / 1000} s, ` +
+      `stream read every ${STREAM_POLL_MS / 1000} s`);
+    console.log(`${'mode'.padStart(16)} | browsers | connected | KiB/browser | CPU % | page views/s | ` +
+      `score reads/min | stream reads/min | updates | p50 ms | p99 ms`);
+    for (const count of BROWSERS) {
+      for (const [name, mode] of Object.entries(MODES)) {
+        await run(name, mode, count);
+      }
+    }
+  })();
+}
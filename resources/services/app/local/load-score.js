@@ -0,0 +1,152 @@
+#!/usr/bin/env node
+// Load test of the game score against a local DynamoDB stand-in
+//
+// Page views read the score while the state machine adds game results to it. The stand-in serves the requests to
+// each partition one after the other, at the per-partition throughput of DynamoDB, so that a hot item limits the
+// throughput as it does in the service. The test compares the single score item read on every page view with the
+// sharded counters read through the cache of the web application.
+//
+//     node resources/services/app/local/load-score.js [seconds] [page view workers] [game result workers]
+const { ScoreCache, scoreKeys, sumScores } = require('../score');
+
+const SECONDS = parseFloat(process.argv[2]) || 3;
+const READERS = parseInt(process.argv[3], 10) || 200;
+const WRITERS = parseInt(process.argv[4], 10) || 50;
+const SHARDS = 8;
+const TABLE_NAME = 'local';
+// Round trip to DynamoDB, and the time each partition spends on a request: 3000 reads or 1000 writes per second
+const NETWORK_MS = 4;
+const READ_MS = 1 / 3;
+const WRITE_MS = 1;
+// Time the web application spends rendering a page, besides reading the score
+const RENDER_MS = 2;
+
+const sleep = ms => new Promise(resolve => setTimeout(resolve, ms));
+
+class LocalDynamoDB {
+  constructor() {
+    this.items = new Map();
+    // Time at which each partition is done with the requests queued so far
+    this.busyUntil = new Map();
+    this.calls = { get: 0, batchGet: 0, update: 0 };
+  }
+
+  // Queue a request on the partition of a key, and return the time it is served
+  queue(pk, serviceMs) {
+    const start = Math.max(performance.now() + NETWORK_MS / 2, this.busyUntil.get(pk) || 0);
+    this.busyUntil.set(pk, start + serviceMs);
+    return start + serviceMs;
+  }
+
+  async respond(servedAt) {
+    await sleep(servedAt + NETWORK_MS / 2 - performance.now());
+  }
+
+  // The Document client methods used by the web application and the state machine, with their promise() interface
+  get(params) {
+    this.calls.get++;
+    const servedAt = this.queue(params.Key.pk, READ_MS);
+    return { promise: async () => {
+      await this.respond(servedAt);
+      const item = this.items.get(params.Key.pk);
+      return item ? { Item: { ...item } } : {};
+    } };
+  }
+
+  batchGet(params) {
+    this.calls.batchGet++;
+    const { Keys } = params.RequestItems[TABLE_NAME];
+    // The items are read in parallel from their partitions
+    const servedAt = Math.max(...Keys.map(key => this.queue(key.pk, READ_MS)));
+    return { promise: async () => {
+      await this.respond(servedAt);
+      const items = Keys.filter(key => this.items.has(key.pk)).map(key => ({ ...this.items.get(key.pk) }));
+      return { Responses: { [TABLE_NAME]: items }, UnprocessedKeys: {} };
+    } };
+  }
+
+  // Only the "ADD <attribute> :inc" update of the score
+  update(params) {
+    this.calls.update++;
+    const servedAt = this.queue(params.Key.pk, WRITE_MS);
+    return { promise: async () => {
+      await this.respond(servedAt);
+      const attribute = params.UpdateExpression.split(' ')[1];
+      const item = this.items.get(params.Key.pk) || { pk: params.Key.pk };
+      item[attribute] = (item[attribute] || 0) + params.ExpressionAttributeValues[':inc'];
+      this.items.set(params.Key.pk, item);
+      return {};
+    } };
+  }
+}
+
+const scenarios = {
+  'single item': {
+    readScore: db => async () => {
+      const data = await db.get({ TableName: TABLE_NAME, Key: { pk: 'score' } }).promise();
+      return data.Item || { won: 0, lost: 0 };
+    },
+    scoreKey: () => 'score',
+  },
+  'sharded, no cache': {
+    readScore: db => {
+      const cache = new ScoreCache(db, { tableName: TABLE_NAME, shards: SHARDS, ttlMs: 0 });
+      cache.get = () => cache.read();
+      return () => cache.get();
+    },
+    scoreKey: () => `score#${Math.floor(Math.random() * SHARDS)}`,
+  },
+  'sharded, cached': {
+    readScore: db => {
+      const cache = new ScoreCache(db, { tableName: TABLE_NAME, shards: SHARDS, ttlMs: 1000 });
+      return () => cache.get();
+    },
+    scoreKey: () => `score#${Math.floor(Math.random() * SHARDS)}`,
+  },
+};
+
+async function run(name, scenario) {
+  const db = new LocalDynamoDB();
+  const readScore = scenario.readScore(db);
+  const end = performance.now() + SECONDS * 1000;
+  const latencies = [];
+  let writes = 0;
+  const reader = async () => {
+    while (performance.now() < end) {
+      const start = performance.now();
+      await readScore();
+      latencies.push(performance.now() - start);
+      await sleep(RENDER_MS);
+    }
+  };
+  const writer = async () => {
+    while (performance.now() < end) {
+      const attribute = Math.random() < 0.5 ? 'won' : 'lost';
+      await db.update({
+        TableName: TABLE_NAME, Key: { pk: scenario.scoreKey() },
+        UpdateExpression: `ADD ${attribute} :inc`, ExpressionAttributeValues: { ':inc': 1 },
+      }).promise();
+      writes++;
+    }
+  };
+  await Promise.all([...Array(READERS)].map(reader).concat([...Array(WRITERS)].map(writer)));
+  const score = sumScores(scoreKeys(SHARDS).filter(key => db.items.has(key.pk)).map(key => db.items.get(key.pk)));
+  latencies.sort((a, b) => a - b);
+  console.log(`${name.padStart(18)}: ${(latencies.length / SECONDS).toFixed(0).padStart(7)} page views/s, ` +
+    `${(writes / SECONDS).toFixed(0).padStart(5)} game results/s, ` +
+    `page view p50 ${latencies[latencies.length >> 1].toFixed(1)} ms, ` +
+    `p99 ${latencies[Math.floor(latencies.length * 0.99)].toFixed(1)} ms, ` +
+    `DynamoDB calls ${JSON.stringify(db.calls)}` +
+    (score.won + score.lost === writes ? '' : `, SCORE MISMATCH ${score.won + score.lost} != ${writes}`));
+}
+
+if (require.main === module) {
+  (async () => {
+    console.log(`${SECONDS} s, ${READERS} page view workers, ${WRITERS} game result workers, ${SHARDS} shards`);
+    for (const [name, scenario] of Object.entries(scenarios)) {
+      await run(name, scenario);
+    }
+  })();
+}
+
+module.exports = { LocalDynamoDB, TABLE_NAME, SHARDS };
@@ -0,0 +1,109 @@
+// Game score read from the sharded counters of the DynamoDB table
+//
+// The state machine adds every game result to one of the 'score#<n>' items picked at random, so that the writes are
+// spread over several partitions. The score is the sum of these shards, plus the 'score' item which holds the results
+// counted before the sharding. The sum is cached in the process for a short time, and the page views arriving while it
+// is refreshed all wait for the same DynamoDB read.
+//
+// The shards also add up the probes of the application during the experiments, the failed ones and the time the
+// application was down, from which the availability of the application over all the games is shown.
+
+// The keys of the items holding the score
+function scoreKeys(shards) {
+  const keys = [{ pk: 'score' }];
+  for (let shard = 0; shard < shards; shard++) {
+    keys.push({ pk: `score#${shard}` });
+  }
+  return keys;
+}
+
+const COUNTERS = ['won', 'lost', 'probes', 'failedProbes', 'downtimeSeconds'];
+
+// Add up the counters of the score items, and compute the availability of the application, null before any probe
+function sumScores(items) {
+  const score = Object.fromEntries(COUNTERS.map(counter => [counter, 0]));
+  for (const item of items) {
+    for (const counter of COUNTERS) {
+      score[counter] += Number(item[counter] || 0);
+    }
+  }
+  score.availabilityPercent = score.probes
+    ? Math.round(10000 * (1 - score.failedProbes / score.probes)) / 100
+    : null;
+  return score;
+}
+
+class ScoreCache {
+  /**
+   * @param {object} documentClient The DynamoDB Document client, only its batchGet method is used
+   * @param {object} options tableName, shards: number of score shards, ttlMs: time the score is served from the
+   *                 cache, maxAttempts: number of BatchGetItem calls to read all the shards
+   */
+  constructor(documentClient, { tableName, shards = 8, ttlMs = 1000, maxAttempts = 3 }) {
+    this.documentClient = documentClient;
+    this.tableName = tableName;
+    this.keys = scoreKeys(shards);
+    this.ttlMs = ttlMs;
+    this.maxAttempts = maxAttempts;
+    this.score = null;
+    this.expiresAt = 0;
+    // The read in progress, shared by all the callers
+    this.refreshing = null;
+    this.stats = { hits: 0, coalesced: 0, reads: 0, errors: 0, stale: 0 };
+  }
+
+  /**
+   * The score, from the cache if it is fresh enough. If the DynamoDB read fails, the last score read is served
+   * instead, and the error is only thrown when there is none.
+   *
+   * @returns {Promise<{won: number, lost: number, probes: number, failedProbes: number, downtimeSeconds: number,
+   *                    availabilityPercent: ?number}>}
+   */
+  async get() {
+    if (this.score && Date.now() < this.expiresAt) {
+      this.stats.hits++;
+      return this.score;
+    }
+    if (this.refreshing) {
+      this.stats.coalesced++;
+    } else {
+      this.refreshing = this.read().finally(() => { this.refreshing = null; });
+    }
+    try {
+      return await this.refreshing;
+    } catch (err) {
+      if (this.score) {
+        this.stats.stale++;
+        return this.score;
+      }
+      throw err;
+    }
+  }
+
+  async read() {
+    this.stats.reads++;
+    const items = [];
+    let keys = this.keys;
+    try {
+      for (let attempt = 1; keys.length; attempt++) {
+        if (attempt > this.maxAttempts) {
+          throw new Error(`${keys.length} score items still unprocessed after ${this.maxAttempts} attempts`);
+        }
+        const data = await this.documentClient.batchGet({
+          RequestItems: { [this.tableName]: { Keys: keys } },
+        }).promise();
+        items.push(...((data.Responses || {})[this.tableName] || []));
+        const unprocessed = (data.UnprocessedKeys || {})[this.tableName];
+        keys = unprocessed ? unprocessed.Keys : [];
+      }
+    } catch (err) {
+      this.stats.errors++;
+      throw err;
+    }
+    this.score = sumScores(items);
+    this.expiresAt = Date.now() + this.ttlMs;
+    return this.score;
+  }
+}
+
+module.exports = { ScoreCache, scoreKeys, sumScores };
@@ -4,6 +4,9 @@ const express = require('express');
 const process = require('process');
 // Load the AWS SDK for Node.js
 let AWS = require("aws-sdk");
+const { ScoreCache } = require('./score');
+const { Leaderboard } = require('./leaderboard');
+const { LiveScore, ScoreStream } = require('./live-score');
 // Defines Port and Host of the app
 const PORT = parseInt(process.env.PORT, 10) || 3000;
 const HOST = process.env.HOST || 'localhost';
@@ -13,12 +16,36 @@ xray.config([xray.plugins.ECSPlugin]);
 // Create the DynamoDB Document client
 AWS.config.update({region: process.env.AWS_REGION});
 const ddbDocumentClient = new AWS.DynamoDB.DocumentClient();
-// Parameters for the DynamoDB GetItem operation to get the game score
-const ddbParams = {
-  TableName: process.env.TABLE_NAME,
-  Key: { pk: 'score' }
-};
-console.log('Dynamo DB query:', ddbParams);
+// The game score, summed over the score shards and cached for a short time
+const scoreCache = new ScoreCache(ddbDocumentClient, {
+  tableName: process.env.TABLE_NAME,
+  shards: parseInt(process.env.SCORE_SHARDS, 10) || 8,
+  ttlMs: parseInt(process.env.SCORE_CACHE_TTL_MS, 10) || 1000,
+});
+console.log('Score items:', scoreCache.keys.map(key => key.pk));
+// The top devices and players of the hour and of the day
+const leaderboard = new Leaderboard(ddbDocumentClient, {
+  tableName: process.env.TABLE_NAME,
+  indexName: process.env.LEADERBOARD_INDEX_NAME,
+  ttlMs: parseInt(process.env.LEADERBOARD_CACHE_TTL_MS, 10) || 5000,
+});
+
+// The score pushed to the browsers of the score page, read once per change of the score items in the table stream,
+// or at a fixed interval when the table has no stream
+const liveScore = new LiveScore(scoreCache, {
+  heartbeatMs: parseInt(process.env.SCORE_HEARTBEAT_MS, 10) || 15000,
+});
+let scoreStream = null;
+if (process.env.SCORE_STREAM_ARN) {
+  scoreStream = new ScoreStream(new AWS.DynamoDBStreams(), {
+    streamArn: process.env.SCORE_STREAM_ARN,
+    pollMs: parseInt(process.env.SCORE_STREAM_POLL_MS, 10) || 1000,
+    onChange: () => liveScore.changed(),
+  });
+  scoreStream.start();
+} else {
+  setInterval(() => liveScore.changed(), parseInt(process.env.SCORE_POLL_MS, 10) || 5000).unref();
+}
 
 // Start the EXPRESS server
 const app = express();
@@ -34,6 +61,11 @@ app.get('/health', (req, res) => {
   res.send({ status: 'healthy' });
 });
 
+// The score events, kept open as long as the page is shown, so outside of the X-Ray segments of the requests
+app.get('<APP-PATH>/score/events', (req, res) => {
+  liveScore.subscribe(req, res);
+});
+
 app.use(xray.express.openSegment('AwsChaosGameWebApplication'));
 // Use the local subdirectories as static resources
 app.use('<APP-PATH>/images', express.static('images'));
@@ -42,20 +74,25 @@ app.use('<APP-PATH>/css', express.static('css'));
 // this will accept all the calls to root URL http://localhost:3000/
 // It will render the index.html available in the Project root directory as a Response
 app.get('<APP-PATH>', (req,res) => {
-  //Read the score key from the DynamoDB Table
-  console.log('Reading the score from the DynamoDB Table');
-  ddbDocumentClient.get(ddbParams, function(err, data) {
-    if (err) {
-      console.log("Error", err);
-      res.render('pages/index', {won: '#', lost: '#'});
+  //Read the score from the cache, which reads the DynamoDB Table when it expired
+  scoreCache.get().then(score => {
+    res.render('pages/index', score);
+  }, err => {
+    console.log("Error", err);
+    res.render('pages/index', {won: '#', lost: '#', availabilityPercent: null});
+  });
+});
+// The top N of a leaderboard as JSON, e.g. <APP-PATH>/leaderboard?by=player&period=day&top=10
+app.get('<APP-PATH>/leaderboard', (req, res) => {
+  const top = Math.max(1, parseInt(req.query.top, 10) || 10);
+  leaderboard.top(req.query.by || 'device', req.query.period || 'day', top).then(board => {
+    res.send(board);
+  }, err => {
+    if (err instanceof RangeError) {
+      res.status(400).send({ error: err.message });
     } else {
-      console.log("Score data:", data.Item);
-      // If there is no Item in the response, then the score is not set yet, so set it to 0
-      if (data.Item) {
-        res.render('pages/index', {won: data.Item.won || 0, lost: data.Item.lost || 0});
-      } else {
-        res.render('pages/index', {won: 0, lost: 0});
-      }
+      console.log("Error", err);
+      res.status(503).send({ error: 'Leaderboard unavailable' });
     }
   });
 });
@@ -72,6 +109,11 @@ const server = app.listen(PORT, HOST, () => {
  */
 async function closeGracefully(signal) {
   console.info(`Received signal to terminate: ${signal}`);
+  // The browsers connect again to another task
+  if (scoreStream) {
+    scoreStream.stop();
+  }
+  liveScore.close();
   await server.close();
   // await other things we should clean up nicely
   process.exit();